@@ -0,0 +1,82 @@
+"""
+parse time of project yaml with pure python and libyaml loaders.
+
+    python benchmarks/yaml_load.py [project root] [-n rounds]
+
+without a project root a synthetic project of clusters, stacks and vars is generated
+"""
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import yaml
+
+
+def synthetic_project(root: str, clusters: int = 20, stacks: int = 10, modules: int = 15) -> None:
+    os.makedirs(os.path.join(root, "cluster"), exist_ok=True)
+    os.makedirs(os.path.join(root, "stack"), exist_ok=True)
+    for c in range(clusters):
+        data = {"name": f"c{c}", "vars": {f"v{i}": f"value-{i}" for i in range(50)},
+                "stacks": {f"s{s}": {"src": f"s{s}", "vars": {"replicas": s, "tags": [f"t{t}" for t in range(10)]}}
+                           for s in range(stacks)}}
+        with open(os.path.join(root, "cluster", f"c{c}.yaml"), "w") as f:
+            yaml.safe_dump(data, f)
+    for s in range(stacks):
+        data = {"name": f"s{s}", "modules": {
+            f"m{m}": {"src": f"core:m{m}", "deps": [f"m{d}" for d in range(m)],
+                      "vars": {f"k{k}": {"a": k, "b": [1, 2, 3], "c": "text " * 5} for k in range(20)}}
+            for m in range(modules)}}
+        os.makedirs(os.path.join(root, "stack", f"s{s}"), exist_ok=True)
+        with open(os.path.join(root, "stack", f"s{s}", "stack.yaml"), "w") as f:
+            yaml.safe_dump(data, f)
+
+
+def project_files(root: str) -> list[str]:
+    files = []
+    for pattern in ("stackd.yaml", "cluster/*.yaml", "stack/**/*.yaml", "vars/**/*.yaml"):
+        files.extend(glob.glob(os.path.join(root, pattern), recursive=True))
+    return files
+
+
+def bench(sources: list[str], loader, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for src in sources:
+            try:
+                yaml.load(src, Loader=loader)
+            except yaml.constructor.ConstructorError:
+                pass # !include and other project tags are not registered here
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", nargs="?")
+    parser.add_argument("-n", "--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.root or tmp
+        if not args.root:
+            synthetic_project(root)
+        sources = []
+        for path in project_files(root):
+            with open(path) as f:
+                sources.append(f.read())
+
+    size = sum(len(s) for s in sources)
+    print(f"{len(sources)} files, {size / 1024:.0f} KiB, {args.rounds} rounds")
+    pure = bench(sources, yaml.SafeLoader, args.rounds)
+    print(f"SafeLoader  {pure:.3f}s")
+    if not yaml.__with_libyaml__:
+        print("pyyaml is built without libyaml, stackd falls back to SafeLoader")
+        return
+    fast = bench(sources, yaml.CSafeLoader, args.rounds)
+    print(f"CSafeLoader {fast:.3f}s ({pure / fast:.1f}x, {pure - fast:.3f}s saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Callable
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, parse_obj_as
+
+from . import metrics
+from .fields import dump, selection
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized response bodies keyed by request and build fingerprint.
+    stale entries are never invalidated explicitly: a changed build gets a new fingerprint
+    and old entries fall out of the LRU
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            body = self._data.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        metrics.CACHE.labels(cache="response", result="miss" if body is None else "hit").inc()
+        return body
+
+    def put(self, key: tuple, body: bytes) -> None:
+        with self._lock:
+            self._data[key] = body
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+response_cache = ResponseCache()
+
+
+def _prepare(content: Any) -> Any:
+    # same conversion fastapi applies before validating against response_model
+    if isinstance(content, BaseModel):
+        # BaseModel.dict leaves lazy mappings (clusters of Stackd) as is
+        return _prepare(content.dict(by_alias=True))
+    if isinstance(content, list):
+        return [ _prepare(c) for c in content ]
+    if isinstance(content, Mapping):
+        return { k: _prepare(v) for k, v in content.items() }
+    return content
+
+
+def serialize(content: Any, response_model: Any, fields: str | None = None) -> bytes:
+    """
+    serializes content the way fastapi does for response_model routes.
+    with fields only selected sub-trees are walked and response_model validation is skipped
+    """
+    mask = selection(response_model, fields)
+    if mask is None:
+        value = jsonable_encoder(parse_obj_as(response_model, _prepare(content)), by_alias=True)
+    else:
+        value = jsonable_encoder(dump(content, mask))
+    return json.dumps(value, ensure_ascii=False,
+                      allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [ t.strip() for t in header.split(",") ]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def etag_response(request: Request, fingerprint: str, response_model: Any,
+                  content: Callable[[], Any], fields: str | None = None) -> Response:
+    """
+    answers If-None-Match with 304 and serves unchanged bodies from response_cache.
+    content is called only on cache miss
+    """
+    if fields:
+        # validate selection before answering 304; each selection is separate representation
+        selection(response_model, fields)
+        fingerprint = hashlib.sha256(f"{fingerprint}\0{fields}".encode()).hexdigest()
+    etag = f'"{fingerprint}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    key = (request.url.path, str(request.query_params), fingerprint)
+    body = response_cache.get(key)
+    if body is None:
+        body = serialize(content(), response_model, fields=fields)
+        response_cache.put(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
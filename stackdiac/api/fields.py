@@ -0,0 +1,128 @@
+# field selection for large responses: ?fields=name,stacks.*.vars
+
+import functools
+import types
+import typing
+from collections.abc import Mapping
+from typing import Any
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+ALL = "__all__"
+
+Mask = dict[str, Any] | bool
+
+
+@functools.lru_cache(maxsize=None)
+def model_mask(tp: Any) -> Mask:
+    """
+    include mask with every field declared by response model type.
+    True marks plain data (Any, dicts of scalars, ...), dumped as is
+    """
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+    if origin in (typing.Union, types.UnionType):
+        models = [ a for a in args if a is not type(None) ]
+        return model_mask(models[0]) if len(models) == 1 else True
+    if origin in (list, set, tuple) and args:
+        sub = model_mask(args[0])
+        return True if sub is True else {ALL: sub}
+    if origin is dict and len(args) == 2:
+        sub = model_mask(args[1])
+        return True if sub is True else {ALL: sub}
+    if isinstance(tp, type) and issubclass(tp, BaseModel):
+        return { name: model_mask(f.outer_type_) for name, f in tp.__fields__.items() }
+    return True
+
+
+def _merge(a: Mask, b: Mask) -> Mask:
+    if a is True or b is True:
+        return True
+    out = dict(a)
+    for k, v in b.items():
+        out[k] = _merge(out[k], v) if k in out else v
+    return out
+
+
+def _field_name(model_type: Any, name: str) -> str:
+    # accept serialized aliases, e.g. `schema` for Stack.stack_schema
+    if isinstance(model_type, type) and issubclass(model_type, BaseModel):
+        for fname, f in model_type.__fields__.items():
+            if f.alias == name:
+                return fname
+    return name
+
+
+def _select(mask: Mask, tp: Any, parts: list[str], path: str) -> Mask:
+    if not parts:
+        return mask
+    head, rest = parts[0], parts[1:]
+    if mask is True:
+        # free-form data: select dict keys without type knowledge
+        return {head: _select(True, Any, rest, path)}
+    if ALL in mask:
+        key = ALL if head in ("*", ALL) else head
+        return {key: _select(mask[ALL], _item_type(tp), rest, path)}
+    name = _field_name(tp, head)
+    if name not in mask:
+        raise HTTPException(status_code=400, detail=f"unknown field {head} in {path}")
+    return {name: _select(mask[name], _field_type(tp, name), rest, path)}
+
+
+def _item_type(tp: Any) -> Any:
+    args = typing.get_args(tp)
+    return args[-1] if args else Any
+
+
+def _field_type(tp: Any, name: str) -> Any:
+    origin = typing.get_origin(tp)
+    if origin is not None and origin not in (list, dict, set, tuple):
+        models = [ a for a in typing.get_args(tp) if a is not type(None) ]
+        tp = models[0] if len(models) == 1 else Any
+    if isinstance(tp, type) and issubclass(tp, BaseModel):
+        return tp.__fields__[name].outer_type_
+    return Any
+
+
+def selection(response_model: Any, fields: str | None) -> Mask | None:
+    """
+    parses comma separated dotted paths into include mask limited to response model fields.
+    `*` selects every item of dict or list
+    """
+    if not fields:
+        return None
+    if typing.get_origin(response_model) is list:
+        # paths of list responses address items
+        return {ALL: selection(typing.get_args(response_model)[0], fields)}
+    full = model_mask(response_model)
+    mask: Mask = {}
+    for path in [ p.strip() for p in fields.split(",") if p.strip() ]:
+        mask = _merge(mask, _select(full, response_model, path.split("."), path))
+    return mask
+
+
+def dump(value: Any, mask: Mask) -> Any:
+    """
+    walks only selected sub-trees of value
+    """
+    if mask is True or value is None:
+        return value
+    if isinstance(value, BaseModel):
+        return { value.__fields__[name].alias: dump(getattr(value, name), sub)
+                 for name, sub in mask.items() if name in value.__fields__ }
+    if isinstance(value, Mapping):
+        if ALL in mask:
+            return { k: dump(v, _merge(mask[ALL], mask[k]) if k in mask else mask[ALL]) for k, v in value.items() }
+        return { k: dump(value[k], sub) for k, sub in mask.items() if k in value }
+    if isinstance(value, (list, tuple)):
+        sub = mask.get(ALL, True)
+        return [ dump(v, sub) for v in value ]
+    return value
+
+
+def field_selection(fields: str | None = None, include: str | None = None) -> str | None:
+    """
+    request dependency: `fields` and `include` query params are synonyms
+    """
+    return ",".join(f for f in (fields, include) if f) or None
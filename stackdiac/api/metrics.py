@@ -0,0 +1,215 @@
+# prometheus metrics registry and /metrics endpoint
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
+from .server import app
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# seconds, from api calls to cluster builds and terragrunt runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [ f'{n}="{_escape(v)}"' for n, v in zip(names, values) ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+
+class _Value:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> list[str]:
+        return [ f"{self.name}_total{_labels(self.labelnames, k)} {_value(c.value)}" for k, c in sorted(self._children.items()) ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def samples(self) -> list[str]:
+        return [ f"{self.name}{_labels(self.labelnames, k)} {_value(c.value)}" for k, c in sorted(self._children.items()) ]
+
+
+class _Buckets:
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for k, h in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, float("inf")], h.counts):
+                cumulative += count
+                le = 'le="' + _value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_value(h.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, k)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter("stackd_http_requests", "API requests", ("method", "route", "status")))
+HTTP_DURATION = registry.register(Histogram("stackd_http_request_duration_seconds", "API request latency", ("method", "route")))
+BUILDS = registry.register(Counter("stackd_builds", "Stackd.build calls"))
+BUILD_DURATION = registry.register(Histogram("stackd_build_duration_seconds", "Stackd.build duration"))
+BUILT = registry.register(Counter("stackd_built", "clusters, stacks and modules built", ("kind",)))
+CLUSTER_BUILD_DURATION = registry.register(Histogram("stackd_cluster_build_duration_seconds", "cluster build duration", ("cluster",)))
+CACHE = registry.register(Counter("stackd_cache_lookups", "cache lookups by cache and result", ("cache", "result")))
+VAULT_REQUESTS = registry.register(Counter("stackd_vault_requests", "vault calls by operation and result", ("operation", "result")))
+VAULT_DURATION = registry.register(Histogram("stackd_vault_request_duration_seconds", "vault call latency", ("operation",)))
+TERRAGRUNT_RUNS = registry.register(Counter("stackd_terragrunt_runs", "terragrunt runs by command and exit code", ("command", "returncode")))
+TERRAGRUNT_DURATION = registry.register(Histogram("stackd_terragrunt_duration_seconds", "terragrunt run duration", ("command",)))
+TERRAFORM_INITS = registry.register(Counter("stackd_terraform_inits", "module inits run or skipped by init cache", ("result",)))
+
+
+@contextmanager
+def vault_call(operation: str):
+    """
+    times vault call, result label is ok or exception class name
+    """
+    start = time.perf_counter()
+    result = "ok"
+    try:
+        yield
+    except Exception as e:
+        result = type(e).__name__
+        raise
+    finally:
+        VAULT_DURATION.labels(operation=operation).observe(time.perf_counter() - start)
+        VAULT_REQUESTS.labels(operation=operation, result=result).inc()
+
+
+def terragrunt_command(options: list[str]) -> str:
+    return next((o for o in options if not o.startswith("-")), "")
+
+
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # route template keeps label cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_DURATION.labels(method=request.method, route=path).observe(time.perf_counter() - start)
+        HTTP_REQUESTS.labels(method=request.method, route=path, status=status).inc()
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
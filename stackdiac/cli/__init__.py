@@ -5,6 +5,12 @@ import os, sys
 import yaml
 
 from stackdiac.stackd import sd, ProcessException
+from stackdiac.stackd.graph import ModuleGraph
+from stackdiac.stackd import runall
+from stackdiac.stackd.plancache import PlanCache
+from stackdiac.stackd.affected import affected_targets, update_index
+from stackdiac.stackd.watch import Target
+from stackdiac.stackd.workqueue import WorkQueue
 
 logger = logging.getLogger(__name__)
 
@@ -40,19 +46,126 @@ def cli():
 from .create import create
 from .build import build
 from .ui import ui
+from .warm import warm
+from .affected import affected
+from .graph import graph
+from .bundle import bundle, materialize
+from .worker import worker
+from .query import query
+from .secrets import secrets
 
 cli.add_command(create)
 cli.add_command(build)
 cli.add_command(update)
 cli.add_command(ui)
+cli.add_command(warm)
+cli.add_command(affected)
+cli.add_command(graph)
+cli.add_command(bundle)
+cli.add_command(materialize)
+cli.add_command(worker)
+cli.add_command(query)
+cli.add_command(secrets)
+
+
+def _print_module_run(r):
+    click.echo(f"=== {r.id}: {r.status} rc={r.returncode} {r.duration:.2f}s")
+    if os.path.isfile(r.log_file) and r.status not in ("skipped", "unchanged"):
+        with open(r.log_file) as f:
+            click.echo(f.read(), nl=False)
+
+
+def tg_run_all(target, terragrunt_options, jobs, skip_unchanged=False, since=None, distributed=False):
+    """
+    target is <cluster>[/<stack>[/<module>]]
+    """
+    parts = [ p for p in target.split("/") if p ]
+    cluster_name, stack, module = (parts + [None, None])[:3]
+    sd.build(cluster=cluster_name, streaming=True)
+    cluster_graph = ModuleGraph.from_cluster(sd.clusters[cluster_name], sd)
+    graph = cluster_graph.select(stack=stack, module=module)
+    if not len(graph):
+        logger.error(f"no modules found for {target}")
+        sys.exit(1)
+    try:
+        graph.topological_order()
+    except ValueError as e:
+        logger.error(f"cannot run {target}: {e}")
+        sys.exit(1)
+    if since:
+        # changed modules and everything depending on them
+        index = update_index(sd)
+        # whole cluster or stack targets select every module of it
+        targets = [ t for t in affected_targets(sd, index, since) if t.cluster == cluster_name ]
+        selected = { i for i, n in graph.nodes.items()
+                     if any(t.covers(Target(cluster=cluster_name, stack=n.stack, module=n.module)) for t in targets) }
+        dependents = graph.dependents()
+        queue = [ i for i in selected if i in graph.nodes ]
+        while queue:
+            for d in dependents[queue.pop()]:
+                if d not in selected:
+                    selected.add(d)
+                    queue.append(d)
+        graph = graph.subgraph([ i for i in graph.nodes if i in selected ])
+        if not len(graph):
+            logger.info(f"no modules of {target} affected since {since}")
+            return
+    terragrunt_options = [*terragrunt_options]
+    run_kwargs = dict(on_finish=_print_module_run)
+    queue = WorkQueue(WorkQueue.default_path(sd)) if distributed else None
+
+    if skip_unchanged:
+        if terragrunt_options[:1] != ["plan"]:
+            logger.error("--skip-unchanged works with plan only")
+            sys.exit(1)
+        if "-detailed-exitcode" not in terragrunt_options:
+            terragrunt_options.append("-detailed-exitcode")
+        plan_cache = PlanCache(sd, cluster_name, graph=cluster_graph)
+
+        def on_finish(r):
+            # only clean plans (no changes) are remembered
+            if r.returncode == 0:
+                plan_cache.record(graph.nodes[r.id])
+            elif r.status != "unchanged":
+                plan_cache.forget(graph.nodes[r.id])
+            _print_module_run(r)
+
+        run_kwargs = dict(on_finish=on_finish, unchanged=plan_cache.unchanged, ok_returncodes=(0, 2))
+
+    logger.info(f"running terragrunt {' '.join(terragrunt_options)} on {len(graph)} modules of {target}, {jobs} at once"
+                + (f" on workers of {queue.path}" if queue else ""))
+
+    runs = runall.run_all(sd, graph, terragrunt_options, jobs=jobs, queue=queue, **run_kwargs)
+
+    if skip_unchanged:
+        plan_cache.save()
+
+    for r in runs:
+        log = logger.info if r.status in ("ok", "unchanged") else logger.error
+        log(f"{r.id}: {r.status} rc={r.returncode} {r.duration:.2f}s {r.log_file}" + (f" {r.error}" if r.error else ""))
+    if any(r.status not in ("ok", "unchanged") for r in runs):
+        sys.exit(1)
 
 
 @click.command(context_settings={"ignore_unknown_options": True}, name="tg")
 @click.option("-b", "--build", is_flag=True, help="deprecated, always building")
+@click.option("-j", "--jobs", default=1, show_default=True, help="modules run at once when target is <cluster>[/<stack>]")
+@click.option("--skip-unchanged", is_flag=True,
+              help="plan only modules whose build or backend state changed since last clean plan")
+@click.option("--since", default=None,
+              help="run only modules affected by changes since git ref and their dependents, with <cluster>[/<stack>] target")
+@click.option("--distributed", is_flag=True,
+              help="queue modules for `stackd worker` processes instead of running them here, with <cluster>[/<stack>] target")
 @click.argument("target")
 @click.argument("terragrunt_options", nargs=-1)
-def tg(target, terragrunt_options, **kwargs):
+def tg(target, terragrunt_options, jobs, skip_unchanged, since, distributed, **kwargs):
+    """
+    target is built module path or <cluster>[/<stack>] to run command on every module in dependency order
+    """
     sd.configure()
+    if not os.path.isdir(target) and target.split("/")[0] in sd.clusters:
+        tg_run_all(target, terragrunt_options, jobs, skip_unchanged=skip_unchanged, since=since, distributed=distributed)
+        return
     sd.build()
     try:
         sd.terragrunt(target, [*terragrunt_options], **kwargs)
@@ -64,9 +177,21 @@ cli.add_command(tg)
 
 @click.command(context_settings={"ignore_unknown_options": True}, name="op")
 @click.option("-b", "--build", is_flag=True, help="deprecated, always building")
+@click.option("--distributed", is_flag=True, help="run pipeline steps on `stackd worker` processes")
 @click.argument("target")
-def op(target, build:bool, **kwargs):
+def op(target, build:bool, distributed:bool, **kwargs):
     sd.configure()    
-    sd.run_operation(target=target, **kwargs)
+    if not distributed:
+        sd.run_operation(target=target, **kwargs)
+        return
+    queue = WorkQueue(WorkQueue.default_path(sd))
+    try:
+        sd.run_operation(target=target, queue=queue, **kwargs)
+    except KeyboardInterrupt:
+        queue.cancel()
+        raise
+    except ProcessException as e:
+        logger.error(f"operation failed: {e}")
+        sys.exit(1)
 
 cli.add_command(op)
\ No newline at end of file
@@ -0,0 +1,29 @@
+import click
+import json
+import logging
+from stackdiac.stackd import sd
+from stackdiac.stackd.affected import ReadIndex, affected_targets, update_index
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option("--since", required=True, help="git ref to compare working tree with")
+@click.option("--no-build", is_flag=True, help="use read index of last build instead of building")
+@click.option("--json", "as_json", is_flag=True, help="print json list")
+def affected(since, no_build, as_json, **kwargs):
+    """
+    print <cluster>/<stack>/<module> targets reading files changed since git ref
+    """
+    sd.configure()
+    index = ReadIndex.load(sd) if no_build else None
+    if index is None:
+        sd.build(cluster="all", stack="all", streaming=True)
+        index = update_index(sd, replace=True)
+
+    targets = [ str(t) for t in affected_targets(sd, index, since) ]
+    if as_json:
+        click.echo(json.dumps(targets))
+    else:
+        for t in targets:
+            click.echo(t)
@@ -4,13 +4,23 @@ import logging
 import os
 from stackdiac.stackd import stackd
 from stackdiac.stackd import sd
+from stackdiac.stackd.watch import ChangePlan, rebuild, watch
+from stackdiac.stackd.affected import ReadIndex, affected_targets, update_index
+from stackdiac.stackd.index import update_build_index
 
 logger = logging.getLogger(__name__)
 
 
 @click.command()
 @click.option("-t", "--target", help="build only target cluster:[stack]", default=None, show_default=True)
-def build(target, **kwargs):
+@click.option("--streaming/--no-streaming", default=True, show_default=True,
+              help="release each module after writing its artifacts, keeping only build records")
+@click.option("-w", "--watch", "watch_mode", is_flag=True, help="rebuild affected clusters, stacks and modules on file changes")
+@click.option("--debounce", help="seconds without changes before rebuild in watch mode", default=0.2, show_default=True)
+@click.option("--poll", is_flag=True, help="poll for changes instead of inotify in watch mode")
+@click.option("--validate-secrets", is_flag=True, help="read existing typed module secrets and validate them against their schema")
+@click.option("--since", default=None, help="build only modules reading files changed since git ref, by read index of last build")
+def build(target, watch_mode, debounce, poll, since, **kwargs):
     only = target
     if only:
         ondata = only.split(":")
@@ -25,5 +35,30 @@ def build(target, **kwargs):
         cluster = "all"
         stack = "all"
     sd.configure()
-    sd.build(cluster=cluster, stack=stack, **kwargs)
+    index = ReadIndex.load(sd) if since else None
+    if index is not None:
+        plan = ChangePlan()
+        for t in affected_targets(sd, index, since):
+            if cluster in ("all", t.cluster) and (stack == "all" or t.stack in (None, stack)):
+                plan.add(t)
+        logger.info(f"building {len(plan.targets)} targets affected since {since}")
+        rebuild(sd, plan, index=index)
+        index.save(sd)
+        update_build_index(sd)
+    else:
+        if since:
+            logger.info("no read index yet, building everything")
+        sd.build(cluster=cluster, stack=stack, **kwargs)
+        index = update_index(sd, replace=(cluster == "all" and stack == "all"))
+        update_build_index(sd)
+        if cluster == "all" and stack == "all":
+            logger.debug(f"pruned {sd.blobs.prune()} unused blobs")
+
+    if watch_mode:
+        def on_rebuild(targets, duration):
+            logger.info(f"rebuilt {', '.join(str(t) for t in targets) or 'nothing'} in {duration:.3f}s")
+        try:
+            watch(sd, debounce=debounce, polling=poll, on_rebuild=on_rebuild, index=index)
+        except KeyboardInterrupt:
+            pass
     
@@ -0,0 +1,36 @@
+import click
+import logging
+import os
+from stackdiac.stackd import sd
+from stackdiac.models.blobstore import BlobStore
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option("-o", "--output", default=None, help="archive path, <cluster>.bundle.tar.gz by default")
+@click.argument("cluster")
+def bundle(cluster, output, **kwargs):
+    """
+    builds cluster and exports its build dir as deduplicated archive with manifest
+    """
+    sd.configure()
+    sd.build(cluster=cluster, streaming=True)
+    output = os.path.abspath(output or f"{cluster}.bundle.tar.gz")
+    manifest = sd.blobs.bundle(os.path.join(sd.builddir, cluster), output,
+                               cluster=cluster, project=sd.conf.project.name, builddir=sd.builddir)
+    logger.info(f"{output}: {len(manifest['files'])} files, {manifest['blobs']} blobs, {manifest['size']} bytes")
+
+
+@click.command()
+@click.option("-d", "--dest", default=None, help="directory for cluster files, build/<cluster> by default")
+@click.option("--store", default=os.path.join(".stackd", "cache", "blobs"), show_default=True, help="blob store directory")
+@click.argument("archive")
+def materialize(archive, dest, store, **kwargs):
+    """
+    links files of bundle into dest, blobs already in store are not unpacked again
+    """
+    blobs = BlobStore(store)
+    manifest = blobs.materialize(archive, dest or os.path.join("build", BlobStore.read_manifest(archive)["cluster"]))
+    logger.info(f"materialized {len(manifest['files'])} files of {manifest['cluster']}")
+
@@ -0,0 +1,50 @@
+import click
+import json
+import logging
+import sys
+from stackdiac.stackd import sd
+from stackdiac.stackd.graph import ModuleGraph, StepTimings
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option("-f", "--format", "output_format", type=click.Choice(["text", "dot", "json"]), default="text", show_default=True)
+@click.option("-c", "--command", default="apply", show_default=True, help="terragrunt command whose recorded timings are used")
+@click.option("-o", "--output", default=None, help="write graph to file instead of stdout")
+@click.argument("cluster")
+def graph(cluster, output_format, command, output, **kwargs):
+    """
+    module dependency graph of cluster with cycles, dangling deps and critical path by recorded timings
+    """
+    sd.configure()
+    sd.build(cluster=cluster, streaming=True)
+    module_graph = ModuleGraph.from_cluster(sd.clusters[cluster], sd)
+    durations = StepTimings(sd, cluster).durations(command)
+    report = module_graph.analyze(durations)
+
+    if output_format == "dot":
+        result = module_graph.to_dot(durations, highlight=report.critical_path)
+    elif output_format == "json":
+        result = json.dumps(dict(graph=module_graph.to_json(), report=report.dict()), indent=2) + "\n"
+    else:
+        lines = [f"{report.modules} modules, {report.edges} dependencies"]
+        lines += [ f"cycle: {' -> '.join([*c, c[0]])}" for c in report.cycles ]
+        lines += [ f"dangling: {m} -> {d}" for m, d in report.dangling ]
+        if report.critical_time:
+            lines.append(f"critical path ({command}): " + " -> ".join(
+                f"{i} {durations[i]:.1f}s" if i in durations else i for i in report.critical_path))
+            lines.append(f"critical time {report.critical_time:.1f}s, serial time {report.serial_time:.1f}s"
+                         + (f", speedup up to {report.speedup:.2f}x" if report.speedup else ""))
+        if report.untimed:
+            lines.append(f"no {command} timings for {len(report.untimed)} modules")
+        result = "\n".join(lines) + "\n"
+
+    if output:
+        with open(output, "w") as f:
+            f.write(result)
+    else:
+        click.echo(result, nl=False)
+
+    if not report.valid:
+        sys.exit(1)
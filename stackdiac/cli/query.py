@@ -0,0 +1,61 @@
+import click
+import json
+import logging
+import os
+import sys
+from stackdiac.stackd import Stackd
+from stackdiac.stackd.index import BuildIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _index() -> BuildIndex:
+    path = BuildIndex.default_path(Stackd())
+    if not os.path.isfile(path):
+        logger.error(f"{path} not found, run stackd build first")
+        sys.exit(1)
+    return BuildIndex(path)
+
+
+@click.group()
+def query():
+    """
+    answers from index of last build in .stackd/index.db, project is not configured nor built
+    """
+
+
+@query.command()
+@click.option("-c", "--cluster", default=None)
+@click.option("-s", "--stack", default=None)
+@click.option("--var", default=None, help="modules getting var")
+@click.option("--secret", default=None, help="modules declaring secret")
+@click.option("--has-secrets", is_flag=True, help="modules declaring any secret")
+@click.option("--depends-on", default=None, help="modules depending on <stack>/<module>")
+@click.option("--paths", is_flag=True, help="print build paths")
+def modules(cluster, stack, var, secret, has_secrets, depends_on, paths, **kwargs):
+    for m in _index().modules(cluster=cluster, stack=stack, var=var, secret=secret,
+                              has_secrets=has_secrets, depends_on=depends_on):
+        click.echo(m["build_path"] if paths else f"{m['cluster']}/{m['stack']}/{m['name']}")
+
+
+@query.command()
+@click.argument("target")
+def module(target, **kwargs):
+    """
+    target is <cluster>/<stack>/<module>, prints its build path, vars, deps, secrets and timings as json
+    """
+    result = _index().module(*target.split("/"))
+    if result is None:
+        logger.error(f"{target} is not indexed")
+        sys.exit(1)
+    click.echo(json.dumps(result, indent=2))
+
+
+@query.command()
+@click.argument("statement")
+def sql(statement, **kwargs):
+    """
+    read only sql over tables clusters, stacks, modules, vars, deps, secrets and timings
+    """
+    for row in _index().query(statement):
+        click.echo(json.dumps(row))
@@ -0,0 +1,57 @@
+import click
+import logging
+import os
+import sys
+from stackdiac.stackd import sd
+from stackdiac.stackd.secrets import SecretsDocument, export_secrets, import_secrets
+
+logger = logging.getLogger(__name__)
+
+
+def _report(results) -> None:
+    for r in results:
+        log = logger.error if r.status in ("failed", "invalid") else logger.info
+        log(f"{r.key}: {r.status}" + (f" version {r.version}" if r.version else "") + (f" {r.error}" if r.error else ""))
+    if any(r.status in ("failed", "invalid") for r in results):
+        sys.exit(1)
+
+
+@click.group()
+def secrets():
+    """
+    bulk export and import of module secrets in vault
+    """
+
+
+@secrets.command(name="export")
+@click.option("-s", "--stack", default=None)
+@click.option("-o", "--output", default=None, help="json file, stdout by default")
+@click.option("-j", "--jobs", default=8, show_default=True, help="vault calls at once")
+@click.argument("cluster")
+def export_(cluster, stack, output, jobs, **kwargs):
+    """
+    writes every module secret of cluster as one json document. it holds secret values in plain text
+    """
+    sd.configure()
+    document = export_secrets(sd, cluster, stack=stack, jobs=jobs)
+    content = document.json(exclude={"results"}, indent=2)
+    if output:
+        with open(os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(content)
+    else:
+        click.echo(content)
+    logger.info(f"exported {len(document.secrets)} secrets of {cluster}")
+    _report([ r for r in document.results if r.status == "failed" ])
+
+
+@secrets.command(name="import")
+@click.option("-c", "--cluster", default=None, help="target cluster, cluster of document by default")
+@click.option("-s", "--stack", default=None, help="import only secrets of stack")
+@click.option("-j", "--jobs", default=8, show_default=True, help="vault calls at once")
+@click.argument("document")
+def import_(document, cluster, stack, jobs, **kwargs):
+    """
+    writes secrets of exported document into cluster, reports result per secret
+    """
+    sd.configure()
+    _report(import_secrets(sd, SecretsDocument.parse_file(document), cluster=cluster, stack=stack, jobs=jobs))
@@ -3,6 +3,7 @@ import logging
 import os
 import uvicorn
 from stackdiac.stackd import sd
+from stackdiac.stackd.jobs import configure_jobs
 from stackdiac.api import app
 
 logger = logging.getLogger(__name__)
@@ -11,6 +12,8 @@ logger = logging.getLogger(__name__)
 @click.command()
 @click.option("-H", "--host", help="host http server listen to", default="0.0.0.0", show_default=True)
 @click.option("-P", "--port", help="port http server listen to", default=8000, show_default=True)
-def ui(host, port, **kwargs):
+@click.option("-j", "--job-workers", help="max jobs running at once", default=4, show_default=True)
+def ui(host, port, job_workers, **kwargs):
     sd.configure()
+    configure_jobs(root=sd.root, max_workers=job_workers)
     uvicorn.run(app, host=host, port=port)
\ No newline at end of file
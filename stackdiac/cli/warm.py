@@ -0,0 +1,34 @@
+
+import click
+import logging
+import sys
+from stackdiac.stackd import sd
+from stackdiac.stackd.warm import ProviderMirror, collect_providers
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option("-j", "--jobs", help="concurrent provider downloads", default=4, show_default=True)
+@click.option("-m", "--mirror", help="filesystem mirror directory [default: .stackd/cache/terraform-mirror]", default=None)
+@click.option("--from", "source", help="copy providers from local filesystem mirror instead of registry", default=None)
+@click.option("--platform", help="provider platform", default="linux_amd64", show_default=True)
+def warm(jobs, mirror, source, platform, **kwargs):
+    """
+    download every provider used by project into filesystem mirror
+    """
+    sd.configure()
+    requirements = collect_providers(sd)
+    logger.info(f"warming {len(requirements)} providers")
+
+    provider_mirror = ProviderMirror(sd, path=mirror, source=source, platform=platform)
+    results = provider_mirror.warm(requirements, jobs=jobs)
+
+    for r in results:
+        logger.info(f"{r.requirement.address} {r.requirement.version}: {r.status} {r.version or r.error or ''}")
+
+    if any(r.status != "failed" for r in results):
+        logger.info(f"terraform cli config saved to {provider_mirror.write_cli_config(results)}")
+
+    if any(r.status == "failed" for r in results):
+        sys.exit(1)
@@ -0,0 +1,29 @@
+import click
+import logging
+import signal
+import sys
+from stackdiac.stackd import sd
+from stackdiac.stackd.workqueue import WorkQueue, work
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option("-q", "--queue", "queue_path", default=None, help="queue database, .stackd/queue.db by default")
+@click.option("-n", "--name", default=None, help="worker name, <host>:<pid> by default")
+@click.option("--lease", default=60.0, show_default=True, help="seconds a claimed step is held without heartbeat")
+@click.option("--poll", default=1.0, show_default=True, help="seconds between polls of empty queue")
+@click.option("--once", is_flag=True, help="exit when queue is empty")
+def worker(queue_path, name, lease, poll, once, **kwargs):
+    """
+    runs terragrunt steps queued by `stackd tg --distributed` and `stackd op --distributed`
+    """
+    sd.configure()
+    queue = WorkQueue(queue_path or WorkQueue.default_path(sd), lease=lease, poll=poll)
+    # running step is terminated and returned to queue on stop
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(143))
+    try:
+        count = work(sd, queue, worker=name, once=once)
+    except KeyboardInterrupt:
+        return
+    logger.info(f"queue is empty, {count} steps run")
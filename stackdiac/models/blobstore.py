@@ -0,0 +1,182 @@
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+class BlobStore:
+    """
+    content addressed files in <root>/<2 hex>/<sha256>, linked into build dir.
+    files are never written through links, build replaces them with new links
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._hardlinks = True
+
+    def path(self, blob: str) -> str:
+        return os.path.join(self.root, blob[:2], blob)
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def put(self, data: bytes) -> str:
+        blob = self.hash(data)
+        path = self.path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return blob
+
+    def link(self, blob: str, dest: str) -> None:
+        """
+        places blob at dest, unchanged dest is left as is
+        """
+        path = self.path(blob)
+        try:
+            if os.path.samefile(path, dest):
+                return
+        except FileNotFoundError:
+            pass
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        copy = not self._hardlinks
+        if not copy:
+            try:
+                os.link(path, tmp)
+            except OSError as e:
+                if e.errno == errno.EMLINK:
+                    # link limit of this blob reached
+                    copy = True
+                elif e.errno in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+                    # store and build dir on different filesystems or no hardlink support
+                    logger.debug(f"hardlinks unavailable in {os.path.dirname(dest)}: {e}, copying blobs")
+                    self._hardlinks = False
+                    copy = True
+                else:
+                    raise # missing blob (pruned meanwhile) and others are errors of this link only
+        if copy:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+
+    def write(self, dest: str, content: str) -> str:
+        data = content.encode()
+        blob = self.put(data)
+        try:
+            self.link(blob, dest)
+        except FileNotFoundError:
+            # pruned by concurrent stackd between put and link
+            self.put(data)
+            self.link(blob, dest)
+        return blob
+
+    def prune(self) -> int:
+        """
+        removes blobs not linked anywhere, returns count of removed blobs
+        """
+        removed = 0
+        if not os.path.isdir(self.root) or not self._hardlinks:
+            return removed # copied blobs have no links to count
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def bundle(self, src: str, archive: str, **meta: Any) -> dict[str, Any]:
+        """
+        writes files under src to tar.gz archive with manifest of relative path -> blob,
+        each distinct content stored once. returns manifest
+        """
+        files: dict[str, dict[str, Any]] = {}
+        blobs: dict[str, str] = {}
+        for dirpath, dirnames, filenames in os.walk(src):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                with open(path, "rb") as f:
+                    blob = self.hash(f.read())
+                rel = os.path.relpath(path, src)
+                files[rel] = dict(blob=blob, mode=os.stat(path).st_mode & 0o777)
+                blobs.setdefault(blob, path)
+        manifest = dict(meta, created=time.time(), files=files, blobs=len(blobs),
+                        size=sum(os.path.getsize(p) for p in blobs.values()))
+        data = json.dumps(manifest, indent=1, sort_keys=True).encode()
+        with tarfile.open(archive, "w:gz") as tar:
+            info = tarfile.TarInfo(MANIFEST)
+            info.size = len(data)
+            info.mtime = int(manifest["created"])
+            tar.addfile(info, io.BytesIO(data))
+            for blob, path in sorted(blobs.items()):
+                tar.add(path, arcname=f"blobs/{blob}", recursive=False)
+        return manifest
+
+    @staticmethod
+    def read_manifest(archive: str) -> dict[str, Any]:
+        with tarfile.open(archive, "r:*") as tar:
+            for member in tar:
+                if member.name == MANIFEST:
+                    return json.load(tar.extractfile(member))
+        raise Exception(f"{archive} has no {MANIFEST}")
+
+    def materialize(self, archive: str, dest: str) -> dict[str, Any]:
+        """
+        unpacks bundle blobs missing from store and links manifest files into dest.
+        files in dest not listed in manifest are removed when they were written by stackd
+        (their content is a blob of store), other files are kept. returns manifest
+        """
+        manifest = None
+        with tarfile.open(archive, "r:*") as tar:
+            for member in tar:
+                if member.name == MANIFEST:
+                    manifest = json.load(tar.extractfile(member))
+                elif member.name.startswith("blobs/") and member.isfile():
+                    blob = os.path.basename(member.name)
+                    if not os.path.exists(self.path(blob)):
+                        data = tar.extractfile(member).read()
+                        if self.hash(data) != blob:
+                            raise Exception(f"corrupted blob {blob} in {archive}")
+                        self.put(data)
+        if manifest is None:
+            raise Exception(f"{archive} has no {MANIFEST}")
+
+        for rel, entry in manifest["files"].items():
+            path = os.path.normpath(os.path.join(dest, rel))
+            if not path.startswith(os.path.join(os.path.normpath(dest), "")):
+                raise Exception(f"{rel} is outside of {dest}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.link(entry["blob"], path)
+            if os.stat(path).st_mode & 0o777 != entry["mode"]:
+                os.chmod(path, entry["mode"]) # shared by all links of blob
+
+        listed = { os.path.normpath(os.path.join(dest, rel)) for rel in manifest["files"] }
+        for dirpath, _, filenames in os.walk(dest):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if path not in listed and self.stored(path):
+                    os.remove(path)
+        return manifest
+
+    def stored(self, path: str) -> bool:
+        """
+        file content is a blob of store, hardlinked or copied
+        """
+        with open(path, "rb") as f:
+            return os.path.exists(self.path(self.hash(f.read())))
+
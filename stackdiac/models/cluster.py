@@ -1,5 +1,7 @@
 
+import json
 import os
+import time
 from urllib.parse import urlparse
 from pydantic import BaseModel, parse_obj_as
 import logging
@@ -11,9 +13,12 @@ from stackdiac.models.backend import Backend
 from stackdiac.models.spec import Spec, SpecModel
 
 from stackdiac.models.operation import Operation
+from stackdiac.models.fingerprint import digest
+from stackdiac.api.metrics import vault_call, CLUSTER_BUILD_DURATION
 
-from .stack import Stack, StackModel, Module
-from .secret import Secret
+from .stack import Stack, StackModel, Module, StackBuildRecord
+from .secret import Secret, write_secret
+from . import validation
 
 logger = logging.getLogger(__name__)
 
@@ -39,12 +44,10 @@ class ClusterStack(ClusterStackModel):
     def __str__(self) -> str:
         return f"<{self.__class__.__name__}:{self.name}>"
 
-    def build(self, cluster, sd, **kwargs):
-
-        #from stackdiac.stackd import sd
-        
-        self.cluster_name = cluster.name
-
+    def spec_path(self, sd) -> str:
+        """
+        local path of stack spec
+        """
         if self.src is None:
             self.src = self.name
 
@@ -61,20 +64,37 @@ class ClusterStack(ClusterStackModel):
             path = os.path.join(repo.repo_dir, parsed_src.path.lstrip("/"))           
         else:
             path = os.path.join(repo.repo_dir, parsed_src.path.lstrip("/"), "stack.yaml")
-            
+        return path
 
-        url = parsed_src.geturl()
+    def load(self, cluster, sd) -> Stack:
+        """
+        parses stack spec for cluster without building modules
+        """
+        self.cluster_name = cluster.name
 
+        path = self.spec_path(sd)
         stack_dir = os.path.dirname(path)
 
-        self.stack = Spec(path=path, 
+        stack = Spec(path=path, 
                         merge_from=always_merger.merge({"name": self.name}, self.override), 
                         jinja_env=sd.get_jinja_env(stack_dir)).parse_obj_as(Stack, stackd=sd, cluster=cluster)
+        stack.intern(sd.interned_stacks)
+        return stack
 
+    def build(self, cluster, sd, streaming: bool = False, **kwargs):
+
+        #from stackdiac.stackd import sd
+        
+        self.stack = self.load(cluster, sd)
       
      #   logger.debug(f"{self} stack: {self.stack}")
-        self.stack.build(cluster_stack=self, cluster=cluster, sd=sd, **kwargs)
-        cluster.built_stacks[self.name] = self.stack
+        record = self.stack.build(cluster_stack=self, cluster=cluster, sd=sd, streaming=streaming, **kwargs)
+        if streaming:
+            # only build record survives, stack spec and modules are freed
+            cluster.built_records[self.name] = record
+            self.stack = None
+        else:
+            cluster.built_stacks[self.name] = self.stack
 
         sd.counters.stacks += 1
 
@@ -84,16 +104,44 @@ class ClusterModel(BaseModel):
     stacks: dict[str, ClusterStackModel] = {}    
     backend: Backend | None = None
     spec: SpecModel | None = None
+    fingerprint: str | None = None
+
+class ClusterSummary(BaseModel):
+    name: str
+    stacks: list[str] = []
+    built: bool = False
+    built_modules: int = 0
+    build_time: float | None = None
+    fingerprint: str | None = None
+
+    def read_build(self, sd) -> "ClusterSummary":
+        """
+        build status is read from build dir, cluster is not built
+        """
+        cluster_dir = os.path.join(sd.builddir, self.name)
+        if not os.path.isdir(cluster_dir):
+            return self
+        self.built = True
+        for stack_dir in os.scandir(cluster_dir):
+            if not stack_dir.is_dir():
+                continue
+            for module_dir in os.scandir(stack_dir.path):
+                tg_file = os.path.join(module_dir.path, "terragrunt.hcl")
+                if module_dir.is_dir() and os.path.isfile(tg_file):
+                    self.built_modules += 1
+                    self.build_time = max(self.build_time or 0, os.path.getmtime(tg_file))
+        return self
 
 class Cluster(ClusterModel):   
     stacks: dict[str, ClusterStack] = {}    
     built_stacks: dict[str, Stack] = {}
+    built_records: dict[str, StackBuildRecord] = {}
     spec: Spec | None = None
 
 
     class Config:        
         exceptions = True
-        exclude = {"built_stacks"}
+        exclude = {"built_stacks", "built_records"}
 
     def __init__(self, **data: Any) -> None:
         super().__init__(**data)
@@ -102,26 +150,70 @@ class Cluster(ClusterModel):
             s.name = sname
 
 
-    def build(self, sd, stack="all", **kwargs):
+    def build(self, sd, stack="all", streaming: bool = False, **kwargs):
+        """
+        streaming build keeps only StackBuildRecord per stack in built_records.
+        cluster build dir is locked exclusively, terragrunt runs on it wait
+        """
         sd.counters.clusters += 1
-        if stack == "all":
-            for s in self.stacks.values():
-                s.build(cluster=self, sd=sd, **kwargs)
-        else:
-            s = self.stacks[stack]
-            s.build(cluster=self, sd=sd, **kwargs)
+        start = time.time()
+        with sd.locks.cluster(self.name):
+            if stack == "all":
+                for s in self.stacks.values():
+                    s.build(cluster=self, sd=sd, streaming=streaming, **kwargs)
+            else:
+                s = self.stacks[stack]
+                s.build(cluster=self, sd=sd, streaming=streaming, **kwargs)
+
+        built = { **{ n: s.fingerprint for n, s in self.built_stacks.items() },
+                  **{ n: r.fingerprint for n, r in self.built_records.items() } }
+        self.fingerprint = digest(self.spec.fingerprint if self.spec else None,
+                                  *[ f"{n}:{fp}" for n, fp in sorted(built.items()) ])
+        duration = time.time() - start
+        CLUSTER_BUILD_DURATION.labels(cluster=self.name).observe(duration)
+        sd.events.emit("cluster.build", cluster=self, stacks=list(built.keys()),
+                       fingerprint=self.fingerprint, duration=duration)
+
+    def summary(self, sd) -> ClusterSummary:
+        """
+        build status is read from build dir, cluster is not built
+        """
+        return ClusterSummary(name=self.name, stacks=list(self.stacks.keys()),
+                              fingerprint=self.fingerprint or (self.spec.fingerprint if self.spec else None)).read_build(sd)
+
+    def stack_fingerprint(self, stack_name: str) -> str:
+        """
+        fingerprint of single cluster stack: cluster spec holds stack vars and overrides
+        """
+        return digest(self.spec.fingerprint if self.spec else None,
+                      self.built_stacks[stack_name].fingerprint)
         
 
+from fastapi import Depends, HTTPException, Request, Response
 from stackdiac.api import app as api_app
+from stackdiac.api.cache import etag_response
+from stackdiac.api.fields import field_selection
 
 
 @api_app.get("/clusters/", operation_id="get_clusters", response_model=list[ClusterModel], tags=["cluster"])
-async def _api_get_clusters() -> list[Cluster]:    
+async def _api_get_clusters(request: Request, fields: str | None = Depends(field_selection)) -> Response:    
     from stackdiac.stackd import Stackd
     sd = Stackd()
     sd.configure()
     
-    return list(sd.clusters.values())
+    clusters = list(sd.clusters.values())
+    return etag_response(request, digest(*[ c.spec.fingerprint for c in clusters ]),
+                         list[ClusterModel], lambda: clusters, fields=fields)
+
+@api_app.get("/clusters/summary", operation_id="get_clusters_summary", response_model=list[ClusterSummary], tags=["cluster"])
+async def _api_get_clusters_summary() -> list[ClusterSummary]:
+    """
+    cluster names, stacks and build status without building
+    """
+    from stackdiac.stackd import Stackd
+    sd = Stackd()
+    sd.configure()
+    return [ cluster_summary(sd, name) for name in sd.clusters ]
 
 @api_app.get("/build/{cluster_name}", operation_id="build_cluster", response_model=ClusterModel, tags=["cluster"])
 async def build_cluster(cluster_name:str) -> Cluster:
@@ -134,11 +226,12 @@ async def build_cluster(cluster_name:str) -> Cluster:
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     return cluster
 
 @api_app.get("/cluster/{cluster_name}", operation_id="read_cluster", response_model=ClusterModel, tags=["cluster"])
-async def read_cluster(cluster_name:str) -> Cluster:
+async def read_cluster(cluster_name:str, request: Request, fields: str | None = Depends(field_selection)) -> Response:
     """
     cluster.stacks will setup while bulding
     """
@@ -148,11 +241,13 @@ async def read_cluster(cluster_name:str) -> Cluster:
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
-    return cluster
+    return etag_response(request, cluster.fingerprint, ClusterModel, lambda: cluster, fields=fields)
 
 @api_app.get("/stack/{cluster_name}/{stack_name}", operation_id="read_cluster_stack", response_model=ClusterStackModel, tags=["stack"])
-async def read_cluster_stack(cluster_name:str, stack_name:str) -> ClusterStack:
+async def read_cluster_stack(cluster_name:str, stack_name:str, request: Request,
+                             fields: str | None = Depends(field_selection)) -> Response:
     """
     cluster.stacks will setup while bulding
     """
@@ -162,14 +257,18 @@ async def read_cluster_stack(cluster_name:str, stack_name:str) -> ClusterStack:
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     try:
-        return cluster.stacks[stack_name]
+        cluster_stack = cluster.stacks[stack_name]
     except KeyError:
         raise Exception(f"Stack {stack_name} not found in cluster {cluster_name}")
+    return etag_response(request, cluster.stack_fingerprint(stack_name), ClusterStackModel, lambda: cluster_stack,
+                         fields=fields)
     
 @api_app.get("/module/{cluster_name}/{stack_name}/{module_name}", operation_id="cluster_stack_module", response_model=Module, tags=["modules"])
-async def build_module(cluster_name:str, stack_name:str, module_name:str) -> Module:
+async def build_module(cluster_name:str, stack_name:str, module_name:str, request: Request,
+                       fields: str | None = Depends(field_selection)) -> Response:
     """
     cluster.stacks will setup while bulding
     """
@@ -179,11 +278,13 @@ async def build_module(cluster_name:str, stack_name:str, module_name:str) -> Mod
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     try:
-        return cluster.stacks[stack_name].stack.modules[module_name]
+        module = cluster.stacks[stack_name].stack.modules[module_name]
     except KeyError:
         raise Exception(f"Module {module_name} not found in stack {stack_name} in cluster {cluster_name}")
+    return etag_response(request, module.fingerprint, Module, lambda: module, fields=fields)
     
 @api_app.post("/vars/{cluster_name}/{stack_name}/{module_name}", operation_id="write_module_vars", tags=["modules"])
 async def write_module_vars(cluster_name:str, stack_name:str, module_name:str, vars:dict) -> Module:
@@ -193,6 +294,7 @@ async def write_module_vars(cluster_name:str, stack_name:str, module_name:str, v
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     vars_file = cluster.stacks[stack_name].stack.modules[module_name].build_vars_file(cluster=cluster, sd=sd,
                                                                                     module=cluster.stacks[stack_name].stack.modules[module_name],
@@ -219,6 +321,7 @@ async def list_module_secrets(cluster_name:str, stack_name:str, module_name:str)
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     try:
         m = cluster.stacks[stack_name].stack.modules[module_name]
@@ -226,14 +329,16 @@ async def list_module_secrets(cluster_name:str, stack_name:str, module_name:str)
         raise Exception(f"Module {module_name} not found in stack {stack_name} in cluster {cluster_name}")
     
     try:
-        resp = sd.vault.kv.v2.list_secrets(path=m.built_vars["module_secret_path"], mount_point='kv')
+        with vault_call("list_secrets"):
+            resp = sd.vault.kv.v2.list_secrets(path=m.built_vars["module_secret_path"], mount_point='kv')
     except hvac.exceptions.InvalidPath as e:
         logger.error(f"list_module_secrets: {e}")
         return []
     
     def _get_secrets():
         for k in resp["data"]["keys"]:
-            rr = sd.vault.kv.v2.read_secret_version(path=f"{m.built_vars['module_secret_path']}/{k}", mount_point='kv')
+            with vault_call("read_secret_version"):
+                rr = sd.vault.kv.v2.read_secret_version(path=f"{m.built_vars['module_secret_path']}/{k}", mount_point='kv')
             logger.debug(f"list_module_secrets: {rr}")
             data = dict(
                 module_name=module_name,
@@ -245,6 +350,7 @@ async def list_module_secrets(cluster_name:str, stack_name:str, module_name:str)
             if rr["data"]["metadata"]["custom_metadata"] and rr["data"]["metadata"]["custom_metadata"].get("schema", False):
                 data["secret_type"] = rr["data"]["metadata"]["custom_metadata"]["schema"]
                 data["secret_schema"] = cluster.stacks[stack_name].stack.stack_schema['components']['schemas'][data["secret_type"]]
+                data["errors"] = secret_errors(cluster.stacks[stack_name].stack, f"{m.built_vars['module_secret_path']}/{k}", data)
    
             yield data
 
@@ -261,13 +367,15 @@ async def read_module_secret(cluster_name:str, stack_name:str, module_name:str,
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     try:
         m = cluster.stacks[stack_name].stack.modules[module_name]
     except KeyError:
         raise Exception(f"Module {module_name} not found in stack {stack_name} in cluster {cluster_name}")
     
-    resp = sd.vault.kv.v2.read_secret_version(path=f'{m.built_vars["module_secret_path"]}/{secret_name}', mount_point='kv')
+    with vault_call("read_secret_version"):
+        resp = sd.vault.kv.v2.read_secret_version(path=f'{m.built_vars["module_secret_path"]}/{secret_name}', mount_point='kv')
     
     data = dict(
                 module_name=module_name,
@@ -281,44 +389,105 @@ async def read_module_secret(cluster_name:str, stack_name:str, module_name:str,
     if resp["data"]["metadata"]["custom_metadata"].get("schema", False):
         data["secret_type"] = resp["data"]["metadata"]["custom_metadata"]["schema"]
         data["secret_schema"] = cluster.stacks[stack_name].stack.stack_schema['components']['schemas'][data["secret_type"]]
+        data["errors"] = secret_errors(cluster.stacks[stack_name].stack, f"{m.built_vars['module_secret_path']}/{secret_name}", data)
         
     return data
 
     
     
 
-@api_app.post("/secret/{cluster_name}/{stack_name}/{module_name}/{secret_name}", operation_id="write_module_secret", response_model=Secret,
-              tags=["secrets"])
-async def write_module_secret(cluster_name:str, stack_name:str, module_name:str, secret_name:str, 
-                              secret_type:str, secret:dict) -> Secret:
+# spec part of cluster summaries by cluster file: stats of files spec was rendered from and summary
+_summaries: dict[str, tuple[list[tuple[str, int, int]], ClusterSummary]] = {}
+
+
+def _stat(path: str) -> tuple[str, int, int]:
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+def cluster_summary(sd, name: str) -> ClusterSummary:
     """
-    module secrets list
+    summary of cluster, its spec is not parsed again while cluster file, its includes
+    and project config are unchanged since last summary
     """
-    from stackdiac.stackd import Stackd
-    sd = Stackd()
-    sd.configure()
+    if name in sd.clusters.loaded():
+        return sd.clusters[name].summary(sd)
+    path = sd.clusters.path(name)
+    entry = _summaries.get(path)
+    try:
+        fresh = entry is not None and all(_stat(s[0]) == s for s in entry[0])
+    except OSError:
+        fresh = False
+    if not fresh:
+        cluster = sd.clusters[name]
+        reads = [path, sd.config_file, *(cluster.spec.includes if cluster.spec else [])]
+        entry = _summaries[path] = ([ _stat(p) for p in reads if os.path.isfile(p) ],
+                                    ClusterSummary(name=name, stacks=list(cluster.stacks.keys()),
+                                                   fingerprint=cluster.spec.fingerprint if cluster.spec else None))
+    return entry[1].copy().read_build(sd)
+
+
+def secret_errors(stack, path: str, data: dict) -> list[str]:
+    """
+    validation errors of read secret
+    """
+    return validation.secret_errors(stack.compiled_schemas, data["secret_type"], path,
+                                    data["metadata"]["version"], data["data"])
+
+
+def module_secret_path(sd, cluster_name: str, stack_name: str, module_name: str) -> str:
+    """
+    module_secret_path var of built module, read from its vars.tfvars.json or build index.
+    cluster is built only when module was never built
+    """
+    from stackdiac.stackd.index import BuildIndex
+    key = (cluster_name, stack_name, module_name)
+    vars_file = os.path.join(sd.builddir, *key, "vars.tfvars.json")
+    if os.path.isfile(vars_file):
+        with open(vars_file) as f:
+            path = json.load(f).get("module_secret_path")
+        if path:
+            return path
+    index_path = BuildIndex.default_path(sd)
+    if os.path.isfile(index_path):
+        rows = BuildIndex(index_path).query("SELECT value FROM vars WHERE cluster = ? AND stack = ? AND module = ? "
+                                            "AND name = 'module_secret_path'", key)
+        if rows:
+            return json.loads(rows[0]["value"])
     cluster = sd.clusters[cluster_name]
     cluster.build(sd=sd)
     sd.counters.stop()
+    sd.observe_build()
     logger.info(f"build_cluster: {cluster_name} {sd.counters}")
     try:
-        m = cluster.stacks[stack_name].stack.modules[module_name]
+        return cluster.stacks[stack_name].stack.modules[module_name].built_vars["module_secret_path"]
     except KeyError:
         raise Exception(f"Module {module_name} not found in stack {stack_name} in cluster {cluster_name}")
-    
-    data = secret
-    resp = sd.vault.kv.v2.create_or_update_secret(path=f'{m.built_vars["module_secret_path"]}/{secret_name}', mount_point='kv', 
-                                                  secret=secret)    
-    logger.info(f"saved secret to {m.built_vars['module_secret_path']}/{secret_name} version: {resp['data']['version']}")
-    logger.debug(f"saved secret to {m.built_vars['module_secret_path']}/{secret_name} version: {resp} data: {data} secret: {secret} <<<")
-
-    resp = sd.vault.kv.v2.read_secret_version(path=f'{m.built_vars["module_secret_path"]}/{secret_name}', mount_point='kv')    
-
-    if not resp["data"]["metadata"]["custom_metadata"] or ("schema" not in resp["data"]["metadata"]["custom_metadata"]):
-        sd.vault.kv.v2.update_metadata(path=f'{m.built_vars["module_secret_path"]}/{secret_name}', mount_point='kv', 
-                                                        custom_metadata=dict(schema=secret_type))
-        logger.info(f"saved secret metadata to {m.built_vars['module_secret_path']}/{secret_name} version: {resp['data']['version']}")
-        resp = sd.vault.kv.v2.read_secret_version(path=f'{m.built_vars["module_secret_path"]}/{secret_name}', mount_point='kv')
+
+
+@api_app.post("/secret/{cluster_name}/{stack_name}/{module_name}/{secret_name}", operation_id="write_module_secret", response_model=Secret,
+              tags=["secrets"])
+async def write_module_secret(cluster_name:str, stack_name:str, module_name:str, secret_name:str, 
+                              secret_type:str, secret:dict) -> Secret:
+    """
+    writes module secret without building cluster. one vault call when secret schema is
+    already secret_type, two when metadata is updated. response is not read back.
+    secret is validated against secret_type first, 422 when invalid
+    """
+    from stackdiac.stackd import Stackd
+    sd = Stackd()
+    sd.configure(setup_kv=False)
+    path = f"{module_secret_path(sd, cluster_name, stack_name, module_name)}/{secret_name}"
+    # only stack spec is loaded for its schema, modules are not built
+    stack = sd.clusters[cluster_name].stacks[stack_name].load(sd.clusters[cluster_name], sd)
+    try:
+        errors = stack.compiled_schemas[1].errors(secret_type, secret)
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=[e.args[0]])
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    metadata = write_secret(sd.vault, path, secret, secret_type)
+    validation.secret_errors(stack.compiled_schemas, secret_type, path, metadata["version"], secret)
 
     return dict(
                 module_name=module_name,
@@ -326,4 +495,5 @@ async def write_module_secret(cluster_name:str, stack_name:str, module_name:str,
                 stack_name=stack_name,
                 cluster_name=cluster_name,
                 secret_type=secret_type,
-                **resp["data"])
\ No newline at end of file
+                data=secret,
+                metadata=metadata)
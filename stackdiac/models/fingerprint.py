@@ -0,0 +1,22 @@
+import hashlib
+import json
+from typing import Any
+
+
+def digest(*parts: str | None) -> str:
+    """
+    stable sha256 over ordered string parts.
+    None parts are hashed as empty strings, so unset fingerprints still produce a value
+    """
+    h = hashlib.sha256()
+    for p in parts:
+        h.update((p or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def data_digest(data: Any) -> str:
+    """
+    fingerprint of parsed yaml/json data, independent of key order
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
@@ -1,4 +1,5 @@
 import os
+import time
 from pydantic import BaseModel, parse_obj_as
 import logging
 from typing import Any
@@ -27,19 +28,38 @@ class PipelineStep(BaseModel):
     command: str | list[str] = "apply"
     vars: dict[str, Any] = {}
 
-    def run(self, sd, cluster, cluster_stack, stack, operation, **kwargs):
+    def run(self, sd, cluster, cluster_stack, stack, operation, queue=None, timings=None, **kwargs):
+        """
+        builds stack with step vars and runs terragrunt on module, on worker when queue is set.
+        duration of successful terragrunt run is recorded to timings (StepTimings)
+        """
         if self.title is None:
             self.title = f"run {self.command} on {self.module}"
             
         if self.command is not list:
             self.command = self.command.split(" ")
         
-        cluster_stack.build(cluster=cluster, sd=sd, extra_vars=self.vars,
-                                                    **kwargs)
-        logger.info(f"builded {self.title} step with extra vars {self.vars}")
-        sd.terragrunt(target=cluster_stack.stack.modules[self.module].built_vars["build_path"], 
-                      terragrunt_options=self.command, 
-                      cluster=cluster, **kwargs)
+        start = time.time()
+        sd.events.emit("step.start", cluster=cluster, stack=cluster_stack, module=self.module,
+                       title=self.title, command=self.command, operation=operation.name)
+        try:
+            cluster_stack.build(cluster=cluster, sd=sd, extra_vars=self.vars,
+                                                        **kwargs)
+            logger.info(f"builded {self.title} step with extra vars {self.vars}")
+            run_start = time.time()
+            (queue or sd).terragrunt(target=cluster_stack.stack.modules[self.module].built_vars["build_path"], 
+                          terragrunt_options=self.command, 
+                          cluster=cluster, stack=cluster_stack.name, module=self.module, **kwargs)
+        except Exception as e:
+            sd.events.emit("step.finish", cluster=cluster, stack=cluster_stack, module=self.module,
+                           title=self.title, operation=operation.name, returncode=1, error=str(e),
+                           duration=time.time() - start)
+            raise
+        if timings is not None:
+            timings.record(f"{cluster_stack.name}/{self.module}", self.command[0], time.time() - run_start)
+        sd.events.emit("step.finish", cluster=cluster, stack=cluster_stack, module=self.module,
+                       title=self.title, operation=operation.name, returncode=0,
+                       duration=time.time() - start)
         logger.info(f"finished running step <{self.title}>")
 
 
@@ -52,11 +72,17 @@ class Operation(BaseModel):
     
 
     def run(self, sd, target, cluster, cluster_stack, **kwargs):
+        from stackdiac.stackd.graph import StepTimings
         logger.info(f"{self} running {len(self.pipeline)} steps pipeline")
 
-        for step in self.pipeline:
-            logger.info(f"running step {step}")
-            step.run(sd, cluster, cluster_stack, operation=self, **kwargs)
+        # same timings as `tg <cluster>` runs, for graph critical path
+        timings = StepTimings(sd, cluster.name)
+        try:
+            for step in self.pipeline:
+                logger.info(f"running step {step}")
+                step.run(sd, cluster, cluster_stack, operation=self, timings=timings, **kwargs)
+        finally:
+            timings.save()
 
 
     def run_old(self, sd, target, cluster, stack, **kwargs):
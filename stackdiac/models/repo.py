@@ -2,8 +2,9 @@ from jinja2 import Environment, FileSystemLoader
 from jinja2.ext import do
 from pydantic import BaseModel, Extra, Field
 from typing import Union, Any, List, Optional
-import os, logging, git, filecmp, shutil, yaml
+import os, logging, git, filecmp, shutil
 from urllib.parse import urlparse
+from . import yamlio
 import os
 
 
@@ -142,7 +143,7 @@ class Repo(BaseModel):
             return
 
 
-        repo_config = RepoConfig.parse_obj(yaml.safe_load(open(stack_yaml).read()))
+        repo_config = RepoConfig.parse_obj(yamlio.load_file(stack_yaml))
 
         if repo_config.kind != "repo":
             logger.debug(f"Repo {self.url} is not a repo kind")
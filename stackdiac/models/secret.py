@@ -2,6 +2,8 @@ from pydantic import BaseModel
 import logging
 from typing import Any
 
+from stackdiac.api.metrics import vault_call
+
 logger  = logging.getLogger(__name__)
 
 class Secret(BaseModel):
@@ -12,4 +14,25 @@ class Secret(BaseModel):
     secret_schema: Any | None = None
     secret_type: str | None = None
     data: dict[str, Any] = {}
-    metadata: dict[str, Any] | None = None
\ No newline at end of file
+    metadata: dict[str, Any] | None = None
+    errors: list[str] | None = None # schema validation errors, None when not validated
+
+def write_secret(vault, path: str, secret: dict[str, Any], secret_type: str | None) -> dict[str, Any]:
+    """
+    writes secret data to kv path, custom_metadata schema is updated only when it differs
+    from secret_type. returns version metadata of write, secret is not read back
+    """
+    with vault_call("create_or_update_secret"):
+        resp = vault.kv.v2.create_or_update_secret(path=path, mount_point='kv', secret=secret)
+    metadata = dict(resp["data"])
+    logger.info(f"saved secret to {path} version: {metadata['version']}")
+
+    # write response carries custom_metadata
+    custom_metadata = metadata.get("custom_metadata") or {}
+    if secret_type and custom_metadata.get("schema") != secret_type:
+        custom_metadata = dict(custom_metadata, schema=secret_type)
+        with vault_call("update_metadata"):
+            vault.kv.v2.update_metadata(path=path, mount_point='kv', custom_metadata=custom_metadata)
+        logger.info(f"saved secret metadata to {path} version: {metadata['version']}")
+    metadata["custom_metadata"] = custom_metadata
+    return metadata
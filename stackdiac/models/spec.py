@@ -4,9 +4,11 @@ import os
 from typing import Any
 from jinja2 import Environment
 from pydantic import BaseModel, parse_obj_as
-import yaml
 from deepmerge import always_merger
 
+from .fingerprint import data_digest
+from . import yamlio
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -18,10 +20,12 @@ class SpecModel(BaseModel):
     rendered: str | None = None
     data: dict[str, Any] = {}    
     jinja_template: bool = False # flag for ui
+    fingerprint: str | None = None
 
 class Spec(SpecModel):
     jinja_env: Any | None = None
     merge_from: Any | None = None
+    includes: list[str] = [] # files read by !include while rendering
 
     class Config:
         arbitrary_types_allowed = True        
@@ -52,7 +56,15 @@ class Spec(SpecModel):
         if self.merge_from:        
             self.data = always_merger.merge(self.data, self.merge_from)
             
-        self.data = always_merger.merge(self.data, yaml.safe_load(self.rendered))
+        sd = kwargs.get("stackd")
+        if sd is not None:
+            with sd.include_cache.track() as reads:
+                data = yamlio.safe_load(self.rendered, sd.yaml_loader)
+            self.includes = sorted({ r[0] for r in reads })
+        else:
+            data = yamlio.safe_load(self.rendered)
+        self.data = always_merger.merge(self.data, data)
+        self.fingerprint = data_digest(self.data)
         
 
     def parse_obj_as(self, obj_type, **kwargs):        
@@ -1,23 +1,103 @@
 
 from urllib.parse import urlparse
-from pydantic import BaseModel, parse_obj_as, Field
+from pydantic import BaseModel, parse_obj_as, Field, PrivateAttr
 from deepmerge import always_merger
 from copy import deepcopy
+import json
 import logging, os
-from typing import Any
+import re
+import time
+from functools import lru_cache
+from typing import Any, Callable
 
-import yaml
 from stackdiac.models.backend import Backend
 from stackdiac.models.spec import Spec, SpecModel
 
 from stackdiac.models.operation import Operation
 from stackdiac.models.provider import Provider
+from stackdiac.models.fingerprint import digest
+from stackdiac.models import yamlio
+from stackdiac.api.metrics import vault_call
+from stackdiac.models import validation
 
 import hvac
 from enum import Enum
 
 logger = logging.getLogger(__name__)
 
+
+def _stackd(sd=None):
+    # explicit instance (api jobs) or module global one
+    if sd is None:
+        from stackdiac.stackd import sd
+    return sd
+
+# json artifacts besides vars.tfvars.json and key their vars are nested under.
+# written only when stack or module lists them in `artifacts`
+# or their name is mentioned in core templates or module source,
+# removed from build dir only when listed in `skip_artifacts`
+OPTIONAL_JSON_ARTIFACTS = {
+    "vars.ansible.json": "stackd",
+    "vars.stackd.json": "_stackd",
+}
+
+# template rendering nothing but vars with tojson filter, jinja drops single trailing newline
+_tojson_template_re = re.compile(r"^\{\{-?\s*vars\s*\|\s*tojson(?:\(\s*(?:indent\s*=\s*)?(\d+)?\s*\))?\s*-?\}\}\n?$")
+
+
+@lru_cache(maxsize=32)
+def direct_json(tpl) -> Callable[[Any], str] | None:
+    """
+    serializer producing same output as template when it is `{{ vars | tojson }}`,
+    None for other templates. jinja reloads changed templates as new objects
+    """
+    env = tpl.environment
+    source, _, _ = env.loader.get_source(env, tpl.name)
+    m = _tojson_template_re.match(source)
+    if not m:
+        return None
+    dumps = env.policies["json.dumps_function"] or json.dumps
+    kwargs = dict(env.policies["json.dumps_kwargs"])
+    if m.group(1):
+        kwargs["indent"] = int(m.group(1))
+
+    def serialize(data: Any) -> str:
+        # same escaping as jinja htmlsafe_json_dumps
+        return (dumps(data, **kwargs).replace("<", "\\u003c").replace(">", "\\u003e")
+                .replace("&", "\\u0026").replace("'", "\\u0027"))
+    return serialize
+
+
+# stale optional artifacts already warned about
+_stale_warned: set[str] = set()
+
+
+def _scan_mentions(d: str) -> frozenset[str]:
+    found = set()
+    for dirpath, dirnames, filenames in os.walk(d):
+        dirnames[:] = [ n for n in dirnames if n not in (".git", ".terraform", ".terragrunt-cache") ]
+        for filename in filenames:
+            try:
+                with open(os.path.join(dirpath, filename), errors="ignore") as f:
+                    content = f.read()
+            except OSError:
+                continue
+            found.update(a for a in OPTIONAL_JSON_ARTIFACTS if a in content)
+    return frozenset(found)
+
+
+def mentioned_artifacts(dirs: list[str], cache: dict[str, frozenset[str]]) -> set[str]:
+    """
+    optional artifact names found in files of dirs. cache maps dir to names found in it
+    and is cleared by every build, so each dir is walked once per build
+    """
+    found = set()
+    for d in dirs:
+        if d not in cache:
+            cache[d] = _scan_mentions(d)
+        found |= cache[d]
+    return found
+
         
 
 
@@ -48,6 +128,7 @@ class ModuleSecretStatus(Enum):
     NOT_EXISTS = "not_exists"
     EXISTS = "exists"
     VALID   = "valid"
+    INVALID = "invalid"
 
 class ModuleSecret(BaseModel):
     name: str | None = None
@@ -55,26 +136,62 @@ class ModuleSecret(BaseModel):
     secret_schema: dict | None = None
     required: bool = False
     status: ModuleSecretStatus = ModuleSecretStatus.UNKNOWN
+    errors: list[str] = []
 
-    def build(self, cluster, cluster_stack, stack, sd, module, status, **kwargs):       
+    def build(self, cluster, cluster_stack, stack, sd, module, status, validate_secrets: bool = False, **kwargs):
 
         if self.secret_schema is None and self.secret_type is not None:
             # extracting schema from stack.schema.components.schemas
             self.secret_schema = stack.stack_schema['components']['schemas'][self.secret_type]
             self.status = status
 
+        # existing typed secrets are read and validated only on request, it costs a vault read per secret
+        if validate_secrets and status == ModuleSecretStatus.EXISTS and self.secret_type is not None:
+            path = f"{module.built_vars['module_secret_path']}/{self.name}"
+            self.errors = validation.validate_secret(sd.vault, stack.compiled_schemas, self.secret_type, path)
+            self.status = ModuleSecretStatus.INVALID if self.errors else ModuleSecretStatus.VALID
+            for e in self.errors:
+                logger.warning(f"{cluster.name}/{stack.name}/{module.name} secret {self.name} is invalid: {e}")
+
 class ModuleSchemas(BaseModel):
     secrets: dict[str, ModuleSecret] = {}
     vars: str | None = None
 
     schemas: dict[str, Any] = {}
+    errors: list[str] = [] # vars validation errors
 
     def build(self, cluster, cluster_stack, stack, sd, module, **kwargs):        
         if self.vars:
             self.schemas["vars"] = stack.stack_schema['components']['schemas'][self.vars]
+            # built vars named in schema, missing required ones are reported
+            properties = self.schemas["vars"].get("properties", {})
+            self.errors = stack.compiled_schemas[1].errors(
+                self.vars, { k: v for k, v in module.built_vars.items() if k in properties })
+            for e in self.errors:
+                logger.warning(f"{cluster.name}/{stack.name}/{module.name} vars are invalid: {e}")
 
   
 
+class ModuleBuildRecord(BaseModel):
+    """
+    compact result of module build, kept instead of built module in streaming builds
+    """
+    stack: str
+    module: str
+    build_path: str
+    deps: list[str] = []
+    fingerprint: str | None = None
+    backend: dict[str, Any] = {}
+    reads: list[str] = []
+    secrets: dict[str, dict[str, Any]] = {} # declarations: secret_type, required, status
+
+
+class StackBuildRecord(BaseModel):
+    name: str
+    fingerprint: str | None = None
+    modules: list[ModuleBuildRecord] = []
+
+
 class Module(BaseModel):
     name: str | None = None
     source: str | None = None
@@ -82,6 +199,7 @@ class Module(BaseModel):
     vars: dict[str, Any] = {}
     module_vars: dict[str, Any] = {}
     built_vars: dict[str, Any] = {}
+    built_backend: dict[str, Any] = {}
     providers: list[str] = []
     provider_overrides: dict[str, Any] = {}
     inputs: Any = []
@@ -94,6 +212,9 @@ class Module(BaseModel):
     backend: Backend | None = None
     secrets: dict[str, ModuleSecret] = {}
     schemas: ModuleSchemas | None = None
+    artifacts: list[str] = [] # optional artifacts, see OPTIONAL_JSON_ARTIFACTS
+    skip_artifacts: list[str] = [] # optional artifacts never written
+    fingerprint: str | None = None
     
 
     def __str__(self) -> str:
@@ -110,11 +231,13 @@ class Module(BaseModel):
 
     @property
     def abssrc(self) -> str:
-        from stackdiac.stackd import sd
-        assert self.src
-        return sd.resolve_path(self.src)
+        return self.resolve_src()
         #return os.path.join(sd.root, self.src)
 
+    def resolve_src(self, sd=None) -> str:
+        assert self.src
+        return _stackd(sd).resolve_path(self.src)
+
     @property
     def absdeps(self) -> list[str]:
         return [ os.path.join(os.path.dirname(self.abssrc), d) for d in self.deps ]
@@ -126,7 +249,7 @@ class Module(BaseModel):
     def build_module_vars(self, sd, cluster_stack, cluster, **kwargs) -> dict[str, Any]:
         vars_file = self.build_vars_file(sd, cluster_stack, cluster)
         if os.path.exists(vars_file):
-            return yaml.load(open(vars_file), Loader=yaml.FullLoader)
+            return yamlio.load_file(vars_file, full=True)
         else:
             return {}
    
@@ -163,17 +286,42 @@ class Module(BaseModel):
         from stackdiac.stackd import sd
         return os.path.join(sd.root, "charts")
 
-    def get_template(self, template_name):
-        from stackdiac.stackd import sd
-        return sd.conf.repos["core"].get_jinja_env().get_template(template_name)
+    def get_template(self, template_name, sd=None):
+        return _stackd(sd).conf.repos["core"].get_jinja_env().get_template(template_name)
 
-    def write(self, template_name, dest, **kwargs):
-        tpl = self.get_template(template_name)
+    def write(self, template_name, dest, sd=None, **kwargs) -> str:
+        sd = _stackd(sd)
+        tpl = self.get_template(template_name, sd=sd)
+        content = tpl.render(**kwargs)
         
-        with open(dest, "w") as f:
-            f.write(tpl.render(**kwargs))
+        sd.blobs.write(dest, content)
 
         # logger.debug(f"{self} writed {dest} from {tpl}")
+        return content
+
+    def write_json(self, template_name, dest, sd=None, **kwargs) -> str:
+        """
+        writes kwargs["vars"] with direct serializer when template is plain tojson, renders template otherwise
+        """
+        sd = _stackd(sd)
+        serialize = direct_json(self.get_template(template_name, sd=sd))
+        if serialize is None:
+            return self.write(template_name, dest, sd=sd, **kwargs)
+        content = serialize(kwargs["vars"])
+        sd.blobs.write(dest, content)
+        return content
+
+    def json_artifacts(self, stack, sd) -> set[str]:
+        """
+        optional json artifacts to write for module
+        """
+        wanted = { *self.artifacts, *stack.artifacts }
+        skipped = { *self.skip_artifacts, *stack.skip_artifacts }
+        if not OPTIONAL_JSON_ARTIFACTS.keys() <= wanted | skipped:
+            templates_dir = sd.conf.repos["core"].templates_dir
+            wanted |= mentioned_artifacts([ d for d in (templates_dir, self.resolve_src(sd)) if d and os.path.isdir(d) ],
+                                          sd.artifact_mentions)
+        return wanted - skipped
 
     @property
     def remote_state_template(self) -> str:
@@ -189,8 +337,8 @@ class Module(BaseModel):
         return f"{stack.name}"
 
     
-    def get_ingress_host(self, cluster, stack) -> str:
-        from stackdiac.stackd import sd
+    def get_ingress_host(self, cluster, stack, sd=None) -> str:
+        sd = _stackd(sd)
         if self.name.startswith("in-"):
             name = self.name[3:]
         else:
@@ -205,12 +353,12 @@ class Module(BaseModel):
             cluster=cluster.name,
             env=cluster.name,
             service=self.name,
-            tg_abspath=self.abssrc,
+            tg_abspath=self.resolve_src(sd),
             group="all", # legacy
             environment=cluster.name,
-            ingress_host=self.get_ingress_host(cluster, stack),
+            ingress_host=self.get_ingress_host(cluster, stack, sd=sd),
             namespace=self.get_namespace(stack),
-            charts_root=self.charts_root,
+            charts_root=os.path.join(sd.root, "charts"),
             module_secret=f"kv/{cluster.name}/module/{stack.name}/{self.name}",
             module_secret_path=f"{cluster.name}/module/{stack.name}/{self.name}",
         )
@@ -222,14 +370,67 @@ class Module(BaseModel):
         """
         return f"{os.path.dirname(self.abssrc)}//{os.path.basename(self.abssrc)}"
 
-    def get_build_dir(self, cluster, stack):
-        from stackdiac.stackd import sd
-        return os.path.join(sd.root, "build", cluster.name, stack.name, self.name)
+    def get_versions(self, sd) -> list[Provider]:
+        """
+        project providers with module overrides applied, limited to module providers
+        """
+        return list(self.get_versions_by_name(sd).values())
+
+    def get_versions_by_name(self, sd) -> dict[str, Provider]:
+        """
+        same as get_versions keyed by provider name, providers added by overrides only have no name set
+        """
+        providers_data = { n: p.dict() for n, p in sd.providers.items() }
+        always_merger.merge(providers_data, self.provider_overrides)
+
+        return { k: parse_obj_as(Provider, v) for k, v in providers_data.items() if k in self.providers }
+
+    def get_build_dir(self, cluster, stack, sd=None):
+        return os.path.join(_stackd(sd).root, "build", cluster.name, stack.name, self.name)
+
+    def record(self, cluster, cluster_stack, stack, sd, **kwargs) -> ModuleBuildRecord:
+        deps = []
+        for d in [*self.build_deps(stack=stack, module=self, cluster=cluster, deps=self.deps, sd=sd),
+                  *self.build_deps(stack=stack, module=self, cluster=cluster, deps=self.inputs, sd=sd)]:
+            dep_id = f"{d.stack_name}/{d.module_name}"
+            if dep_id not in deps:
+                deps.append(dep_id)
+        return ModuleBuildRecord(stack=stack.name, module=self.name, build_path=self.get_build_dir(cluster, stack, sd=sd),
+                                 deps=deps, fingerprint=self.fingerprint, backend=self.built_backend,
+                                 reads=self.build_reads(cluster, cluster_stack, stack, sd),
+                                 secrets=self.secret_declarations())
+
+    def secret_declarations(self) -> dict[str, dict[str, Any]]:
+        return { n: dict(secret_type=s.secret_type, required=s.required, status=s.status.value, errors=s.errors)
+                 for n, s in self.secrets.items() }
+
+    def build_reads(self, cluster, cluster_stack, stack, sd, **kwargs) -> list[str]:
+        """
+        files and directories (with trailing /) module build depends on
+        """
+        reads = [sd.config_file, sd.resolve_path("core:versions.yaml"),
+                 self.build_vars_file(sd, cluster_stack, cluster), os.path.join(self.resolve_src(sd), "")]
+        for spec in (cluster.spec, stack.spec):
+            if spec:
+                reads.extend([spec.path, *spec.includes])
+        templates_dir = sd.conf.repos["core"].templates_dir
+        if templates_dir:
+            reads.append(os.path.join(templates_dir, ""))
+        return sorted({ os.path.abspath(r) + (os.sep if r.endswith(os.sep) else "") for r in reads })
+
+    def release(self) -> None:
+        """
+        drops merged vars of built module, artifacts are already written
+        """
+        self.module_vars = {}
+        self.built_vars = {}
+        self.built_backend = {}
 
     def build(self, cluster, cluster_stack, stack, sd, extra_vars={}, **kwargs):
         #from stackdiac.stackd import sd
+        start = time.time()
         path = sd.resolve_module_path(self.src)
-        dest = self.get_build_dir(cluster, stack)
+        dest = self.get_build_dir(cluster, stack, sd=sd)
         os.makedirs(dest, exist_ok=True)
         _vars = {
             'build_path': dest,
@@ -306,7 +507,8 @@ class Module(BaseModel):
         vault_module_secrets = []
         if self.secrets:
             try:
-                resp = sd.vault.kv.v2.list_secrets(path=self.built_vars["module_secret_path"], mount_point='kv')
+                with vault_call("list_secrets"):
+                    resp = sd.vault.kv.v2.list_secrets(path=self.built_vars["module_secret_path"], mount_point='kv')
             except hvac.exceptions.InvalidPath:
                 pass
             else:
@@ -338,23 +540,40 @@ class Module(BaseModel):
             vars_list=list(get_vars_list()),
             tf_backend=bk.build(sd, stack, self, cluster, cluster_stack, **kwargs),
              **kwargs)
+        self.built_backend = ctx["tf_backend"]
         
-        self.write("terragrunt.root.j2", os.path.join(dest, "terragrunt.hcl"), **ctx)        
-        self.write("variables.tf.j2", os.path.join(dest, "_variables.tf"), **ctx)
+        artifacts = [
+            self.write("terragrunt.root.j2", os.path.join(dest, "terragrunt.hcl"), sd=sd, **ctx),
+            self.write("variables.tf.j2", os.path.join(dest, "_variables.tf"), sd=sd, **ctx),
+        ]
         
-        providers_data = { n: p.dict() for n, p in sd.providers.items() }
-        always_merger.merge(providers_data, self.provider_overrides)
-
-        versions = [ parse_obj_as(Provider, v) for k, v in providers_data.items() if k in self.providers ]
-
-        self.write("versions.tf.j2", os.path.join(dest, "_versions.tf"), **dict(versions=versions, **ctx))
-
-        self.write("vars.tfvars.json.j2", os.path.join(dest, "vars.tfvars.json"), **dict(versions=versions, **ctx))
-        self.write("vars.tfvars.json.j2", os.path.join(dest, "vars.ansible.json"), **dict(vars=dict(stackd=ctx["vars"])))
-        self.write("vars.tfvars.json.j2", os.path.join(dest, "vars.stackd.json"), **dict(vars=dict(_stackd=ctx["vars"])))
+        versions = self.get_versions(sd)
+
+        artifacts.append(self.write("versions.tf.j2", os.path.join(dest, "_versions.tf"), sd=sd, **dict(versions=versions, **ctx)))
+
+        artifacts.append(self.write_json("vars.tfvars.json.j2", os.path.join(dest, "vars.tfvars.json"), sd=sd,
+                                         **dict(versions=versions, **ctx)))
+        wanted = self.json_artifacts(stack, sd)
+        for name, key in OPTIONAL_JSON_ARTIFACTS.items():
+            if name in wanted:
+                artifacts.append(self.write_json("vars.tfvars.json.j2", os.path.join(dest, name), sd=sd, vars={key: ctx["vars"]}))
+            elif not os.path.exists(os.path.join(dest, name)):
+                continue
+            elif name in self.skip_artifacts or name in stack.skip_artifacts:
+                os.remove(os.path.join(dest, name))
+            elif name not in _stale_warned:
+                # may be read outside of project, left for user to list in artifacts or skip_artifacts
+                _stale_warned.add(name)
+                logger.warning(f"{name} of {dest} is no longer written and left from previous build, "
+                               f"list it in `artifacts` or `skip_artifacts` of stack or module")
+
+        # secrets status comes from vault and is not part of artifacts
+        self.fingerprint = digest(*artifacts, *[ f"{s.name}:{s.status.value}" for s in self.secrets.values() ])
 
         # logger.debug(f"{self} building module {self.name} in {stack.name} from {path} to {dest}")
         sd.counters.modules += 1
+        sd.events.emit("module.build", cluster=cluster, stack=stack, module=self,
+                       build_path=dest, fingerprint=self.fingerprint, duration=time.time() - start)
 
          
 class StackModel(BaseModel):
@@ -367,10 +586,14 @@ class StackModel(BaseModel):
     backend: Backend | None = None
     spec: SpecModel | None = None
     stack_schema: Any = Field({}, alias="schema")
+    artifacts: list[str] = [] # optional artifacts of every module
+    skip_artifacts: list[str] = [] # optional artifacts never written for any module
+    fingerprint: str | None = None
 
 
 class Stack(StackModel):
     spec: Spec | None = None
+    _compiled_schemas: tuple | None = PrivateAttr(default=None)
 
     class Config:
         orm_mode = True
@@ -387,7 +610,62 @@ class Stack(StackModel):
     def __str__(self) -> str:
         return f"<{self.__class__.__name__}:{self.name}>"
 
+    def intern(self, interned: dict[str, dict[str, Any]]) -> None:
+        """
+        shares spec source, rendered text and stack_schema with stack previously loaded
+        from same spec path when they are identical. interned maps spec path to last seen
+        values, shared schemas are never mutated
+        """
+        if not self.spec or self.spec.rendered is None:
+            return
+        rendered_digest = digest(self.spec.rendered)
+        entry = interned.get(self.spec.path)
+        if entry is None:
+            interned[self.spec.path] = dict(source=self.spec.source, rendered_digest=rendered_digest,
+                                            rendered=self.spec.rendered, schema=self.stack_schema)
+            return
+
+        if entry["source"] == self.spec.source:
+            self.spec.source = entry["source"]
+        else:
+            entry["source"] = self.spec.source
+
+        if entry["rendered_digest"] == rendered_digest:
+            self.spec.rendered = entry["rendered"]
+        else:
+            entry["rendered_digest"], entry["rendered"] = rendered_digest, self.spec.rendered
 
-    def build(self, **kwargs):
+        # rendered text may differ by cluster vars while schema is the same, so schemas are compared
+        if entry["schema"] is self.stack_schema or entry["schema"] == self.stack_schema:
+            self.stack_schema = entry["schema"]
+            if "schema" in self.spec.data:
+                self.spec.data["schema"] = self.stack_schema
+        else:
+            entry["schema"] = self.stack_schema
+
+    @property
+    def compiled_schemas(self) -> tuple[str, "validation.StackSchemas"]:
+        """
+        digest and validators of stack_schema components, compiled once per stack
+        """
+        if self._compiled_schemas is None:
+            self._compiled_schemas = validation.compile_schemas(self.stack_schema)
+        return self._compiled_schemas
+
+    def build(self, streaming: bool = False, **kwargs) -> StackBuildRecord | None:
+        """
+        in streaming mode every module is released right after its artifacts are written
+        and stack build record is returned
+        """
+        records = []
         for module in self.modules.values():
-            module.build(stack=self, **kwargs)
\ No newline at end of file
+            module.build(stack=self, **kwargs)
+            if streaming:
+                records.append(module.record(stack=self, **kwargs))
+                module.release()
+
+        self.fingerprint = digest(self.spec.fingerprint if self.spec else None,
+                                  *[ m.fingerprint for m in self.modules.values() ])
+        if streaming:
+            return StackBuildRecord(name=self.name, fingerprint=self.fingerprint, modules=records)
+        return None
@@ -0,0 +1,90 @@
+# json schema validation of module secrets and vars against stack schema components
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from stackdiac.api.metrics import vault_call
+from stackdiac.models.fingerprint import data_digest
+import jsonschema
+
+logger = logging.getLogger(__name__)
+
+
+class StackSchemas:
+    """
+    validators of stack schema components, compiled once per schema name.
+    $refs to #/components/schemas/... resolve inside stack schema
+    """
+
+    def __init__(self, stack_schema: dict[str, Any]) -> None:
+        self.components = (stack_schema or {}).get("components", {})
+        self._validators: dict[str, Any] = {}
+
+    def validator(self, name: str):
+        v = self._validators.get(name)
+        if v is None:
+            if name not in self.components.get("schemas", {}):
+                raise KeyError(f"schema {name} not found in stack schema components")
+            schema = { "$ref": f"#/components/schemas/{name}", "components": self.components }
+            cls = jsonschema.validators.validator_for(schema, default=jsonschema.Draft7Validator)
+            v = self._validators[name] = cls(schema)
+        return v
+
+    def errors(self, name: str, instance: Any) -> list[str]:
+        return [ f"{'/'.join(str(p) for p in e.absolute_path) or '.'}: {e.message}"
+                 for e in self.validator(name).iter_errors(instance) ]
+
+
+# compiled stack schemas by schema digest, stacks of every cluster sharing schema reuse them
+_compiled: OrderedDict[str, StackSchemas] = OrderedDict()
+
+# secret validation errors by (kv path, secret version, schema digest and type)
+_secret_errors: OrderedDict[tuple[str, int, str], tuple[str, ...]] = OrderedDict()
+
+CACHE_SIZE = 4096
+
+
+_lock = threading.Lock()
+
+
+def _lru_get(cache: OrderedDict, key, make):
+    with _lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+            return value
+    value = make()
+    with _lock:
+        cache[key] = value
+        if len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+    return value
+
+
+def compile_schemas(stack_schema: dict[str, Any]) -> tuple[str, StackSchemas]:
+    """
+    digest of stack schema and its compiled validators
+    """
+    key = data_digest(stack_schema)
+    return key, _lru_get(_compiled, key, lambda: StackSchemas(stack_schema))
+
+
+def secret_errors(compiled: tuple[str, StackSchemas], secret_type: str, path: str,
+                  version: int, data: dict[str, Any]) -> list[str]:
+    """
+    validation errors of secret data, cached by secret version
+    """
+    key, schemas = compiled
+    return list(_lru_get(_secret_errors, (path, version, f"{key}:{secret_type}"),
+                         lambda: tuple(schemas.errors(secret_type, data))))
+
+
+def validate_secret(vault, compiled: tuple[str, StackSchemas], secret_type: str, path: str) -> list[str]:
+    """
+    reads current version of secret at kv path and validates it against secret_type schema
+    """
+    with vault_call("read_secret_version"):
+        resp = vault.kv.v2.read_secret_version(path=path, mount_point='kv')
+    return secret_errors(compiled, secret_type, path, resp["data"]["metadata"]["version"], resp["data"]["data"])
@@ -0,0 +1,38 @@
+import logging
+from typing import Any, IO
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# libyaml C loaders when pyyaml is built with them, pure python otherwise
+try:
+    from yaml import CSafeLoader as SafeLoader, CFullLoader as FullLoader
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeLoader, FullLoader
+    LIBYAML = False
+
+# include constructors of first configured project are registered on both safe loader classes,
+# so code still calling yaml.safe_load resolves !include the same way
+SAFE_LOADERS = (SafeLoader,) if SafeLoader is yaml.SafeLoader else (SafeLoader, yaml.SafeLoader)
+
+
+def safe_loader_class(name: str = "StackdSafeLoader") -> type:
+    """
+    SafeLoader subclass, constructors added to it do not touch other loaders
+    """
+    return type(name, (SafeLoader,), {})
+
+
+def safe_load(stream: str | bytes | IO, loader_class: type | None = None) -> Any:
+    return yaml.load(stream, Loader=loader_class or SafeLoader)
+
+
+def full_load(stream: str | bytes | IO) -> Any:
+    return yaml.load(stream, Loader=FullLoader)
+
+
+def load_file(path: str, full: bool = False) -> Any:
+    with open(path) as f:
+        return full_load(f) if full else safe_load(f)
@@ -1,4 +1,6 @@
 from .sdmod import sd
 from .stackd import Stackd, ProcessException
+from . import stream
+from . import jobs
 
 __all__ = [sd, Stackd, ProcessException]
\ No newline at end of file
@@ -0,0 +1,163 @@
+# changed files to affected modules, from files each module build reads
+
+import json
+import logging
+import os
+
+import git
+
+from .watch import ChangePlan, Target
+
+logger = logging.getLogger(__name__)
+
+
+class ReadIndex:
+    """
+    files and directories read by module builds, by module id <cluster>/<stack>/<module>.
+    saved in .stackd/reads.json with paths relative to project root
+    """
+
+    def __init__(self, root: str, reads: dict[str, list[str]] | None = None) -> None:
+        self.root = root
+        self.reads: dict[str, list[str]] = reads or {}
+
+    @classmethod
+    def from_build(cls, sd) -> "ReadIndex":
+        """
+        index of modules in built clusters of sd, regular and streaming builds
+        """
+        index = cls(sd.root)
+        for cluster in sd.clusters.loaded().values():
+            for name, stack in cluster.built_stacks.items():
+                cluster_stack = cluster.stacks[name]
+                for module in stack.modules.values():
+                    index.reads[f"{cluster.name}/{stack.name}/{module.name}"] = \
+                        module.build_reads(cluster, cluster_stack, stack, sd)
+            for record in cluster.built_records.values():
+                for m in record.modules:
+                    index.reads[f"{cluster.name}/{m.stack}/{m.module}"] = m.reads
+        return index
+
+    @staticmethod
+    def path(sd) -> str:
+        return os.path.join(sd.dataroot, "reads.json")
+
+    @classmethod
+    def load(cls, sd) -> "ReadIndex | None":
+        path = cls.path(sd)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return cls(sd.root, { k: [ cls._abs(sd.root, p) for p in v ] for k, v in data.items() })
+
+    def update(self, other: "ReadIndex") -> None:
+        self.reads.update(other.reads)
+
+    def save(self, sd) -> None:
+        path = self.path(sd)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with sd.locks.file("reads"):
+            with open(tmp, "w") as f:
+                json.dump({ k: [ self._rel(p) for p in v ] for k, v in sorted(self.reads.items()) }, f, indent=1)
+            os.replace(tmp, path)
+
+    def _rel(self, path: str) -> str:
+        if path == self.root or path.startswith(self.root + os.sep):
+            return os.path.relpath(path, self.root) + (os.sep if path.endswith(os.sep) else "")
+        return path
+
+    @staticmethod
+    def _abs(root: str, path: str) -> str:
+        return path if os.path.isabs(path) else os.path.join(root, path)
+
+    def affected(self, paths: list[str]) -> list[str]:
+        """
+        ids of modules which read any of paths
+        """
+        return sorted(self.read_files(paths))
+
+    def read_files(self, paths: list[str]) -> dict[str, list[str]]:
+        """
+        ids of modules which read any of paths with real paths of files among them read as files,
+        not as part of read directory
+        """
+        paths = [ os.path.realpath(p) for p in paths ]
+        result = {}
+        for module_id, reads in self.reads.items():
+            # project root may be reached through symlink, git reports real paths
+            files = { os.path.realpath(r) for r in reads if not r.endswith(os.sep) }
+            dirs = tuple(os.path.join(os.path.realpath(r), "") for r in reads if r.endswith(os.sep))
+            if any(p in files or p.startswith(dirs) for p in paths):
+                result[module_id] = [ p for p in paths if p in files ]
+        return result
+
+    def targets(self, sd, paths: list[str]) -> list[Target]:
+        """
+        targets affected by changed paths. changed cluster files and their includes affect their
+        cluster as a whole, stack specs and their includes whole stack, as they may add modules
+        not in index yet. other reads (module vars, sources) affect the module
+        """
+        # files every module reads, they add no modules
+        project_files = { os.path.realpath(p) for p in (sd.config_file, sd.resolve_path("core:versions.yaml")) }
+        cluster_files = { os.path.realpath(sd.clusters.path(name)) for name in sd.clusters.files }
+
+        clusters, stacks, modules = set(), set(), []
+        for module_id, files in self.read_files(paths).items():
+            cluster, stack, module = module_id.split("/")
+            if cluster not in sd.clusters:
+                continue
+            vars_file = os.path.realpath(os.path.join(sd.root, "vars", cluster, stack, module, "vars.yaml"))
+            specs = [ f for f in files if f not in project_files and f != vars_file ]
+            if any(f in cluster_files for f in specs):
+                clusters.add(cluster)
+            elif specs:
+                stacks.add((cluster, stack))
+            else:
+                modules.append((cluster, stack, module))
+
+        targets = [ Target(cluster=c) for c in sorted(clusters) ]
+        targets += [ Target(cluster=c, stack=s) for c, s in sorted(stacks) if c not in clusters ]
+        targets += [ Target(cluster=c, stack=s, module=m) for c, s, m in modules
+                     if c not in clusters and (c, s) not in stacks ]
+        return targets
+
+
+def update_index(sd, replace: bool = False) -> ReadIndex:
+    """
+    merges reads of modules built by sd into saved index.
+    replace drops modules not built, for full project builds
+    """
+    built = ReadIndex.from_build(sd)
+    # other processes may update index meanwhile
+    with sd.locks.file("reads"):
+        index = (not replace and ReadIndex.load(sd)) or ReadIndex(sd.root)
+        index.update(built)
+        index.save(sd)
+    return index
+
+
+def changed_files(root: str, since: str) -> list[str]:
+    """
+    absolute paths of files changed since git ref, working tree changes and untracked files included
+    """
+    repo = git.Repo(root, search_parent_directories=True)
+    names = repo.git.diff("--name-only", since).splitlines()
+    names += repo.untracked_files
+    return sorted({ os.path.join(repo.working_tree_dir, n) for n in names if n })
+
+
+def affected_targets(sd, index: ReadIndex, since: str) -> list[Target]:
+    """
+    modules affected by changes since git ref, see ReadIndex.targets.
+    clusters missing from index (new or never built) are affected as a whole
+    """
+    indexed = { i.split("/")[0] for i in index.reads }
+    plan = ChangePlan()
+    for name in sorted(sd.clusters):
+        if name not in indexed:
+            plan.add(Target(cluster=name))
+    for target in index.targets(sd, changed_files(sd.root, since)):
+        plan.add(target)
+    return plan.targets
@@ -0,0 +1,72 @@
+# clusters of project by name, parsed on first access
+
+import os
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator
+
+
+class ClusterMap(MutableMapping):
+    """
+    configure indexes cluster files of clusters dir by name only, cluster spec is rendered
+    and parsed by load(filename) when cluster is first accessed. membership, iteration over
+    names and len never parse, values() and items() parse every cluster
+    """
+
+    def __init__(self, load: Callable[[str], Any], clusters_dir: str, filenames: list[str] | None = None) -> None:
+        self._load = load
+        self.clusters_dir = clusters_dir
+        self.files: dict[str, str] = { os.path.splitext(f)[0]: f for f in sorted(filenames or []) }
+        self._clusters: dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.clusters_dir, self.files[name])
+
+    def loaded(self) -> dict[str, Any]:
+        """
+        clusters parsed so far, without parsing others
+        """
+        return dict(self._clusters)
+
+    def __getitem__(self, name: str) -> Any:
+        cluster = self._clusters.get(name)
+        if cluster is not None:
+            return cluster
+        if name not in self.files:
+            raise KeyError(name)
+        with self._lock:
+            if name not in self._clusters:
+                self._clusters[name] = self._load(self.files[name])
+            return self._clusters[name]
+
+    def __setitem__(self, name: str, cluster: Any) -> None:
+        self._clusters[name] = cluster
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        self.files.pop(name, None)
+        self._clusters.pop(name, None)
+
+    def pop(self, name: str, default: Any = None) -> Any:
+        """
+        removes cluster, returns it only when it was parsed
+        """
+        cluster = self._clusters.get(name, default)
+        if name in self:
+            del self[name]
+        return cluster
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.files or name in self._clusters
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.files
+        yield from (n for n in list(self._clusters) if n not in self.files)
+
+    def __len__(self) -> int:
+        return len(self.files.keys() | self._clusters.keys())
+
+    def __repr__(self) -> str:
+        return f"<ClusterMap {list(self)} loaded: {list(self._clusters)}>"
@@ -0,0 +1,69 @@
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class Event(BaseModel):
+    """
+    progress event emitted while building and running operations.
+
+    kinds:
+      module.build       module artifacts written
+      cluster.build      cluster build finished
+      step.start         pipeline step started
+      step.finish        pipeline step finished, data.returncode set
+      terragrunt.output  one line of terragrunt output
+      done, error        end of stream markers
+    """
+    kind: str
+    time: float = 0.0
+    cluster: str | None = None
+    stack: str | None = None
+    module: str | None = None
+    data: dict[str, Any] = {}
+
+
+Listener = Callable[[Event], None]
+
+
+class EventBus:
+    """
+    synchronous fan-out of events to subscribed listeners.
+    emit is cheap when nobody is subscribed
+    """
+
+    def __init__(self) -> None:
+        self._listeners: list[Listener] = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._listeners)
+
+    def subscribe(self, listener: Listener) -> Listener:
+        with self._lock:
+            self._listeners = [*self._listeners, listener]
+        return listener
+
+    def unsubscribe(self, listener: Listener) -> None:
+        with self._lock:
+            self._listeners = [ l for l in self._listeners if l is not listener ]
+
+    def emit(self, kind: str, cluster=None, stack=None, module=None, **data) -> None:
+        if not self._listeners:
+            return
+        event = Event(kind=kind, time=time.time(),
+                      cluster=getattr(cluster, "name", cluster),
+                      stack=getattr(stack, "name", stack),
+                      module=getattr(module, "name", module),
+                      data=data)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"event listener {listener} failed on {kind}: {e}")
@@ -1,11 +1,12 @@
 
 import json
 from typing import Any
-import yaml
+
+from ..models import yamlio
 
 
 def from_yaml(src) -> dict[str, Any]:
-    return yaml.safe_load(src)
+    return yamlio.safe_load(src)
 
 def to_json(data, **kwargs) -> str:
     return json.dumps(data, **kwargs)
\ No newline at end of file
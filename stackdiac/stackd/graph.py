@@ -0,0 +1,308 @@
+# module dependency graph of built cluster
+
+import json
+import logging
+import os
+import time
+from typing import Any
+
+from pydantic import BaseModel
+
+from stackdiac.api import app as api_app
+
+logger = logging.getLogger(__name__)
+
+
+class ModuleNode(BaseModel):
+    """
+    built module, id is <stack>/<module>
+    """
+    id: str
+    cluster: str
+    stack: str
+    module: str
+    build_path: str
+    deps: list[str] = []
+    fingerprint: str | None = None
+    backend: dict[str, Any] = {}
+
+
+class ModuleGraph:
+    """
+    modules of built cluster with edges from module deps and inputs.
+    both regular and streaming cluster builds are supported
+    """
+
+    def __init__(self, cluster: str, nodes: dict[str, ModuleNode] | None = None) -> None:
+        self.cluster = cluster
+        self.nodes: dict[str, ModuleNode] = nodes or {}
+
+    @classmethod
+    def from_cluster(cls, cluster, sd) -> "ModuleGraph":
+        graph = cls(cluster.name)
+        for stack in cluster.built_stacks.values():
+            for module in stack.modules.values():
+                deps = []
+                for d in [*module.build_deps(stack=stack, module=module, cluster=cluster, deps=module.deps, sd=sd),
+                          *module.build_deps(stack=stack, module=module, cluster=cluster, deps=module.inputs, sd=sd)]:
+                    dep_id = f"{d.stack_name}/{d.module_name}"
+                    if dep_id not in deps:
+                        deps.append(dep_id)
+                node = ModuleNode(id=f"{stack.name}/{module.name}", cluster=cluster.name, stack=stack.name,
+                                  module=module.name, build_path=module.get_build_dir(cluster, stack, sd=sd), deps=deps,
+                                  fingerprint=module.fingerprint, backend=module.built_backend)
+                graph.nodes[node.id] = node
+        # streaming builds keep module build records only
+        for record in cluster.built_records.values():
+            for m in record.modules:
+                node = ModuleNode(id=f"{m.stack}/{m.module}", cluster=cluster.name, stack=m.stack, module=m.module,
+                                  build_path=m.build_path, deps=m.deps, fingerprint=m.fingerprint, backend=m.backend)
+                graph.nodes[node.id] = node
+        return graph
+
+    def subgraph(self, ids: list[str]) -> "ModuleGraph":
+        """
+        graph limited to ids, edges to modules outside are dropped
+        """
+        keep = set(ids)
+        nodes = { i: self.nodes[i].copy(update=dict(deps=[ d for d in self.nodes[i].deps if d in keep ]))
+                  for i in self.nodes if i in keep }
+        return ModuleGraph(self.cluster, nodes)
+
+    def select(self, stack: str | None = None, module: str | None = None) -> "ModuleGraph":
+        return self.subgraph([ i for i, n in self.nodes.items()
+                               if (stack is None or n.stack == stack) and (module is None or n.module == module) ])
+
+    def dependents(self) -> dict[str, list[str]]:
+        result: dict[str, list[str]] = { i: [] for i in self.nodes }
+        for i, n in self.nodes.items():
+            for d in n.deps:
+                if d in result:
+                    result[d].append(i)
+        return result
+
+    def topological_order(self) -> list[str]:
+        """
+        dependencies first. raises ValueError on cycles
+        """
+        order = []
+        state: dict[str, int] = {}
+
+        def visit(i, path):
+            if state.get(i) == 2:
+                return
+            if state.get(i) == 1:
+                raise ValueError(f"dependency cycle: {' -> '.join([*path, i])}")
+            state[i] = 1
+            for d in self.nodes[i].deps:
+                if d in self.nodes:
+                    visit(d, [*path, i])
+            state[i] = 2
+            order.append(i)
+
+        for i in sorted(self.nodes):
+            visit(i, [])
+        return order
+
+    def reversed(self) -> "ModuleGraph":
+        """
+        same modules with edges inverted, for destroy
+        """
+        dependents = self.dependents()
+        return ModuleGraph(self.cluster, { i: n.copy(update=dict(deps=dependents[i])) for i, n in self.nodes.items() })
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def edges(self) -> list[tuple[str, str]]:
+        """
+        (module, dependency) pairs, dangling ones included
+        """
+        return [ (i, d) for i in sorted(self.nodes) for d in self.nodes[i].deps ]
+
+    def dangling(self) -> list[tuple[str, str]]:
+        """
+        deps and inputs referring to modules missing from cluster
+        """
+        return [ (i, d) for i, d in self.edges() if d not in self.nodes ]
+
+    def cycles(self) -> list[list[str]]:
+        """
+        strongly connected components with more than one module or self dependency (tarjan)
+        """
+        index: dict[str, int] = {}
+        low: dict[str, int] = {}
+        stack: list[str] = []
+        on_stack: set[str] = set()
+        result = []
+
+        def connect(i):
+            index[i] = low[i] = len(index)
+            stack.append(i)
+            on_stack.add(i)
+            for d in self.nodes[i].deps:
+                if d not in self.nodes:
+                    continue
+                if d not in index:
+                    connect(d)
+                    low[i] = min(low[i], low[d])
+                elif d in on_stack:
+                    low[i] = min(low[i], index[d])
+            if low[i] == index[i]:
+                component = []
+                while True:
+                    j = stack.pop()
+                    on_stack.discard(j)
+                    component.append(j)
+                    if j == i:
+                        break
+                if len(component) > 1 or i in self.nodes[i].deps:
+                    result.append(sorted(component))
+
+        for i in sorted(self.nodes):
+            if i not in index:
+                connect(i)
+        return result
+
+    def critical_path(self, durations: dict[str, float]) -> tuple[list[str], float]:
+        """
+        dependency chain with longest total duration, modules without timing count as 0
+        """
+        finish: dict[str, float] = {}
+        previous: dict[str, str | None] = {}
+        for i in self.topological_order():
+            deps = [ d for d in self.nodes[i].deps if d in self.nodes ]
+            before = max(deps, key=lambda d: finish[d], default=None)
+            previous[i] = before
+            finish[i] = (finish[before] if before else 0.0) + durations.get(i, 0.0)
+        if not finish:
+            return [], 0.0
+        i = max(finish, key=lambda n: finish[n])
+        total = finish[i]
+        path = []
+        while i is not None:
+            path.append(i)
+            i = previous[i]
+        return list(reversed(path)), total
+
+    def analyze(self, durations: dict[str, float] | None = None) -> "GraphReport":
+        durations = durations or {}
+        report = GraphReport(cluster=self.cluster, modules=len(self.nodes), edges=len(self.edges()),
+                             cycles=self.cycles(), dangling=[ list(e) for e in self.dangling() ])
+        if report.cycles:
+            return report
+        report.critical_path, report.critical_time = self.critical_path(durations)
+        report.serial_time = sum(durations.get(i, 0.0) for i in self.nodes)
+        report.untimed = sorted(i for i in self.nodes if i not in durations)
+        if report.critical_time:
+            report.speedup = report.serial_time / report.critical_time
+        return report
+
+    def to_json(self) -> dict[str, Any]:
+        return dict(cluster=self.cluster,
+                    nodes=[ dict(id=n.id, stack=n.stack, module=n.module, build_path=n.build_path)
+                            for n in sorted(self.nodes.values(), key=lambda n: n.id) ],
+                    edges=[ dict(source=i, target=d, dangling=d not in self.nodes) for i, d in self.edges() ])
+
+    def to_dot(self, durations: dict[str, float] | None = None, highlight: list[str] | None = None) -> str:
+        """
+        graphviz digraph, stacks as clusters, edges point from module to its dependency
+        """
+        durations = durations or {}
+        highlight = highlight or []
+        critical = set(zip(highlight[1:], highlight[:-1]))
+        lines = [f'digraph "{self.cluster}" {{', "  rankdir=RL;", "  node [shape=box];"]
+        stacks: dict[str, list[ModuleNode]] = {}
+        for n in self.nodes.values():
+            stacks.setdefault(n.stack, []).append(n)
+        for stack in sorted(stacks):
+            lines.append(f'  subgraph "cluster_{stack}" {{')
+            lines.append(f'    label="{stack}";')
+            for n in sorted(stacks[stack], key=lambda n: n.id):
+                label = n.module + (f"\\n{durations[n.id]:.1f}s" if n.id in durations else "")
+                style = ", color=red" if n.id in highlight else ""
+                lines.append(f'    "{n.id}" [label="{label}"{style}];')
+            lines.append("  }")
+        for i, d in self.edges():
+            if d not in self.nodes:
+                lines.append(f'  "{d}" [style=dashed, color=gray];')
+                lines.append(f'  "{i}" -> "{d}" [style=dashed, color=gray];')
+            else:
+                style = " [color=red]" if (i, d) in critical else ""
+                lines.append(f'  "{i}" -> "{d}"{style};')
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+
+class GraphReport(BaseModel):
+    cluster: str
+    modules: int
+    edges: int
+    cycles: list[list[str]] = []
+    dangling: list[list[str]] = [] # [module, missing dependency]
+    critical_path: list[str] = []
+    critical_time: float = 0.0 # lower bound of fully parallel run
+    serial_time: float = 0.0
+    speedup: float | None = None # serial_time / critical_time
+    untimed: list[str] = []
+
+    @property
+    def valid(self) -> bool:
+        return not self.cycles and not self.dangling
+
+
+class StepTimings:
+    """
+    last successful terragrunt run duration per module and command,
+    in .stackd/timings/<cluster>.json
+    """
+
+    def __init__(self, sd, cluster: str) -> None:
+        self.path = os.path.join(sd.dataroot, "timings", f"{cluster}.json")
+        self.cluster = cluster
+        self.locks = sd.locks
+        self.timings: dict[str, dict[str, dict[str, float]]] = self._load()
+
+    def _load(self) -> dict[str, dict[str, dict[str, float]]]:
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def record(self, module_id: str, command: str, duration: float) -> None:
+        self.timings.setdefault(module_id, {})[command] = dict(duration=duration, time=time.time())
+
+    def durations(self, command: str) -> dict[str, float]:
+        return { i: t[command]["duration"] for i, t in self.timings.items() if command in t }
+
+    def save(self) -> None:
+        """
+        merges with timings saved by concurrent runs, latest record wins
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self.locks.file(f"timings-{self.cluster}"):
+            timings = self._load()
+            for module_id, commands in self.timings.items():
+                for command, t in commands.items():
+                    saved = timings.setdefault(module_id, {}).get(command)
+                    if saved is None or saved["time"] <= t["time"]:
+                        timings[module_id][command] = t
+            with open(tmp, "w") as f:
+                json.dump(timings, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        self.timings = timings
+
+
+@api_app.get("/graph/{cluster_name}", operation_id="get_cluster_graph", tags=["cluster"])
+async def get_cluster_graph(cluster_name: str, command: str = "apply") -> dict[str, Any]:
+    """
+    module graph of built cluster with validation and critical path by recorded timings of command
+    """
+    from stackdiac.stackd import Stackd
+    sd = Stackd()
+    sd.configure()
+    sd.build(cluster=cluster_name, streaming=True)
+    graph = ModuleGraph.from_cluster(sd.clusters[cluster_name], sd)
+    return dict(graph=graph.to_json(),
+                report=graph.analyze(StepTimings(sd, cluster_name).durations(command)).dict())
@@ -0,0 +1,287 @@
+# sqlite index of built clusters, stacks and modules answering queries without configure and build
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any
+
+from fastapi import HTTPException
+
+from stackdiac.api import app as api_app
+from .graph import StepTimings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    name TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    indexed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stacks (
+    cluster TEXT NOT NULL,
+    name TEXT NOT NULL,
+    fingerprint TEXT,
+    PRIMARY KEY (cluster, name)
+);
+CREATE TABLE IF NOT EXISTS modules (
+    cluster TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    name TEXT NOT NULL,
+    build_path TEXT NOT NULL,
+    fingerprint TEXT,
+    backend TEXT,
+    PRIMARY KEY (cluster, stack, name)
+);
+CREATE TABLE IF NOT EXISTS vars (
+    cluster TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    module TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS vars_name ON vars (name);
+CREATE INDEX IF NOT EXISTS vars_module ON vars (cluster, stack, module);
+CREATE TABLE IF NOT EXISTS deps (
+    cluster TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    module TEXT NOT NULL,
+    dep TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deps_dep ON deps (cluster, dep);
+CREATE INDEX IF NOT EXISTS deps_module ON deps (cluster, stack, module);
+CREATE TABLE IF NOT EXISTS secrets (
+    cluster TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    module TEXT NOT NULL,
+    name TEXT NOT NULL,
+    secret_type TEXT,
+    required INTEGER NOT NULL DEFAULT 0,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS secrets_name ON secrets (name);
+CREATE INDEX IF NOT EXISTS secrets_module ON secrets (cluster, stack, module);
+CREATE TABLE IF NOT EXISTS timings (
+    cluster TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    module TEXT NOT NULL,
+    command TEXT NOT NULL,
+    duration REAL,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS timings_module ON timings (cluster, stack, module);
+"""
+
+# tables with rows per cluster, replaced on every index update of fully built cluster
+CLUSTER_TABLES = ("stacks", "modules", "vars", "deps", "secrets", "timings")
+
+# tables with rows per module, replaced for every built stack
+MODULE_TABLES = ("modules", "vars", "deps", "secrets")
+
+
+def module_records(cluster, sd):
+    """
+    ModuleBuildRecord of every built module of cluster, regular and streaming builds
+    """
+    for name, stack in cluster.built_stacks.items():
+        for module in stack.modules.values():
+            yield module.record(cluster, cluster.stacks[name], stack, sd)
+    for record in cluster.built_records.values():
+        yield from record.modules
+
+
+class BuildIndex:
+    """
+    built clusters in .stackd/index.db. rows of fully built cluster are replaced when it is indexed again,
+    for partly built cluster (`build -t cluster:stack`, `build --since`) only rows of built stacks are
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @staticmethod
+    def default_path(sd) -> str:
+        return os.path.join(sd.dataroot, "index.db")
+
+    @contextmanager
+    def _connect(self, readonly: bool = False):
+        if readonly:
+            db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        else:
+            db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def update(self, sd) -> int:
+        """
+        indexes built clusters of sd, returns count of indexed modules
+        """
+        count = 0
+        now = time.time()
+        with self._connect() as db:
+            # clusters removed from project
+            for row in db.execute("SELECT name FROM clusters").fetchall():
+                if row["name"] not in sd.clusters:
+                    self._delete_cluster(db, row["name"])
+            for cluster in sd.clusters.loaded().values():
+                stacks = { **{ n: s.fingerprint for n, s in cluster.built_stacks.items() },
+                           **{ n: r.fingerprint for n, r in cluster.built_records.items() } }
+                if not stacks:
+                    continue
+                if stacks.keys() >= cluster.stacks.keys():
+                    self._delete_cluster(db, cluster.name)
+                    db.execute("INSERT INTO clusters (name, fingerprint, indexed) VALUES (?, ?, ?)",
+                               (cluster.name, cluster.fingerprint, now))
+                else:
+                    # other stacks keep rows of their last build, cluster keeps fingerprint of last full build
+                    for name in stacks:
+                        self._delete_stack(db, cluster.name, name)
+                    db.execute("DELETE FROM timings WHERE cluster = ?", (cluster.name,))
+                    db.execute("INSERT INTO clusters (name, fingerprint, indexed) VALUES (?, NULL, ?) "
+                               "ON CONFLICT (name) DO UPDATE SET indexed = excluded.indexed", (cluster.name, now))
+                db.executemany("INSERT INTO stacks (cluster, name, fingerprint) VALUES (?, ?, ?)",
+                               [ (cluster.name, n, fp) for n, fp in stacks.items() ])
+                for m in module_records(cluster, sd):
+                    self._insert_module(db, cluster.name, m)
+                    count += 1
+                for module_id, commands in StepTimings(sd, cluster.name).timings.items():
+                    stack, module = module_id.split("/")
+                    db.executemany("INSERT INTO timings (cluster, stack, module, command, duration, time) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)",
+                                   [ (cluster.name, stack, module, c, t["duration"], t["time"])
+                                     for c, t in commands.items() ])
+        return count
+
+    @staticmethod
+    def _delete_cluster(db, cluster: str) -> None:
+        db.execute("DELETE FROM clusters WHERE name = ?", (cluster,))
+        for table in CLUSTER_TABLES:
+            db.execute(f"DELETE FROM {table} WHERE cluster = ?", (cluster,))
+
+    @staticmethod
+    def _delete_stack(db, cluster: str, stack: str) -> None:
+        db.execute("DELETE FROM stacks WHERE cluster = ? AND name = ?", (cluster, stack))
+        for table in MODULE_TABLES:
+            db.execute(f"DELETE FROM {table} WHERE cluster = ? AND stack = ?", (cluster, stack))
+
+    @staticmethod
+    def _insert_module(db, cluster: str, m) -> None:
+        key = (cluster, m.stack, m.module)
+        db.execute("INSERT INTO modules (cluster, stack, name, build_path, fingerprint, backend) VALUES (?, ?, ?, ?, ?, ?)",
+                   (*key, m.build_path, m.fingerprint, json.dumps(m.backend)))
+        db.executemany("INSERT INTO deps (cluster, stack, module, dep) VALUES (?, ?, ?, ?)",
+                       [ (*key, d) for d in m.deps ])
+        db.executemany("INSERT INTO secrets (cluster, stack, module, name, secret_type, required, status) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [ (*key, n, s["secret_type"], int(s["required"]), s["status"]) for n, s in m.secrets.items() ])
+        # vars terraform gets, read back from written artifact
+        vars_file = os.path.join(m.build_path, "vars.tfvars.json")
+        if os.path.isfile(vars_file):
+            with open(vars_file) as f:
+                module_vars = json.load(f)
+            db.executemany("INSERT INTO vars (cluster, stack, module, name, value) VALUES (?, ?, ?, ?, ?)",
+                           [ (*key, n, json.dumps(v, sort_keys=True)) for n, v in module_vars.items() ])
+
+    def modules(self, cluster: str | None = None, stack: str | None = None, var: str | None = None,
+                secret: str | None = None, has_secrets: bool = False, depends_on: str | None = None) -> list[dict[str, Any]]:
+        """
+        modules matching all given filters: declaring var or secret, having secrets,
+        depending on <stack>/<module>
+        """
+        where, args = [], []
+        for column, value in (("m.cluster", cluster), ("m.stack", stack)):
+            if value:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if var:
+            where.append("EXISTS (SELECT 1 FROM vars v WHERE v.cluster = m.cluster AND v.stack = m.stack "
+                         "AND v.module = m.name AND v.name = ?)")
+            args.append(var)
+        if secret or has_secrets:
+            where.append("EXISTS (SELECT 1 FROM secrets s WHERE s.cluster = m.cluster AND s.stack = m.stack "
+                         "AND s.module = m.name" + (" AND s.name = ?)" if secret else ")"))
+            args.extend([secret] if secret else [])
+        if depends_on:
+            where.append("EXISTS (SELECT 1 FROM deps d WHERE d.cluster = m.cluster AND d.stack = m.stack "
+                         "AND d.module = m.name AND d.dep = ?)")
+            args.append(depends_on)
+        query = "SELECT m.cluster, m.stack, m.name, m.build_path, m.fingerprint FROM modules m"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        with self._connect(readonly=True) as db:
+            rows = db.execute(query + " ORDER BY m.cluster, m.stack, m.name", args).fetchall()
+        return [ dict(r) for r in rows ]
+
+    def module(self, cluster: str, stack: str, module: str) -> dict[str, Any] | None:
+        key = (cluster, stack, module)
+        match = "WHERE cluster = ? AND stack = ? AND module = ?"
+        with self._connect(readonly=True) as db:
+            row = db.execute("SELECT * FROM modules WHERE cluster = ? AND stack = ? AND name = ?", key).fetchone()
+            if row is None:
+                return None
+            result = dict(row, backend=json.loads(row["backend"]))
+            result["vars"] = { r["name"]: json.loads(r["value"])
+                               for r in db.execute(f"SELECT name, value FROM vars {match}", key) }
+            result["deps"] = [ r["dep"] for r in db.execute(f"SELECT dep FROM deps {match}", key) ]
+            result["dependents"] = [ f"{r['stack']}/{r['module']}" for r in db.execute(
+                "SELECT stack, module FROM deps WHERE cluster = ? AND dep = ?", (cluster, f"{stack}/{module}")) ]
+            result["secrets"] = { r["name"]: dict(secret_type=r["secret_type"], required=bool(r["required"]), status=r["status"])
+                                  for r in db.execute(f"SELECT * FROM secrets {match}", key) }
+            result["timings"] = { r["command"]: dict(duration=r["duration"], time=r["time"])
+                                  for r in db.execute(f"SELECT * FROM timings {match}", key) }
+        return result
+
+    def query(self, sql: str, args: tuple = ()) -> list[dict[str, Any]]:
+        """
+        read only sql over index tables
+        """
+        with self._connect(readonly=True) as db:
+            return [ dict(r) for r in db.execute(sql, args).fetchall() ]
+
+
+def update_build_index(sd) -> BuildIndex:
+    index = BuildIndex(BuildIndex.default_path(sd))
+    start = time.time()
+    count = index.update(sd)
+    logger.debug(f"indexed {count} modules in {time.time() - start:.3f}s")
+    return index
+
+
+def _open_index() -> BuildIndex:
+    from .stackd import Stackd
+    path = BuildIndex.default_path(Stackd())
+    if not os.path.isfile(path):
+        raise Exception(f"{path} not found, run stackd build first")
+    return BuildIndex(path)
+
+
+@api_app.get("/index/modules", operation_id="query_modules", tags=["index"])
+async def query_modules(cluster: str | None = None, stack: str | None = None, var: str | None = None,
+                        secret: str | None = None, has_secrets: bool = False,
+                        depends_on: str | None = None) -> list[dict[str, Any]]:
+    """
+    modules of last build matching filters, from index without building
+    """
+    return _open_index().modules(cluster=cluster, stack=stack, var=var, secret=secret,
+                                 has_secrets=has_secrets, depends_on=depends_on)
+
+
+@api_app.get("/index/module/{cluster_name}/{stack_name}/{module_name}", operation_id="query_module", tags=["index"])
+async def query_module(cluster_name: str, stack_name: str, module_name: str) -> dict[str, Any]:
+    """
+    indexed module with vars, deps, dependents, secret declarations and timings
+    """
+    result = _open_index().module(cluster_name, stack_name, module_name)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"{cluster_name}/{stack_name}/{module_name} is not indexed")
+    return result
@@ -0,0 +1,144 @@
+# reusable terraform init state: per module TF_DATA_DIR with providers shared by provider set
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+logger = logging.getLogger(__name__)
+
+NO_AUTO_INIT = "--terragrunt-no-auto-init"
+LOCK_FILE = ".terraform.lock.hcl"
+
+_source_re = re.compile(r'^\s*source\s*=\s*"([^"]+)"', re.M)
+
+
+def _block(text: str, name: str) -> str:
+    """
+    text of top level hcl block by name, empty when missing
+    """
+    m = re.search(rf"^{name}\s*\{{", text, re.M)
+    if not m:
+        return ""
+    depth = 0
+    for i in range(m.end() - 1, len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[m.start():i + 1]
+    return text[m.start():]
+
+
+def _tree_stamp(path: str) -> str:
+    """
+    hash of names, sizes and mtimes of terraform files under local module source
+    """
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            if filename.endswith((".tf", ".tf.json")):
+                st = os.stat(os.path.join(dirpath, filename))
+                h.update(f"{os.path.relpath(os.path.join(dirpath, filename), path)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+class ModuleInit:
+    """
+    init state of one built module. providers key is hash of _versions.tf,
+    stamp adds backend config and module source files
+    """
+
+    def __init__(self, cache: "InitCache", build_path: str, module_id: list[str]) -> None:
+        self.cache = cache
+        self.build_path = build_path
+        self.data_dir = os.path.join(cache.root, "modules", *module_id)
+        with open(os.path.join(build_path, "_versions.tf"), "rb") as f:
+            self.key = hashlib.sha256(f.read()).hexdigest()
+        with open(os.path.join(build_path, "terragrunt.hcl")) as f:
+            config = f.read()
+        source = _source_re.search(_block(config, "terraform"))
+        source_stamp = _tree_stamp(source.group(1)) if source and os.path.isdir(source.group(1)) else None
+        self.stamp = dict(providers=self.key,
+                          backend=hashlib.sha256(_block(config, "remote_state").encode()).hexdigest(),
+                          source=source_stamp)
+
+    @property
+    def providers_dir(self) -> str:
+        return os.path.join(self.cache.root, "providers", self.key)
+
+    @property
+    def stamp_file(self) -> str:
+        return os.path.join(self.data_dir, "stackd-init.json")
+
+    @property
+    def initialized(self) -> bool:
+        if not os.path.isfile(self.stamp_file) or not os.path.isdir(os.path.join(self.data_dir, "providers")):
+            return False
+        with open(self.stamp_file) as f:
+            return json.load(f) == self.stamp
+
+    def prepare(self) -> None:
+        """
+        links shared providers into data dir and seeds lock file of provider set
+        """
+        os.makedirs(self.providers_dir, exist_ok=True)
+        os.makedirs(self.data_dir, exist_ok=True)
+        link = os.path.join(self.data_dir, "providers")
+        if os.path.islink(link) and os.readlink(link) == self.providers_dir:
+            pass
+        else:
+            if os.path.islink(link) or os.path.isfile(link):
+                os.remove(link)
+            elif os.path.isdir(link):
+                shutil.rmtree(link)
+            os.symlink(self.providers_dir, link)
+        lock_file = os.path.join(self.build_path, LOCK_FILE)
+        if not os.path.exists(lock_file) and os.path.isfile(self.cached_lock_file):
+            shutil.copyfile(self.cached_lock_file, lock_file)
+
+    @property
+    def cached_lock_file(self) -> str:
+        return os.path.join(self.cache.root, "providers", f"{self.key}{LOCK_FILE}")
+
+    def done(self) -> None:
+        """
+        records successful init, lock file terragrunt copied back to build dir is kept for provider set
+        """
+        tmp = f"{self.stamp_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.stamp, f)
+        os.replace(tmp, self.stamp_file)
+        lock_file = os.path.join(self.build_path, LOCK_FILE)
+        if os.path.isfile(lock_file) and not os.path.isfile(self.cached_lock_file):
+            shutil.copyfile(lock_file, self.cached_lock_file)
+
+    def forget(self) -> None:
+        if os.path.isfile(self.stamp_file):
+            os.remove(self.stamp_file)
+
+
+class InitCache:
+    """
+    .stackd/cache/tf-init: modules/<cluster>/<stack>/<module> is TF_DATA_DIR of module,
+    its providers dir links to providers/<hash of _versions.tf> shared by modules with same providers.
+    init is skipped when providers, backend config and module sources are unchanged since last init
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def module(self, builddir: str, target: str) -> ModuleInit | None:
+        """
+        init state of module build dir target, None for other targets
+        """
+        rel = os.path.relpath(os.path.abspath(target), builddir).split(os.sep)
+        if len(rel) != 3 or rel[0] == os.pardir:
+            return None
+        if not all(os.path.isfile(os.path.join(target, f)) for f in ("_versions.tf", "terragrunt.hcl")):
+            return None
+        return ModuleInit(self, os.path.abspath(target), rel)
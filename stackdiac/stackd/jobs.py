@@ -0,0 +1,254 @@
+# background jobs for builds and operations started from the API
+
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable
+
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from stackdiac.api import app as api_app
+from .events import Event
+from .stackd import Stackd
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    INTERRUPTED = "interrupted" # was running when server stopped
+
+
+class Job(BaseModel):
+    id: str
+    kind: str # build | operation
+    target: str
+    cluster: str
+    status: JobStatus = JobStatus.PENDING
+    created: float
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.status not in (JobStatus.PENDING, JobStatus.RUNNING)
+
+    @property
+    def duration(self) -> float | None:
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+class JobManager:
+    """
+    runs jobs on bounded worker pool, never more than one job per cluster at once.
+    job records and logs are kept in .stackd/jobs
+    """
+
+    def __init__(self, root: str, max_workers: int = 4) -> None:
+        self.root = root
+        self.max_workers = max_workers
+        self.jobs: dict[str, Job] = {}
+        self._pending: list[str] = []
+        self._busy_clusters: set[str] = set()
+        self._running: dict[str, Stackd] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stackd-job")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def jobs_dir(self) -> str:
+        return os.path.join(self.root, ".stackd", "jobs")
+
+    def log_file(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.log")
+
+    def _job_file(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: Job) -> None:
+        tmp = self._job_file(job.id) + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(job.json())
+        os.replace(tmp, self._job_file(job.id))
+
+    def _load(self) -> None:
+        for path in glob.glob(os.path.join(self.jobs_dir, "*.json")):
+            try:
+                job = Job.parse_file(path)
+            except Exception as e:
+                logger.error(f"cannot load job record {path}: {e}")
+                continue
+            if not job.done:
+                job.status = JobStatus.INTERRUPTED
+                job.finished = job.finished or os.path.getmtime(path)
+                self._save(job)
+            self.jobs[job.id] = job
+        logger.debug(f"loaded {len(self.jobs)} jobs from {self.jobs_dir}")
+
+    def submit(self, kind: str, target: str, cluster: str) -> Job:
+        job = Job(id=uuid.uuid4().hex[:12], kind=kind, target=target, cluster=cluster, created=time.time())
+        with self._lock:
+            self.jobs[job.id] = job
+            self._pending.append(job.id)
+            self._save(job)
+        logger.info(f"job {job.id} {kind} {target} submitted")
+        self._dispatch()
+        return job
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            for job_id in list(self._pending):
+                if len(self._running) >= self.max_workers:
+                    break
+                job = self.jobs[job_id]
+                if job.cluster in self._busy_clusters:
+                    continue
+                self._pending.remove(job_id)
+                self._busy_clusters.add(job.cluster)
+                self._running[job_id] = Stackd(root=self.root)
+                self._executor.submit(self._run, job)
+
+    def _runner(self, job: Job) -> Callable[[Stackd], None]:
+        if job.kind == "build":
+            return lambda sd: sd.build(cluster=job.cluster)
+        if job.kind == "operation":
+            return lambda sd: sd.run_operation(target=job.target)
+        raise ValueError(f"unknown job kind {job.kind}")
+
+    def _run(self, job: Job) -> None:
+        sd = self._running[job.id]
+        job.status = JobStatus.RUNNING
+        job.started = time.time()
+        self._save(job)
+
+        with open(self.log_file(job.id), "a", buffering=1) as log:
+            listener = sd.events.subscribe(lambda event: log.write(format_event(event) + "\n"))
+            try:
+                sd.configure()
+                self._runner(job)(sd)
+            except Exception as e:
+                job.error = str(e)
+                job.status = JobStatus.CANCELLED if sd._cancelled else JobStatus.FAILED
+                log.write(f"error: {e}\n")
+                logger.error(f"job {job.id} {job.target} {job.status.value}: {e}")
+            else:
+                if sd._cancelled:
+                    # build only jobs run no terragrunt, cancel is noticed after they finish
+                    job.status, job.error = JobStatus.CANCELLED, "cancelled"
+                    log.write("cancelled\n")
+                else:
+                    job.status = JobStatus.SUCCEEDED
+            finally:
+                sd.events.unsubscribe(listener)
+
+        job.finished = time.time()
+        self._save(job)
+        logger.info(f"job {job.id} {job.target} {job.status.value} in {job.duration:.2f}s")
+        with self._lock:
+            self._running.pop(job.id, None)
+            self._busy_clusters.discard(job.cluster)
+        self._dispatch()
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.jobs[job_id]
+        with self._lock:
+            if job_id in self._pending:
+                self._pending.remove(job_id)
+                job.status = JobStatus.CANCELLED
+                job.finished = time.time()
+                self._save(job)
+            elif job_id in self._running:
+                self._running[job_id].cancel()
+        return job
+
+    def read_log(self, job_id: str, offset: int = 0) -> str:
+        path = self.log_file(job_id)
+        if not os.path.isfile(path):
+            return ""
+        with open(path) as f:
+            f.seek(offset)
+            return f.read()
+
+
+def format_event(event: Event) -> str:
+    if event.kind == "terragrunt.output":
+        return event.data["line"]
+    target = "/".join(x for x in (event.cluster, event.stack, event.module) if x)
+    if event.kind == "step.finish":
+        return f"[{event.kind}] {target} returncode={event.data.get('returncode')} {event.data.get('duration', 0):.2f}s"
+    return f"[{event.kind}] {target}"
+
+
+_manager: JobManager | None = None
+_manager_lock = threading.Lock()
+
+
+def configure_jobs(root: str, max_workers: int = 4) -> JobManager:
+    global _manager
+    with _manager_lock:
+        _manager = JobManager(root=root, max_workers=max_workers)
+    return _manager
+
+
+def get_job_manager() -> JobManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            from .sdmod import sd
+            _manager = JobManager(root=sd.root)
+    return _manager
+
+
+def _get_job(job_id: str) -> Job:
+    try:
+        return get_job_manager().jobs[job_id]
+    except KeyError:
+        raise Exception(f"Job {job_id} not found")
+
+
+@api_app.post("/jobs/build/{cluster_name}", operation_id="submit_build_job", response_model=Job, tags=["jobs"])
+async def submit_build_job(cluster_name: str) -> Job:
+    return get_job_manager().submit("build", target=cluster_name, cluster=cluster_name)
+
+
+@api_app.post("/jobs/operation/{cluster_name}/{stack_name}/{operation_name}", operation_id="submit_operation_job",
+              response_model=Job, tags=["jobs"])
+async def submit_operation_job(cluster_name: str, stack_name: str, operation_name: str) -> Job:
+    return get_job_manager().submit("operation", target=f"{cluster_name}/{stack_name}/{operation_name}",
+                                    cluster=cluster_name)
+
+
+@api_app.get("/jobs", operation_id="list_jobs", response_model=list[Job], tags=["jobs"])
+async def list_jobs() -> list[Job]:
+    return sorted(get_job_manager().jobs.values(), key=lambda j: j.created, reverse=True)
+
+
+@api_app.get("/jobs/{job_id}", operation_id="read_job", response_model=Job, tags=["jobs"])
+async def read_job(job_id: str) -> Job:
+    return _get_job(job_id)
+
+
+@api_app.get("/jobs/{job_id}/log", operation_id="read_job_log", response_class=PlainTextResponse, tags=["jobs"])
+async def read_job_log(job_id: str, offset: int = 0) -> str:
+    _get_job(job_id)
+    return get_job_manager().read_log(job_id, offset=offset)
+
+
+@api_app.delete("/jobs/{job_id}", operation_id="cancel_job", response_model=Job, tags=["jobs"])
+async def cancel_job(job_id: str) -> Job:
+    _get_job(job_id)
+    return get_job_manager().cancel(job_id)
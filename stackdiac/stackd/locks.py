@@ -0,0 +1,94 @@
+# advisory file locks letting concurrent stackd processes share project checkout
+
+import fcntl
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# terragrunt/terraform commands changing state, run under exclusive module lock
+STATE_COMMANDS = {"apply", "destroy", "import", "refresh", "taint", "untaint", "state", "force-unlock"}
+
+
+class _Held:
+    def __init__(self, fd: int, shared: bool) -> None:
+        self.fd = fd
+        self.shared = shared
+        self.count = 0
+
+
+class FileLocks:
+    """
+    flock based reader/writer locks on files in root.
+    locks are reentrant per thread, other threads and processes wait.
+    exclusive request while holding shared lock upgrades it
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._local = threading.local()
+
+    def _held(self) -> dict[str, _Held]:
+        if not hasattr(self._local, "held"):
+            self._local.held = {}
+        return self._local.held
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts[:-1], f"{parts[-1]}.lock")
+
+    @contextmanager
+    def lock(self, *parts: str, shared: bool = False):
+        path = self.path(*parts)
+        held = self._held()
+        h = held.get(path)
+        upgraded = False
+        if h is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            h = held[path] = _Held(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), shared)
+            self._acquire(h.fd, path, shared)
+        elif h.shared and not shared:
+            self._acquire(h.fd, path, shared=False)
+            h.shared, upgraded = False, True
+        h.count += 1
+        try:
+            yield
+        finally:
+            h.count -= 1
+            if h.count == 0:
+                del held[path]
+                fcntl.flock(h.fd, fcntl.LOCK_UN)
+                os.close(h.fd)
+            elif upgraded:
+                fcntl.flock(h.fd, fcntl.LOCK_SH)
+                h.shared = True
+
+    @staticmethod
+    def _acquire(fd: int, path: str, shared: bool) -> None:
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(fd, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(f"waiting for {'shared' if shared else 'exclusive'} lock {path}")
+            fcntl.flock(fd, mode)
+
+
+class ProjectLocks(FileLocks):
+    """
+    locks in .stackd/locks: cluster build dir (exclusive for build, shared for terragrunt runs),
+    module (exclusive for state changing commands) and project files updated by several processes
+    """
+
+    def cluster(self, cluster: str, shared: bool = False):
+        return self.lock("clusters", cluster, shared=shared)
+
+    def module(self, cluster: str, stack: str, module: str, shared: bool = False):
+        return self.lock("modules", cluster, stack, module, shared=shared)
+
+    def file(self, name: str):
+        return self.lock("files", name)
+
+    @staticmethod
+    def changes_state(terragrunt_options: list[str]) -> bool:
+        return any(o in STATE_COMMANDS for o in terragrunt_options if not o.startswith("-"))
@@ -0,0 +1,210 @@
+# skip-unchanged plan: module build fingerprint + backend state serials of module and its deps seen at last clean plan
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from pydantic import BaseModel
+
+from .graph import ModuleGraph, ModuleNode
+
+try:
+    import boto3
+except ImportError: # optional, s3 state serials are unknown without it
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# terraform writes version, terraform_version, serial, lineage first; a small head is enough
+STATE_HEAD_BYTES = 4096
+_serial_re = re.compile(r'"serial"\s*:\s*(\d+)')
+_lineage_re = re.compile(r'"lineage"\s*:\s*"([^"]*)"')
+
+
+class StateVersion(BaseModel):
+    serial: int
+    lineage: str | None = None
+
+
+def parse_state_head(head: str) -> StateVersion | None:
+    serial = _serial_re.search(head)
+    if not serial:
+        return None
+    lineage = _lineage_re.search(head)
+    return StateVersion(serial=int(serial.group(1)), lineage=lineage.group(1) if lineage else None)
+
+
+def _read_file_head(path: str) -> StateVersion | None:
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return parse_state_head(f.read(STATE_HEAD_BYTES))
+
+
+def local_state_path(sd, node: ModuleNode) -> str | None:
+    """
+    state file of module with local backend, None for other backends.
+    default local state lives in terragrunt working copy of module, asked from terragrunt
+    """
+    if (node.backend.get("name") or "local") != "local":
+        return None
+    config = node.backend.get("config") or {}
+    if config.get("path"):
+        return os.path.join(node.build_path, config["path"])
+    return os.path.join(sd.terragrunt_info(node.build_path)["WorkingDir"], "terraform.tfstate")
+
+
+def _read_s3_head(config: dict) -> StateVersion | None:
+    if boto3 is None:
+        logger.debug("boto3 not installed, s3 state serial unknown")
+        return None
+    session = boto3.session.Session(profile_name=config.get("profile"))
+    endpoint = config.get("endpoint") or (config.get("endpoints") or {}).get("s3")
+    client = session.client("s3", region_name=config.get("region"), endpoint_url=endpoint)
+    try:
+        obj = client.get_object(Bucket=config["bucket"], Key=config["key"], Range=f"bytes=0-{STATE_HEAD_BYTES - 1}")
+    except client.exceptions.NoSuchKey:
+        return None
+    return parse_state_head(obj["Body"].read().decode())
+
+
+def read_state_version(sd, node: ModuleNode, path: str | None = None) -> StateVersion | None:
+    """
+    serial and lineage of module state from backend built by Backend.build,
+    None when unknown. path is local state file when already known
+    """
+    name = node.backend.get("name") or "local"
+    config = node.backend.get("config") or {}
+    try:
+        if name == "local":
+            path = path or local_state_path(sd, node)
+            return _read_file_head(path) if path else None
+        if name == "s3":
+            return _read_s3_head(config)
+    except Exception as e:
+        logger.warning(f"cannot read state serial of {node.id} from {name} backend: {e}")
+        return None
+    logger.debug(f"state serial of {name} backend is not supported")
+    return None
+
+
+class PlanRecord(BaseModel):
+    fingerprint: str
+    state: StateVersion
+    deps: dict[str, StateVersion] = {} # dependency outputs are read from their states
+    state_path: str | None = None # local state file, terragrunt is not asked for it again
+    time: float
+
+
+class PlanCache:
+    """
+    per cluster records of clean plans in .stackd/plan-state/<cluster>.json.
+    graph is the whole cluster graph, deps of modules outside of planned selection count too.
+    local state paths are resolved once per module and kept in its record
+    """
+
+    def __init__(self, sd, cluster: str, graph: ModuleGraph | None = None) -> None:
+        self.sd = sd
+        self.graph = graph
+        self.path = os.path.join(sd.dataroot, "plan-state", f"{cluster}.json")
+        self.cluster = cluster
+        self.records: dict[str, PlanRecord] = self._load()
+        self.seen: dict[str, StateVersion | None] = {}
+        self.paths: dict[str, str | None] = {}
+        self._changed: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, PlanRecord]:
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path) as f:
+            return { k: PlanRecord.parse_obj(v) for k, v in json.load(f).items() }
+
+    def _path(self, node: ModuleNode) -> str | None:
+        record = self.records.get(node.id)
+        # changed module may run in other terragrunt working copy
+        if record is not None and record.state_path and record.fingerprint == node.fingerprint:
+            return record.state_path
+        with self._lock:
+            if node.id in self.paths:
+                return self.paths[node.id]
+        try:
+            path = local_state_path(self.sd, node)
+        except Exception as e:
+            logger.warning(f"cannot find state of {node.id}: {e}")
+            path = None
+        with self._lock:
+            self.paths[node.id] = path
+        return path
+
+    def _read(self, node: ModuleNode) -> StateVersion | None:
+        state = read_state_version(self.sd, node, path=self._path(node))
+        with self._lock:
+            self.seen[node.id] = state
+        return state
+
+    def _state(self, node: ModuleNode) -> StateVersion | None:
+        with self._lock:
+            if node.id in self.seen:
+                return self.seen[node.id]
+        return self._read(node)
+
+    def _deps(self, node: ModuleNode) -> dict[str, StateVersion] | None:
+        """
+        state versions of module deps, None when any is unknown
+        """
+        nodes = self.graph.nodes if self.graph else {}
+        deps = {}
+        for d in (nodes[node.id] if node.id in nodes else node).deps:
+            state = self._state(nodes[d]) if d in nodes else None
+            if state is None:
+                return None
+            deps[d] = state
+        return deps
+
+    def unchanged(self, node: ModuleNode) -> bool:
+        record = self.records.get(node.id)
+        if record is None or node.fingerprint is None or record.fingerprint != node.fingerprint:
+            return False
+        state = self._read(node)
+        if state is None or record.state != state:
+            return False
+        # applied dependency may change outputs module plans with
+        return record.deps == self._deps(node)
+
+    def record(self, node: ModuleNode) -> None:
+        state = self._state(node)
+        deps = self._deps(node)
+        if state is None or deps is None or node.fingerprint is None:
+            return
+        path = self._path(node)
+        with self._lock:
+            self.records[node.id] = PlanRecord(fingerprint=node.fingerprint, state=state, deps=deps,
+                                               state_path=path, time=time.time())
+            self._changed.add(node.id)
+
+    def forget(self, node: ModuleNode) -> None:
+        with self._lock:
+            self.records.pop(node.id, None)
+            self._changed.add(node.id)
+
+    def save(self) -> None:
+        """
+        writes modules recorded or forgotten by this run over records saved by concurrent runs
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self.sd.locks.file(f"plan-state-{self.cluster}"):
+            records = self._load()
+            for module_id in self._changed:
+                if module_id in self.records:
+                    records[module_id] = self.records[module_id]
+                else:
+                    records.pop(module_id, None)
+            with open(tmp, "w") as f:
+                json.dump({ k: v.dict() for k, v in records.items() }, f, indent=1)
+            os.replace(tmp, self.path)
+        self.records = records
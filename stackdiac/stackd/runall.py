@@ -0,0 +1,109 @@
+# running terragrunt command across modules in dependency order
+
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+from pydantic import BaseModel
+
+from .graph import ModuleGraph, ModuleNode, StepTimings
+from .stackd import ProcessException
+
+logger = logging.getLogger(__name__)
+
+
+class ModuleRun(BaseModel):
+    id: str
+    build_path: str
+    log_file: str
+    status: str = "pending" # ok | unchanged | failed | skipped
+    returncode: int | None = None
+    duration: float = 0.0
+    error: str | None = None
+
+
+def log_path(sd, graph: ModuleGraph, node: ModuleNode) -> str:
+    return os.path.join(sd.dataroot, "logs", graph.cluster, node.stack, f"{node.module}.log")
+
+
+def run_all(sd, graph: ModuleGraph, terragrunt_options: list[str], jobs: int = 1,
+            on_finish: Callable[[ModuleRun], None] | None = None,
+            unchanged: Callable[[ModuleNode], bool] | None = None,
+            ok_returncodes: tuple[int, ...] = (0,), queue=None, **kwargs) -> list[ModuleRun]:
+    """
+    runs terragrunt in every graph module, dependencies first, up to `jobs` at once.
+    with WorkQueue modules run on workers, `jobs` limits steps queued at once.
+    dependents of failed modules are skipped, errors of a module run fail that module only.
+    modules for which `unchanged` returns True are not run.
+    destroy runs in reverse dependency order.
+    durations of successful runs are recorded to StepTimings by command
+    """
+    timings = StepTimings(sd, graph.cluster)
+    command = terragrunt_options[0] if terragrunt_options else ""
+    if "destroy" in terragrunt_options:
+        graph = graph.reversed()
+    order = graph.topological_order() # validates graph
+    runs = { i: ModuleRun(id=i, build_path=n.build_path, log_file=log_path(sd, graph, n))
+             for i, n in graph.nodes.items() }
+
+    def run(node_id: str) -> ModuleRun:
+        r = runs[node_id]
+        node = graph.nodes[node_id]
+        start = time.time()
+        if unchanged and unchanged(node):
+            r.status = "unchanged"
+            return r
+        try:
+            (queue or sd).terragrunt(r.build_path, [*terragrunt_options], log_file=r.log_file,
+                          cluster=graph.cluster, stack=node.stack, module=node.module, **kwargs)
+        except ProcessException as e:
+            if e.returncode in ok_returncodes:
+                r.status, r.returncode = "ok", e.returncode
+            else:
+                r.status, r.returncode, r.error = "failed", e.returncode, str(e)
+        except Exception as e:
+            # lock, init or os errors fail this module only
+            logger.error(f"{graph.cluster}/{node_id}: {e}", exc_info=True)
+            r.status, r.error = "failed", f"{e.__class__.__name__}: {e}"
+        else:
+            r.status, r.returncode = "ok", 0
+        r.duration = time.time() - start
+        return r
+
+    def finish(r: ModuleRun) -> None:
+        if r.status == "ok":
+            timings.record(r.id, command, r.duration)
+        if on_finish:
+            on_finish(r)
+
+    pending = list(order)
+    # cluster build dir stays unchanged between module runs
+    with sd.locks.cluster(graph.cluster, shared=True), ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        running = {}
+        while pending or running:
+            for node_id in list(pending):
+                deps = graph.nodes[node_id].deps
+                if any(runs[d].status in ("failed", "skipped") for d in deps):
+                    pending.remove(node_id)
+                    runs[node_id].status = "skipped"
+                    runs[node_id].error = "dependency failed"
+                    finish(runs[node_id])
+                elif all(runs[d].status in ("ok", "unchanged") for d in deps) and len(running) < max(jobs, 1):
+                    pending.remove(node_id)
+                    running[executor.submit(run, node_id)] = node_id
+            if not running:
+                continue
+            try:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+            except BaseException:
+                if queue is not None:
+                    queue.cancel() # threads waiting for queued steps return
+                raise
+            for future in done:
+                running.pop(future)
+                finish(future.result())
+
+    timings.save()
+    return [ runs[i] for i in order ]
@@ -1,15 +1,24 @@
 # stackd instance
 
 
+from fastapi import Depends, Request, Response
 from stackdiac.api import app as api_app
-from .stackd import Stackd, StackdModel
+from stackdiac.api.cache import etag_response
+from stackdiac.api.fields import field_selection
+from .stackd import Stackd, StackdModel, StackdSummary
 sd = Stackd()
 
 @api_app.get("/sd", response_model=StackdModel)
-async def get_sd() -> Stackd:
+async def get_sd(request: Request, fields: str | None = Depends(field_selection)) -> Response:
     s = Stackd()
     s.configure()
-    return s
+    return etag_response(request, s.fingerprint, StackdModel, lambda: s, fields=fields)
+
+@api_app.get("/sd/summary", response_model=StackdSummary)
+async def get_sd_summary() -> StackdSummary:
+    s = Stackd()
+    s.configure()
+    return s.summary()
 
 import logging
 
@@ -0,0 +1,166 @@
+# bulk export and import of module secrets of cluster
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import hvac
+from fastapi import Query
+from pydantic import BaseModel
+
+from stackdiac.api import app as api_app
+from stackdiac.api.metrics import vault_call
+from stackdiac.models.cluster import module_secret_path
+from stackdiac.models.secret import write_secret
+from stackdiac.models import validation
+
+logger = logging.getLogger(__name__)
+
+
+class ExportedSecret(BaseModel):
+    secret_type: str | None = None
+    data: dict[str, Any] = {}
+    version: int | None = None
+
+
+class SecretResult(BaseModel):
+    key: str
+    status: str  # exported, written, invalid, failed
+    version: int | None = None
+    error: str | None = None
+
+
+class SecretsDocument(BaseModel):
+    """
+    module secrets of cluster keyed by <stack>/<module>/<secret>
+    """
+    cluster: str
+    stack: str | None = None
+    secrets: dict[str, ExportedSecret] = {}
+    results: list[SecretResult] = []
+
+
+def built_modules(sd, cluster: str, stack: str | None = None) -> list[tuple[str, str]]:
+    """
+    (stack, module) of built modules of cluster, cluster is built when its build dir is missing
+    """
+    cluster_dir = os.path.join(sd.builddir, cluster)
+    if not os.path.isdir(cluster_dir):
+        sd.build(cluster=cluster, streaming=True)
+    modules = []
+    for stack_dir in sorted(os.scandir(cluster_dir), key=lambda e: e.name):
+        if not stack_dir.is_dir() or (stack and stack_dir.name != stack):
+            continue
+        for module_dir in sorted(os.scandir(stack_dir.path), key=lambda e: e.name):
+            if os.path.isfile(os.path.join(module_dir.path, "vars.tfvars.json")):
+                modules.append((stack_dir.name, module_dir.name))
+    return modules
+
+
+def export_secrets(sd, cluster: str, stack: str | None = None, jobs: int = 8) -> SecretsDocument:
+    """
+    reads every module secret of cluster (or its stack), jobs vault calls at once
+    """
+    modules = built_modules(sd, cluster, stack)
+    paths = { m: module_secret_path(sd, cluster, *m) for m in modules }
+
+    def list_module(m) -> list[str]:
+        try:
+            with vault_call("list_secrets"):
+                resp = sd.vault.kv.v2.list_secrets(path=paths[m], mount_point='kv')
+        except hvac.exceptions.InvalidPath:
+            return []
+        # nested folders are not module secrets
+        return [ f"{m[0]}/{m[1]}/{k}" for k in resp["data"]["keys"] if not k.endswith("/") ]
+
+    def read(key: str) -> tuple[str, ExportedSecret | None, SecretResult]:
+        stack_name, module_name, name = key.split("/")
+        try:
+            with vault_call("read_secret_version"):
+                resp = sd.vault.kv.v2.read_secret_version(path=f"{paths[(stack_name, module_name)]}/{name}", mount_point='kv')
+        except Exception as e:
+            logger.error(f"export {cluster}/{key}: {e}")
+            return key, None, SecretResult(key=key, status="failed", error=str(e))
+        metadata = resp["data"]["metadata"]
+        secret = ExportedSecret(secret_type=(metadata.get("custom_metadata") or {}).get("schema"),
+                                data=resp["data"]["data"], version=metadata["version"])
+        return key, secret, SecretResult(key=key, status="exported", version=secret.version)
+
+    document = SecretsDocument(cluster=cluster, stack=stack)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        keys = [ k for ks in executor.map(list_module, modules) for k in ks ]
+        for key, secret, result in executor.map(read, keys):
+            if secret is not None:
+                document.secrets[key] = secret
+            document.results.append(result)
+    return document
+
+
+def import_secrets(sd, document: SecretsDocument, cluster: str | None = None, stack: str | None = None,
+                   jobs: int = 8) -> list[SecretResult]:
+    """
+    writes secrets of document into cluster (document cluster by default), jobs vault calls at once.
+    secrets of modules not built in cluster fail, secrets not matching their schema are not written
+    """
+    cluster = cluster or document.cluster
+    modules = set(built_modules(sd, cluster, stack))
+    paths = {}
+    for key in document.secrets:
+        m = tuple(key.split("/")[:2])
+        if m in modules and m not in paths:
+            paths[m] = module_secret_path(sd, cluster, *m)
+    schemas = {}
+    for stack_name in { m[0] for m in paths }:
+        cluster_stack = sd.clusters[cluster].stacks[stack_name]
+        schemas[stack_name] = cluster_stack.load(sd.clusters[cluster], sd).compiled_schemas
+
+    def write(item: tuple[str, ExportedSecret]) -> SecretResult:
+        key, secret = item
+        parts = key.split("/")
+        if len(parts) != 3:
+            return SecretResult(key=key, status="failed", error="key is not <stack>/<module>/<secret>")
+        if tuple(parts[:2]) not in paths:
+            return SecretResult(key=key, status="failed", error=f"module {parts[0]}/{parts[1]} is not built in {cluster}")
+        if parts[0] in schemas and secret.secret_type:
+            try:
+                errors = schemas[parts[0]][1].errors(secret.secret_type, secret.data)
+            except KeyError as e: # secret_type of other stack
+                return SecretResult(key=key, status="invalid", error=e.args[0])
+            if errors:
+                return SecretResult(key=key, status="invalid", error="; ".join(errors))
+        try:
+            metadata = write_secret(sd.vault, f"{paths[tuple(parts[:2])]}/{parts[2]}", secret.data, secret.secret_type)
+        except Exception as e:
+            logger.error(f"import {cluster}/{key}: {e}")
+            return SecretResult(key=key, status="failed", error=str(e))
+        return SecretResult(key=key, status="written", version=metadata["version"])
+
+    selected = [ (k, s) for k, s in document.secrets.items() if not stack or k.split("/")[0] == stack ]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(write, selected))
+
+
+@api_app.get("/secrets/{cluster_name}", operation_id="export_secrets", response_model=SecretsDocument, tags=["secrets"])
+def export_cluster_secrets(cluster_name: str, stack: str | None = None,
+                           jobs: int = Query(8, ge=1, le=32)) -> SecretsDocument:
+    """
+    every module secret of cluster or its stack with data, schema and version.
+    plain def: blocking vault calls and builds run in threadpool, not on event loop
+    """
+    from .stackd import Stackd
+    sd = Stackd()
+    sd.configure(setup_kv=False)
+    return export_secrets(sd, cluster_name, stack=stack, jobs=jobs)
+
+
+@api_app.post("/secrets/{cluster_name}", operation_id="import_secrets", response_model=list[SecretResult], tags=["secrets"])
+def import_cluster_secrets(cluster_name: str, document: SecretsDocument, stack: str | None = None,
+                           jobs: int = Query(8, ge=1, le=32)) -> list[SecretResult]:
+    """
+    writes secrets of exported document into cluster, result per secret
+    """
+    from .stackd import Stackd
+    sd = Stackd()
+    sd.configure(setup_kv=False)
+    return import_secrets(sd, document, cluster=cluster_name, stack=stack, jobs=jobs)
@@ -5,9 +5,14 @@ from jinja2 import Environment, FileSystemLoader
 import time
 from urllib.parse import parse_qs, urlparse
 
-from pydantic import parse_obj_as, BaseModel
-from typing import Any, Optional, Pattern, Sequence, Tuple
+from pydantic import parse_obj_as, BaseModel, Field, PrivateAttr
+from typing import Any, Callable, Optional, Pattern, Sequence, Tuple
+import signal
 import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
 from deepmerge import always_merger
 from yamlinclude import YamlIncludeConstructor
 from yamlinclude.readers import Reader
@@ -15,10 +20,19 @@ from yamlinclude.readers import Reader
 from stackdiac import models
 from stackdiac.models.provider import Provider
 from ..models import spec
+from ..models.fingerprint import digest, data_digest
+from ..models import yamlio
+from ..models.blobstore import BlobStore
+from ..models.cluster import cluster_summary
+from ..api import metrics
+from .locks import ProjectLocks
+from .initcache import InitCache, NO_AUTO_INIT
+from .clustermap import ClusterMap
 
 import hvac
 
 from . import filters
+from .events import EventBus
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +61,9 @@ class StackdCounters(BaseModel):
         return f"clusters: {self.clusters} stacks: {self.stacks} modules: {self.modules} time: {self.time:.4f}s"
     
 class ProcessException(Exception):
-    pass
+    def __init__(self, message, returncode: int | None = None) -> None:
+        super().__init__(message)
+        self.returncode = returncode
 
 class StackdModel(BaseModel):
     conf: models.ConfigModel | None = None
@@ -56,6 +72,121 @@ class StackdModel(BaseModel):
     providers: dict[str, models.Provider] = {}
 
 
+class StackdSummary(BaseModel):
+    project: str | None = None
+    root: str
+    repos: list[str] = []
+    providers: list[str] = []
+    clusters: list[models.cluster.ClusterSummary] = []
+
+
+class IncludeCache:
+    """
+    parsed include files keyed by resolved path, checked against mtime and size
+    of the file and of files it includes itself. cached trees are shared between
+    every !include of the file and must not be mutated.
+    least recently used files are dropped above maxsize
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, tuple[list[tuple[str, int, int]], Any, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    @staticmethod
+    def _stat(path: str) -> tuple[str, int, int]:
+        st = os.stat(path)
+        return path, st.st_mtime_ns, st.st_size
+
+    def _fresh(self, stats: list[tuple[str, int, int]]) -> bool:
+        try:
+            return all(self._stat(s[0]) == s for s in stats)
+        except OSError:
+            return False
+
+    def get(self, path: str, read: Callable[[], Any]) -> Any:
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._data.get(path)
+            if entry is not None and self._fresh(entry[0]):
+                self._data.move_to_end(path)
+                self.hits += 1
+                self._depend(entry[0])
+                return entry[1]
+            self.misses += 1
+
+        stats = [self._stat(path)]
+        reading = self._reading()
+        reading.append(stats)
+        try:
+            data = read()
+        finally:
+            reading.pop()
+        self._depend(stats)
+
+        with self._lock:
+            self._data[path] = (stats, data, {})
+            self._data.move_to_end(path)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return data
+
+    def fragment(self, path: str, fragment: str, data: Any, lookup: Callable[[Any, str], Any]) -> Any:
+        """
+        fragment of cached file, looked up once per file version
+        """
+        with self._lock:
+            entry = self._data.get(os.path.abspath(path))
+            if entry is None or entry[1] is not data:
+                return lookup(data, fragment)
+            if fragment not in entry[2]:
+                entry[2][fragment] = lookup(data, fragment)
+            return entry[2][fragment]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    @contextmanager
+    def track(self):
+        """
+        collects paths of files included, directly or not, while in context
+        """
+        reads: list[tuple[str, int, int]] = []
+        reading = self._reading()
+        reading.append(reads)
+        try:
+            yield reads
+        finally:
+            # nested contexts may collect equal lists, only this one is dropped
+            if reading and reading[-1] is reads:
+                reading.pop()
+            else:
+                reading[:] = [ r for r in reading if r is not reads ]
+
+    def _reading(self) -> list:
+        if not hasattr(self._local, "reading"):
+            self._local.reading = []
+        return self._local.reading
+
+    def _depend(self, stats: list[tuple[str, int, int]]) -> None:
+        # files included while parsing another file invalidate it too
+        for outer in self._reading():
+            outer.extend(s for s in stats if s not in outer)
+
+
+# plain yaml.safe_load resolves !include through first configured instance
+_default_includes = False
+_default_includes_lock = threading.Lock()
+
+
+if not hasattr(YamlIncludeConstructor, "_read_file"):
+    logger.warning("installed pyyaml-include has no _read_file, includes are parsed without cache")
+
+
 class RepoYamlIncludeConstructor(YamlIncludeConstructor):
     def __init__(self, sd, *args, **kwargs):
         self.sd = sd
@@ -69,7 +200,11 @@ class RepoYamlIncludeConstructor(YamlIncludeConstructor):
             return data[fragments[0]]
         else:
             return self.get_fragment(data[fragments[0]], "/".join(fragments[1:]))
-        
+
+    # pyyaml-include 1.x reads every included file through private _read_file,
+    # include cache is skipped when installed version has no such hook
+    def _read_file(self, path, *args, **kwargs):
+        return self.sd.include_cache.get(path, lambda: super(RepoYamlIncludeConstructor, self)._read_file(path, *args, **kwargs))
 
     def load(
             self,
@@ -81,7 +216,7 @@ class RepoYamlIncludeConstructor(YamlIncludeConstructor):
         
         data = super().load(loader, path, *args, **kwargs)
         if fragment:
-            return self.get_fragment(data, fragment)
+            return self.sd.include_cache.fragment(os.path.join(self.base_dir, path), fragment, data, self.get_fragment)
         
         return data
 
@@ -90,13 +225,67 @@ class Stackd(StackdModel):
     conf: models.Config | None = None
     counters: StackdCounters = StackdCounters()
     vault: hvac.Client | None = None
+    events: EventBus = Field(default_factory=EventBus)
+    _processes: set = PrivateAttr(default_factory=set)
+    _cancelled: bool = PrivateAttr(default=False)
+    _include_cache: IncludeCache = PrivateAttr(default_factory=IncludeCache)
+    _interned_stacks: dict = PrivateAttr(default_factory=dict)
+    _blobs: BlobStore | None = PrivateAttr(default=None)
+    _locks: ProjectLocks | None = PrivateAttr(default=None)
+    _yaml_loader: type | None = PrivateAttr(default=None)
+    _artifact_mentions: dict = PrivateAttr(default_factory=dict)
 
     class Config:
         # orm_mode = True
         exceptions = True
-        exclude = {"versions", "counters", "vault"}   
+        exclude = {"versions", "counters", "vault", "events"}   
         arbitrary_types_allowed = True
 
+    @property
+    def include_cache(self) -> IncludeCache:
+        return self._include_cache
+
+    @property
+    def artifact_mentions(self) -> dict:
+        """
+        optional artifact names mentioned by dir, see mentioned_artifacts. cleared by every build
+        """
+        return self._artifact_mentions
+
+    @property
+    def yaml_loader(self) -> type:
+        """
+        safe loader resolving !include through this instance
+        """
+        return self._yaml_loader or yamlio.SafeLoader
+
+    @property
+    def blobs(self) -> BlobStore:
+        """
+        content addressed store of build artifacts, build dir files are links to it
+        """
+        root = os.path.join(self.cacheroot, "blobs")
+        if self._blobs is None or self._blobs.root != root:
+            self._blobs = BlobStore(root)
+        return self._blobs
+
+    @property
+    def locks(self) -> ProjectLocks:
+        """
+        advisory locks shared with other stackd processes on this project
+        """
+        root = os.path.join(self.dataroot, "locks")
+        if self._locks is None or self._locks.root != root:
+            self._locks = ProjectLocks(root)
+        return self._locks
+
+    @property
+    def interned_stacks(self) -> dict:
+        """
+        shared stack spec text and schemas by stack spec path, see Stack.intern
+        """
+        return self._interned_stacks
+
     @property
     def dns_zone(self) -> str:
         return self.conf.project.domain
@@ -109,6 +298,23 @@ class Stackd(StackdModel):
         else:
             logger.debug("don't forget to run configure()")
 
+    def parse_cluster(self, filename: str) -> models.Cluster:
+        """
+        parses cluster file from clusters dir
+        """
+        cname = os.path.splitext(filename)[0]
+        return spec.Spec(path=os.path.join(self.conf.clusters_dir, filename),
+                jinja_env=self.get_jinja_env(self.conf.clusters_dir), 
+                merge_from={'name': cname}).parse_obj_as(models.Cluster, stackd=self)
+
+    def load_cluster(self, filename: str) -> models.Cluster:
+        """
+        parses cluster file from clusters dir into self.clusters
+        """
+        cname = os.path.splitext(filename)[0]
+        self.clusters[cname] = self.parse_cluster(filename)
+        return self.clusters[cname]
+
     @property
     def builddir(self):
         return os.path.join(self.root, "build")
@@ -119,18 +325,31 @@ class Stackd(StackdModel):
         return func
   
 
-    def configure(self):
-        
+    def configure(self, setup_kv: bool = True):
+        """
+        loads project config and clusters, connects vault. setup_kv=False skips kv mount setup call
+        """
         from ..models import config
 
-        os.chdir(self.root)
-        logger.debug(f"{self} chdir to {self.root}")
+        # cwd is process wide, instances sharing root (api, jobs) never change it
+        if os.getcwd() != self.root:
+            os.chdir(self.root)
+            logger.debug(f"{self} chdir to {self.root}")
 
         self.conf = spec.Spec(path=self.config_file,
                 merge_from=models.get_initial_config(name="unconfigured", domain="example.com", 
                                                         vault_address="http://127.0.0.1:9090").dict()
                                             ).parse_obj_as(config.Config)
-        RepoYamlIncludeConstructor(sd=self).add_to_loader_class(loader_class=yaml.SafeLoader, base_dir=self.root, sd=self)
+        # specs are loaded with loader of this instance, so instances configured at once (api jobs)
+        # never resolve includes through each other
+        self._yaml_loader = yamlio.safe_loader_class()
+        RepoYamlIncludeConstructor.add_to_loader_class(loader_class=self._yaml_loader, base_dir=self.root, sd=self)
+        global _default_includes
+        with _default_includes_lock:
+            if not _default_includes:
+                for loader_class in yamlio.SAFE_LOADERS:
+                    RepoYamlIncludeConstructor.add_to_loader_class(loader_class=loader_class, base_dir=self.root, sd=self)
+                _default_includes = True
         try:
             self.vault = hvac.Client(url=self.conf.vars['vault_address'],
                                     token=os.environ['TF_VAR_vault_token'])
@@ -141,10 +360,11 @@ class Stackd(StackdModel):
             logger.debug(f"{self} vault configured: {self.conf.vars['vault_address']}")
 
         try:
-            self.vault.secrets.kv.v2.configure(
-                max_versions=20,
-                mount_point='kv',
-            )
+            if setup_kv:
+                self.vault.secrets.kv.v2.configure(
+                    max_versions=20,
+                    mount_point='kv',
+                )
         except Exception as e:
             logger.error(f"kv err: {e}")
 
@@ -157,16 +377,17 @@ class Stackd(StackdModel):
         #    # logger.debug(f"{self} loaded config: conf: {self.conf} \n\n data: {data} \n\n initial: {initial}\n\n")
 
         if os.path.isfile(self.resolve_path("core:versions.yaml")):
-            with open(self.resolve_path("core:versions.yaml")) as f:
-                versions_data = yaml.safe_load(f.read())
-                if self.conf.providers:
-                    versions_data = always_merger.merge(versions_data, self.conf.dict()["providers"])
-                self.providers = parse_obj_as(dict[str, models.Provider], versions_data)
-                for name, v in self.providers.items():
-                    v.name = name
+            versions_data = yamlio.load_file(self.resolve_path("core:versions.yaml"))
+            if self.conf.providers:
+                versions_data = always_merger.merge(versions_data, self.conf.dict()["providers"])
+            self.providers = parse_obj_as(dict[str, models.Provider], versions_data)
+            for name, v in self.providers.items():
+                v.name = name
                     
               #  logger.debug(f"{self} loaded providers: {self.providers}")
 
+        # clusters are indexed by file name only, each is parsed on first access
+        filenames = []
         if os.path.isdir(self.conf.clusters_dir):            
             
             for c in os.listdir(self.conf.clusters_dir):
@@ -174,11 +395,8 @@ class Stackd(StackdModel):
                 if not os.path.isfile(os.path.join(self.conf.clusters_dir, c)):
                     continue
                 
-                cname = os.path.splitext(c)[0]
-                self.clusters[cname] = spec.Spec(path=os.path.join(self.conf.clusters_dir, c),
-                        jinja_env=self.get_jinja_env(self.conf.clusters_dir), 
-                        merge_from={'name': cname}).parse_obj_as(models.Cluster, stackd=self)
-                
+                filenames.append(c)
+        self.clusters = ClusterMap(self.parse_cluster, self.conf.clusters_dir, filenames)
                     
         self.counters.reset()
      #   logger.debug(f"{self} loaded clusters: {tuple(self.clusters.keys())}")
@@ -213,6 +431,13 @@ class Stackd(StackdModel):
     def cacheroot(self):
         return os.path.join(self.dataroot, "cache")    
 
+    @property
+    def terraform_cli_config(self):
+        """
+        written by `stackd warm`, routes warmed providers to local mirror
+        """
+        return os.path.join(self.dataroot, "terraform.rc")
+
     def __str__(self):
         try:
             return f"<{self.__class__.__name__} {self.conf.project.name}>"
@@ -237,6 +462,8 @@ class Stackd(StackdModel):
 
     def build(self, **kwargs):
         self.counters.reset()
+        self.artifact_mentions.clear()
+        hits, misses = self.include_cache.hits, self.include_cache.misses
         #logger.debug("%s performing build %s", self, kwargs)
         cluster = kwargs.pop("cluster", "all")
         if cluster == "all":
@@ -246,8 +473,21 @@ class Stackd(StackdModel):
             self.clusters[cluster].build(sd=self, **kwargs)
         
         self.counters.stop()
+        self.observe_build(hits, misses)
     
         logger.info(f"{self} build {self.counters.clusters} clusters, {self.counters.stacks} stacks, {self.counters.modules} modules in {self.counters.time:.4f} seconds")
+        logger.debug(f"{self} include cache: {self.include_cache.hits} hits, {self.include_cache.misses} misses")
+
+    def observe_build(self, hits: int = 0, misses: int = 0):
+        """
+        feeds build counters and include cache lookups since hits/misses to metrics
+        """
+        metrics.BUILDS.inc()
+        metrics.BUILD_DURATION.observe(self.counters.time)
+        for kind in ("clusters", "stacks", "modules"):
+            metrics.BUILT.labels(kind=kind).inc(getattr(self.counters, kind))
+        metrics.CACHE.labels(cache="include", result="hit").inc(self.include_cache.hits - hits)
+        metrics.CACHE.labels(cache="include", result="miss").inc(self.include_cache.misses - misses)
 
     def resolve_stack_path(self, src):
         """
@@ -288,8 +528,60 @@ class Stackd(StackdModel):
     
     resolve_module_path = resolve_path
 
-    def terragrunt(self, target, terragrunt_options:list[str], **kwargs):
-        env = dict(
+    @contextmanager
+    def target_locks(self, target, terragrunt_options: list[str]):
+        """
+        shared lock of cluster build dir and module lock, exclusive for state changing commands.
+        targets outside of build dir are not locked
+        """
+        rel = os.path.relpath(os.path.abspath(target), self.builddir).split(os.sep)
+        with ExitStack() as stack:
+            if rel[0] not in (os.pardir, os.curdir):
+                stack.enter_context(self.locks.cluster(rel[0], shared=True))
+                if len(rel) == 3:
+                    stack.enter_context(self.locks.module(*rel, shared=not self.locks.changes_state(terragrunt_options)))
+            yield
+
+    def terragrunt(self, target, terragrunt_options:list[str], log_file: str | None = None, **kwargs):
+        """
+        runs terragrunt in target build dir. output goes to log_file if set
+        """
+        with self.target_locks(target, terragrunt_options):
+            # TF_DATA_DIR set by user disables init cache
+            init = None if "TF_DATA_DIR" in os.environ else self.init_cache.module(self.builddir, target)
+            if init is None:
+                self._terragrunt(target, terragrunt_options, log_file=log_file, **kwargs)
+                return
+            env = dict(TF_DATA_DIR=init.data_dir)
+            explicit_init = "init" in terragrunt_options
+            if explicit_init or not init.initialized:
+                metrics.TERRAFORM_INITS.labels(result="run").inc()
+                # modules with same providers install them into one directory, one at a time
+                with self.locks.lock("init", init.key):
+                    init.prepare()
+                    self._terragrunt(target, terragrunt_options if explicit_init else ["init", "-input=false"],
+                                     log_file=log_file, env=env, **kwargs)
+                    init.done()
+                if explicit_init:
+                    return
+            else:
+                metrics.TERRAFORM_INITS.labels(result="skipped").inc()
+                logger.debug(f"{self} {target} is initialized, skipping init")
+            with self.locks.lock("init", init.key, shared=True):
+                try:
+                    self._terragrunt(target, [*terragrunt_options, NO_AUTO_INIT], log_file=log_file, env=env, **kwargs)
+                except ProcessException as e:
+                    changes = e.returncode == 2 and "-detailed-exitcode" in terragrunt_options
+                    if not changes:
+                        init.forget() # next run inits again in case failure came from stale init
+                    raise
+
+    @property
+    def init_cache(self) -> InitCache:
+        return InitCache(os.path.join(self.cacheroot, "tf-init"))
+
+    def _terragrunt_env(self, target, env: dict[str, str] | None = None) -> dict[str, str]:
+        env = dict(env or {},
             TERRAGRUNT_WORKING_DIR=target,
             TERRAGRUNT_TFPATH=self.conf.binaries.terraform.abspath,
             TF_INPUT="false",
@@ -297,27 +589,122 @@ class Stackd(StackdModel):
             TERRAGRUNT_CACHE=os.path.join(self.cacheroot, "terragrunt-cache"),
             TF_PLUGIN_CACHE_DIR=os.path.join(self.cacheroot, "terraform-plugins"),
         )
+        if os.path.isfile(self.terraform_cli_config) and "TF_CLI_CONFIG_FILE" not in os.environ:
+            env["TF_CLI_CONFIG_FILE"] = self.terraform_cli_config
+        return env
+
+    def terragrunt_info(self, target) -> dict[str, Any]:
+        """
+        terragrunt-info of target build dir, WorkingDir is where terraform runs
+        """
+        cmd = f"{self.conf.binaries.terragrunt.abspath} terragrunt-info"
+        result = subprocess.run(cmd, shell=True, env=dict(**os.environ, **self._terragrunt_env(target)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        if result.returncode != 0:
+            raise ProcessException(f"terragrunt-info {target} failed with {result.returncode}", returncode=result.returncode)
+        return json.loads(result.stdout)
+
+    def _terragrunt(self, target, terragrunt_options:list[str], log_file: str | None = None,
+                    env: dict[str, str] | None = None, **kwargs):
+        env = self._terragrunt_env(target, env)
         opts = " ".join(terragrunt_options)
         cmd = f"{self.conf.binaries.terragrunt.abspath} {opts}"
         logger.debug(f"{self} terragrunt {target} {cmd} {env}")
 
-        process = subprocess.Popen(cmd, shell=True, env=dict(**os.environ, **env))
-        process.wait()
+        if self._cancelled:
+            raise ProcessException(f"terragrunt {target} cancelled")
+
+        if log_file:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        output = open(log_file, "w") if log_file else None
+
+        command = metrics.terragrunt_command(terragrunt_options)
+        start = time.perf_counter()
+        if not self.events.active:
+            process = subprocess.Popen(cmd, shell=True, env=dict(**os.environ, **env),
+                                       stdout=output, stderr=subprocess.STDOUT if output else None)
+            self._processes.add(process)
+            if self._cancelled: # cancelled while starting
+                self._terminate(process)
+            process.wait()
+        else:
+            # someone is listening: tee output lines to stdout and event stream.
+            # own process group lets cancel() stop the whole terragrunt/terraform tree
+            process = subprocess.Popen(cmd, shell=True, env=dict(**os.environ, **env),
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       text=True, bufsize=1, start_new_session=True)
+            self._processes.add(process)
+            if self._cancelled: # cancelled while starting
+                self._terminate(process)
+            for line in process.stdout:
+                (output or sys.stdout).write(line)
+                self.events.emit("terragrunt.output", target=target, line=line.rstrip("\n"),
+                                 **{k: kwargs[k] for k in ("cluster", "stack", "module") if k in kwargs})
+            process.wait()
+        self._processes.discard(process)
+        metrics.TERRAGRUNT_DURATION.labels(command=command).observe(time.perf_counter() - start)
+        metrics.TERRAGRUNT_RUNS.labels(command=command, returncode=process.returncode).inc()
+        if output:
+            output.close()
+        if self._cancelled:
+            raise ProcessException(f"terragrunt {target} cancelled", returncode=process.returncode)
         if process.returncode != 0:
-            raise ProcessException(f"terragrunt {target} failed with {process.returncode}")
+            raise ProcessException(f"terragrunt {target} failed with {process.returncode}", returncode=process.returncode)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        fingerprint of configuration and cluster specs, clusters are not built
+        """
+        return digest(self.conf.spec.fingerprint if self.conf and self.conf.spec else None,
+                      data_digest({ n: p.dict() for n, p in self.providers.items() }),
+                      *[ c.spec.fingerprint for c in self.clusters.values() ])
+
+    def summary(self) -> StackdSummary:
+        return StackdSummary(project=self.conf.project.name if self.conf else None, root=self.root,
+                             repos=list(self.conf.repos.keys()) if self.conf else [],
+                             providers=list(self.providers.keys()),
+                             clusters=[ cluster_summary(self, name) for name in self.clusters ])
+
+    def cancel(self):
+        """
+        stops running terragrunt processes and refuses to start new ones
+        """
+        self._cancelled = True
+        for process in list(self._processes):
+            self._terminate(process)
 
-    def run_operation(self, target, **kwargs):
+    def resume(self):
+        """
+        allows running terragrunt again after cancel(), for workers going on with next step
+        """
+        self._cancelled = False
+
+    def _terminate(self, process):
+        logger.info(f"{self} terminating terragrunt process {process.pid}")
+        try:
+            if os.getpgid(process.pid) == process.pid:
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.terminate()
+        except ProcessLookupError:
+            pass
+
+    def run_operation(self, target, queue=None, **kwargs):
         """
         target is in form <cluster>/<stack>/<operation>
-        running  self.terragrunt with configured module path
-    
+        running  self.terragrunt with configured module path,
+        steps run on workers when WorkQueue is given. only target cluster is built
         """
-        self.build()
         cluster, stack, operation = target.split("/")
+        self.build(cluster=cluster)
         self.clusters[cluster].stacks[stack].build(cluster=self.clusters[cluster], sd=self, **kwargs)
         
-        self.clusters[cluster].stacks[stack].stack.operations[operation].run(target=target, sd=self, 
+        op = self.clusters[cluster].stacks[stack].stack.operations[operation]
+        if op.name is None:
+            op.name = operation
+        op.run(target=target, sd=self, 
             cluster=self.clusters[cluster],
             stack=self.clusters[cluster].stacks[stack],
             cluster_stack=self.clusters[cluster].stacks[stack], # < more logical name
-            **kwargs)
+            queue=queue, **kwargs)
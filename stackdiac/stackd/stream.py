@@ -0,0 +1,64 @@
+# server-sent events endpoints streaming build and operation progress
+
+import logging
+import queue
+import threading
+from typing import Callable, Iterator
+
+from fastapi.responses import StreamingResponse
+
+from stackdiac.api import app as api_app
+from .events import Event
+from .stackd import Stackd
+
+logger = logging.getLogger(__name__)
+
+
+def stream_events(run: Callable[[Stackd], None]) -> Iterator[str]:
+    """
+    runs `run` with fresh configured Stackd in background thread
+    and yields its events in text/event-stream format
+    """
+    q: queue.Queue[Event | None] = queue.Queue()
+    sd = Stackd()
+    sd.events.subscribe(q.put)
+
+    def worker():
+        try:
+            sd.configure()
+            run(sd)
+        except Exception as e:
+            logger.error(f"streamed run failed: {e}")
+            q.put(Event(kind="error", data=dict(error=str(e))))
+        else:
+            sd.counters.stop()
+            q.put(Event(kind="done", data=dict(counters=sd.counters.dict(exclude={"start_time"}))))
+        finally:
+            q.put(None)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    while (event := q.get()) is not None:
+        yield f"event: {event.kind}\ndata: {event.json()}\n\n"
+
+
+def _sse(run: Callable[[Stackd], None]) -> StreamingResponse:
+    return StreamingResponse(stream_events(run), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@api_app.get("/stream/build/{cluster_name}", operation_id="stream_build_cluster", tags=["cluster"])
+async def stream_build_cluster(cluster_name: str) -> StreamingResponse:
+    """
+    builds cluster streaming module.build events
+    """
+    return _sse(lambda sd: sd.build(cluster=cluster_name))
+
+
+@api_app.post("/stream/operation/{cluster_name}/{stack_name}/{operation_name}", operation_id="stream_run_operation",
+              tags=["operations"])
+async def stream_run_operation(cluster_name: str, stack_name: str, operation_name: str) -> StreamingResponse:
+    """
+    runs stack operation streaming build, step and terragrunt output events
+    """
+    return _sse(lambda sd: sd.run_operation(target=f"{cluster_name}/{stack_name}/{operation_name}"))
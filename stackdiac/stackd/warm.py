@@ -0,0 +1,220 @@
+# terraform provider mirror warm-up
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "registry.terraform.io"
+DEFAULT_NAMESPACE = "hashicorp"
+
+
+def provider_address(source: str) -> tuple[str, str, str]:
+    """
+    hostname, namespace, type of provider source address
+    """
+    parts = [ p for p in source.split("/") if p ]
+    if len(parts) == 1:
+        return DEFAULT_HOST, DEFAULT_NAMESPACE, parts[0]
+    if len(parts) == 2:
+        return DEFAULT_HOST, parts[0], parts[1]
+    if len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    raise ValueError(f"invalid provider source {source}")
+
+
+def parse_version(version: str) -> tuple[int, ...]:
+    version = version.strip().lstrip("v").split("-")[0].split("+")[0]
+    return tuple(int(x) for x in version.split("."))
+
+
+def _pad(v: tuple[int, ...], n: int = 3) -> tuple[int, ...]:
+    return v + (0,) * (n - len(v))
+
+
+def version_matches(version: str, constraint: str) -> bool:
+    """
+    terraform version constraint check: =, !=, >, >=, <, <=, ~> joined by commas
+    """
+    v = _pad(parse_version(version))
+    for c in [ c.strip() for c in constraint.split(",") if c.strip() ]:
+        m = re.match(r"^(=|!=|>=|<=|>|<|~>)?\s*(\S+)$", c)
+        if not m:
+            raise ValueError(f"invalid version constraint {constraint}")
+        op, ref = m.group(1) or "=", parse_version(m.group(2))
+        r = _pad(ref)
+        if op == "=" and v != r: return False
+        if op == "!=" and v == r: return False
+        if op == ">" and not v > r: return False
+        if op == ">=" and not v >= r: return False
+        if op == "<" and not v < r: return False
+        if op == "<=" and not v <= r: return False
+        if op == "~>":
+            # rightmost given component may increment: ~> 1.2 is >= 1.2, < 2.0; ~> 1.2.3 is >= 1.2.3, < 1.3.0
+            upper = list(ref[:-1]) if len(ref) > 1 else list(ref)
+            upper[-1] += 1
+            if not (v >= r and v < _pad(tuple(upper))):
+                return False
+    return True
+
+
+class ProviderRequirement(BaseModel):
+    name: str
+    source: str
+    version: str # version constraint
+
+    @property
+    def address(self) -> str:
+        return "/".join(provider_address(self.source))
+
+
+class WarmResult(BaseModel):
+    requirement: ProviderRequirement
+    status: str # cached | copied | downloaded | failed
+    version: str | None = None
+    error: str | None = None
+
+
+def collect_providers(sd) -> list[ProviderRequirement]:
+    """
+    union of project providers and every module's effective providers with overrides
+    """
+    found: dict[tuple[str, str], ProviderRequirement] = {}
+
+    def add(name, source, version):
+        req = ProviderRequirement(name=name, source=source, version=version)
+        found.setdefault((req.address, req.version), req)
+
+    for name, p in sd.providers.items():
+        add(name, p.source, p.version)
+
+    for cluster in sd.clusters.values():
+        for cluster_stack in cluster.stacks.values():
+            stack = cluster_stack.load(cluster, sd)
+            for module in stack.modules.values():
+                for name, p in module.get_versions_by_name(sd).items():
+                    add(name, p.source, p.version)
+
+    return sorted(found.values(), key=lambda r: (r.address, r.version))
+
+
+class ProviderMirror:
+    """
+    filesystem mirror of terraform providers, filled from local mirror directory
+    (packed or unpacked layout) or from registry via `terraform providers mirror`
+    """
+
+    def __init__(self, sd, path: str | None = None, source: str | None = None,
+                 platform: str = "linux_amd64") -> None:
+        self.sd = sd
+        self.path = os.path.abspath(path or os.path.join(sd.cacheroot, "terraform-mirror"))
+        self.source = os.path.abspath(source) if source else None
+        self.platform = platform
+
+    def _available(self, root: str, req: ProviderRequirement) -> dict[str, str]:
+        """
+        version -> layout (packed|unpacked) found in mirror root
+        """
+        base = os.path.join(root, *provider_address(req.source))
+        if not os.path.isdir(base):
+            return {}
+        _, _, ptype = provider_address(req.source)
+        versions = {}
+        packed = re.compile(rf"^terraform-provider-{re.escape(ptype)}_(.+)_{re.escape(self.platform)}\.zip$")
+        for entry in os.listdir(base):
+            m = packed.match(entry)
+            if m:
+                versions[m.group(1)] = "packed"
+            elif os.path.isdir(os.path.join(base, entry, self.platform)):
+                versions[entry] = "unpacked"
+        return versions
+
+    def _pick(self, versions: dict[str, str], req: ProviderRequirement) -> str | None:
+        matching = [ v for v in versions if version_matches(v, req.version) ]
+        return max(matching, key=parse_version) if matching else None
+
+    def warm_one(self, req: ProviderRequirement) -> WarmResult:
+        try:
+            # `terraform providers mirror` rewrites index.json of provider, one warm per provider at once
+            with self.sd.locks.lock("warm", *provider_address(req.source)):
+                cached = self._pick(self._available(self.path, req), req)
+                if cached:
+                    return WarmResult(requirement=req, status="cached", version=cached)
+                if self.source:
+                    return self._copy(req)
+                return self._download(req)
+        except Exception as e:
+            logger.error(f"warming {req.address} {req.version} failed: {e}")
+            return WarmResult(requirement=req, status="failed", error=str(e))
+
+    def _copy(self, req: ProviderRequirement) -> WarmResult:
+        available = self._available(self.source, req)
+        version = self._pick(available, req)
+        if version is None:
+            raise ValueError(f"no version of {req.address} matching '{req.version}' in {self.source}")
+
+        src_base = os.path.join(self.source, *provider_address(req.source))
+        dest = os.path.join(self.path, *provider_address(req.source), version, self.platform)
+        tmp = dest + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        if available[version] == "unpacked":
+            shutil.copytree(os.path.join(src_base, version, self.platform), tmp)
+        else:
+            _, _, ptype = provider_address(req.source)
+            with zipfile.ZipFile(os.path.join(src_base, f"terraform-provider-{ptype}_{version}_{self.platform}.zip")) as z:
+                z.extractall(tmp)
+                for info in z.infolist():
+                    # zipfile drops permission bits
+                    mode = (info.external_attr >> 16) & 0o777
+                    if mode:
+                        os.chmod(os.path.join(tmp, info.filename), mode)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp, dest)
+        logger.info(f"copied {req.address} {version} from {self.source}")
+        return WarmResult(requirement=req, status="copied", version=version)
+
+    def _download(self, req: ProviderRequirement) -> WarmResult:
+        with tempfile.TemporaryDirectory(prefix="stackd-warm-") as tmpdir:
+            with open(os.path.join(tmpdir, "versions.tf"), "w") as f:
+                f.write(f'terraform {{\n  required_providers {{\n    {req.name} = {{\n'
+                        f'      source  = "{req.source}"\n      version = "{req.version}"\n    }}\n  }}\n}}\n')
+            process = subprocess.run([self.sd.conf.binaries.terraform.abspath, "providers", "mirror",
+                                      f"-platform={self.platform}", self.path],
+                                     cwd=tmpdir, capture_output=True, text=True)
+            if process.returncode != 0:
+                raise ValueError(process.stderr.strip() or f"terraform exited with {process.returncode}")
+        version = self._pick(self._available(self.path, req), req)
+        logger.info(f"downloaded {req.address} {version}")
+        return WarmResult(requirement=req, status="downloaded", version=version)
+
+    def warm(self, requirements: list[ProviderRequirement], jobs: int = 4) -> list[WarmResult]:
+        os.makedirs(self.path, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(self.warm_one, requirements))
+
+    def write_cli_config(self, results: list[WarmResult]) -> str:
+        """
+        terraform cli config installing warmed providers from mirror only
+        """
+        addresses = sorted({ r.requirement.address for r in results if r.status != "failed" })
+        include = ", ".join(f'"{a}"' for a in addresses)
+        config = ("provider_installation {\n"
+                  "  filesystem_mirror {\n"
+                  f'    path    = "{self.path}"\n'
+                  f"    include = [{include}]\n"
+                  "  }\n"
+                  "  direct {\n"
+                  f"    exclude = [{include}]\n"
+                  "  }\n"
+                  "}\n")
+        with open(self.sd.terraform_cli_config, "w") as f:
+            f.write(config)
+        return self.sd.terraform_cli_config
@@ -0,0 +1,307 @@
+# incremental rebuild on project file changes
+
+import logging
+import os
+import time
+from typing import Callable
+
+from pydantic import BaseModel
+
+try:
+    import inotify_simple
+except ImportError: # optional, directories are polled without it
+    inotify_simple = None
+
+logger = logging.getLogger(__name__)
+
+# directories never holding build inputs
+IGNORED_DIRS = {".git", ".stackd", "build", "__pycache__", ".terraform", ".terragrunt-cache", "node_modules"}
+# files build reads besides module sources; other changes are ignored
+INPUT_SUFFIXES = (".yaml", ".yml", ".j2", ".json")
+
+
+def _ignored_file(name: str) -> bool:
+    # editor swap and backup files
+    return name.startswith(".") or name.endswith("~") or name.endswith((".swp", ".swx", ".tmp"))
+
+
+def watch_roots(sd) -> list[str]:
+    """
+    project root and repos outside of it
+    """
+    roots = [sd.root]
+    for repo in sd.conf.repos.values():
+        path = os.path.abspath(repo.repo_dir)
+        if not any(path == r or path.startswith(r + os.sep) for r in roots) and os.path.isdir(path):
+            roots.append(path)
+    return roots
+
+
+def _walk_dirs(root: str):
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [ d for d in dirnames if d not in IGNORED_DIRS ]
+        yield dirpath
+
+
+class PollingWatcher:
+    """
+    mtime snapshots of watched trees compared every interval
+    """
+
+    def __init__(self, roots: list[str], interval: float = 0.3) -> None:
+        self.roots = roots
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for root in self.roots:
+            for dirpath in _walk_dirs(root):
+                try:
+                    entries = list(os.scandir(dirpath))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if entry.is_file() and not _ignored_file(entry.name):
+                        st = entry.stat()
+                        snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def read(self, timeout: float) -> set[str]:
+        deadline = time.time() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = { p for p in snapshot.keys() | self._snapshot.keys() if snapshot.get(p) != self._snapshot.get(p) }
+            self._snapshot = snapshot
+            if changed or time.time() >= deadline:
+                return changed
+            time.sleep(min(self.interval, max(deadline - time.time(), 0)))
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    inotify watches on every directory of watched trees, new directories are added on creation
+    """
+
+    def __init__(self, roots: list[str]) -> None:
+        f = inotify_simple.flags
+        self.mask = f.CLOSE_WRITE | f.CREATE | f.DELETE | f.MOVED_TO | f.MOVED_FROM | f.DELETE_SELF
+        self.inotify = inotify_simple.INotify()
+        self.dirs: dict[int, str] = {}
+        for root in roots:
+            for dirpath in _walk_dirs(root):
+                self._add(dirpath)
+
+    def _add(self, path: str) -> None:
+        try:
+            self.dirs[self.inotify.add_watch(path, self.mask)] = path
+        except OSError as e:
+            logger.warning(f"cannot watch {path}: {e}")
+
+    def read(self, timeout: float) -> set[str]:
+        f = inotify_simple.flags
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            base = self.dirs.get(event.wd)
+            if base is None:
+                continue
+            if event.mask & f.IGNORED:
+                self.dirs.pop(event.wd, None)
+                continue
+            path = os.path.join(base, event.name)
+            if event.mask & f.ISDIR:
+                if event.mask & (f.CREATE | f.MOVED_TO) and event.name not in IGNORED_DIRS:
+                    for dirpath in _walk_dirs(path):
+                        self._add(dirpath)
+                        changed.update(e.path for e in os.scandir(dirpath) if e.is_file() and not _ignored_file(e.name))
+                continue
+            if event.name and not _ignored_file(event.name):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        self.inotify.close()
+
+
+def make_watcher(roots: list[str], polling: bool = False):
+    if inotify_simple is None or polling:
+        if not polling:
+            logger.info("inotify_simple is not installed, polling for changes")
+        return PollingWatcher(roots)
+    return InotifyWatcher(roots)
+
+
+class Target(BaseModel):
+    """
+    part of project to rebuild, None means all stacks or modules
+    """
+    cluster: str
+    stack: str | None = None
+    module: str | None = None
+
+    def __str__(self) -> str:
+        return "/".join(p for p in (self.cluster, self.stack, self.module) if p)
+
+    def covers(self, other: "Target") -> bool:
+        return (self.cluster == other.cluster and self.stack in (None, other.stack)
+                and (self.stack is None or self.module in (None, other.module)))
+
+
+class ChangePlan(BaseModel):
+    reconfigure: bool = False
+    clusters: list[str] = [] # cluster files to reload, missing ones are dropped
+    targets: list[Target] = []
+
+    def add(self, target: Target) -> None:
+        if any(t.covers(target) for t in self.targets):
+            return
+        self.targets = [ t for t in self.targets if not target.covers(t) ] + [target]
+
+
+def plan_changes(sd, paths: set[str], index=None) -> ChangePlan:
+    """
+    maps changed files to clusters, stacks and modules to rebuild.
+    stack specs rebuild whole stack. with ReadIndex modules are found by files they read,
+    spec includes among them rebuild whole stack or cluster and other files are ignored,
+    without it project config and unknown inputs (templates, includes, versions) rebuild everything
+    """
+    plan = ChangePlan()
+    clusters_dir = os.path.abspath(sd.conf.clusters_dir)
+    vars_dir = os.path.join(sd.root, "vars")
+
+    stack_specs: dict[str, list[Target]] = {}
+    for cluster in sd.clusters.values():
+        for name, cluster_stack in cluster.stacks.items():
+            stack_specs.setdefault(os.path.abspath(cluster_stack.spec_path(sd)), []).append(
+                Target(cluster=cluster.name, stack=name))
+
+    for path in sorted(paths):
+        path = os.path.abspath(path)
+        if not path.endswith(INPUT_SUFFIXES):
+            continue
+        if path == os.path.abspath(sd.config_file):
+            plan.reconfigure = True
+        elif os.path.dirname(path) == clusters_dir:
+            filename = os.path.basename(path)
+            if filename.startswith("_"):
+                plan.reconfigure = True # shared cluster includes
+                continue
+            plan.clusters.append(filename)
+            plan.add(Target(cluster=os.path.splitext(filename)[0]))
+        elif path in stack_specs:
+            # spec may add modules, index knows only built ones
+            for t in stack_specs[path]:
+                plan.add(t)
+        elif index is not None:
+            for t in index.targets(sd, [path]):
+                plan.add(t)
+        elif path.startswith(vars_dir + os.sep):
+            parts = os.path.relpath(path, vars_dir).split(os.sep)
+            if len(parts) == 4 and parts[0] in sd.clusters:
+                plan.add(Target(cluster=parts[0], stack=parts[1], module=parts[2]))
+        else:
+            logger.debug(f"{path} is not mapped to target, rebuilding everything")
+            plan.reconfigure = True
+    return plan
+
+
+def rebuild(sd, plan: ChangePlan, index=None) -> list[Target]:
+    """
+    applies change plan to configured sd, returns rebuilt targets.
+    reads of rebuilt modules are updated in index when given
+    """
+    from .affected import ReadIndex
+
+    sd.artifact_mentions.clear()
+    if plan.reconfigure:
+        sd.clusters = {}
+        sd.configure()
+        sd.build(cluster="all", stack="all", streaming=True)
+        if index is not None:
+            index.reads = ReadIndex.from_build(sd).reads
+        return [ Target(cluster=c) for c in sd.clusters ]
+
+    for filename in plan.clusters:
+        cname = os.path.splitext(filename)[0]
+        if os.path.isfile(os.path.join(sd.conf.clusters_dir, filename)):
+            sd.load_cluster(filename)
+        else:
+            logger.info(f"cluster {cname} removed")
+            sd.clusters.pop(cname, None)
+
+    rebuilt = []
+    modules: dict[tuple[str, str], list[Target]] = {}
+    for target in plan.targets:
+        cluster = sd.clusters.get(target.cluster)
+        if cluster is None or (target.stack and target.stack not in cluster.stacks):
+            continue
+        if target.module is None:
+            cluster.build(sd=sd, stack=target.stack or "all", streaming=True)
+            rebuilt.append(target)
+        else:
+            modules.setdefault((target.cluster, target.stack), []).append(target)
+
+    # stack is loaded once for all its changed modules
+    for (cluster_name, stack_name), targets in modules.items():
+        cluster = sd.clusters[cluster_name]
+        cluster_stack = cluster.stacks[stack_name]
+        stack = cluster_stack.load(cluster, sd)
+        with sd.locks.cluster(cluster_name):
+            for target in targets:
+                module = stack.modules.get(target.module)
+                if module is None:
+                    continue
+                module.build(cluster=cluster, cluster_stack=cluster_stack, stack=stack, sd=sd)
+                if index is not None:
+                    index.reads[f"{cluster_name}/{stack.name}/{module.name}"] = \
+                        module.build_reads(cluster, cluster_stack, stack, sd)
+                rebuilt.append(target)
+
+    if index is not None:
+        for target in rebuilt:
+            if target.module is None:
+                index.update(ReadIndex.from_build(sd))
+                break
+    return rebuilt
+
+
+def watch(sd, debounce: float = 0.2, polling: bool = False,
+          on_rebuild: Callable[[list[Target], float], None] | None = None, index=None) -> None:
+    """
+    rebuilds affected targets until interrupted. changes are collected
+    until no new change arrives for debounce seconds.
+    changed files are mapped to modules by files each module build read,
+    index is taken from sd build when not given
+    """
+    from .affected import ReadIndex
+
+    if index is None:
+        index = ReadIndex.from_build(sd)
+    watcher = make_watcher(watch_roots(sd), polling=polling)
+    logger.info(f"watching {', '.join(watch_roots(sd))}")
+    try:
+        while True:
+            changed = watcher.read(timeout=1.0)
+            if not changed:
+                continue
+            while True:
+                more = watcher.read(timeout=debounce)
+                if not more:
+                    break
+                changed |= more
+            start = time.time()
+            try:
+                plan = plan_changes(sd, changed, index=index if len(index.reads) else None)
+                if not (plan.reconfigure or plan.clusters or plan.targets):
+                    continue
+                rebuilt = rebuild(sd, plan, index=index)
+            except Exception as e:
+                logger.error(f"rebuild failed: {e}")
+                continue
+            if on_rebuild:
+                on_rebuild(rebuilt, time.time() - start)
+    finally:
+        watcher.close()
@@ -0,0 +1,272 @@
+# terragrunt steps executed by worker processes through sqlite work queue
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from pydantic import BaseModel
+
+from .stackd import ProcessException
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    cluster TEXT,
+    stack TEXT,
+    module TEXT,
+    target TEXT NOT NULL,
+    options TEXT NOT NULL,
+    log_file TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    returncode INTEGER,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+"""
+
+DONE = ("ok", "failed", "cancelled")
+
+
+class Task(BaseModel):
+    id: int
+    run: str
+    cluster: str | None = None
+    stack: str | None = None
+    module: str | None = None
+    target: str
+    options: list[str]
+    log_file: str | None = None
+    status: str = "queued" # leased | ok | failed | cancelled
+    worker: str | None = None
+    lease_until: float | None = None
+    attempts: int = 0
+    returncode: int | None = None
+    error: str | None = None
+    created: float
+    started: float | None = None
+    finished: float | None = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Task":
+        return cls(**dict(dict(row), options=json.loads(row["options"])))
+
+
+class WorkQueue:
+    """
+    terragrunt steps in sqlite database, claimed by workers with expiring leases.
+    workers keep leases alive with heartbeats, steps of dead workers are claimed again
+    up to max_attempts. database may live on storage shared by hosts
+    when its filesystem supports posix locks
+    """
+
+    def __init__(self, path: str, lease: float = 60.0, poll: float = 1.0, max_attempts: int = 3) -> None:
+        self.path = path
+        self.lease = lease
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.run = uuid.uuid4().hex # steps enqueued by this instance
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @staticmethod
+    def default_path(sd) -> str:
+        return os.path.join(sd.dataroot, "queue.db")
+
+    @contextmanager
+    def _connect(self):
+        # connection per call, queue is used from coordinator threads and worker heartbeats
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def enqueue(self, target: str, options: list[str], log_file: str | None = None,
+                cluster: str | None = None, stack: str | None = None, module: str | None = None) -> int:
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO tasks (run, cluster, stack, module, target, options, log_file, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.run, cluster, stack, module, target, json.dumps(options), log_file, time.time()))
+            return cursor.lastrowid
+
+    def get(self, task_id: int) -> Task | None:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return Task.from_row(row) if row else None
+
+    def tasks(self, run: str | None = None) -> list[Task]:
+        with self._connect() as db:
+            if run:
+                rows = db.execute("SELECT * FROM tasks WHERE run = ? ORDER BY id", (run,)).fetchall()
+            else:
+                rows = db.execute("SELECT * FROM tasks ORDER BY id").fetchall()
+        return [ Task.from_row(r) for r in rows ]
+
+    def claim(self, worker: str) -> Task | None:
+        """
+        oldest queued step or step with expired lease, leased to worker
+        """
+        now = time.time()
+        with self._transaction() as db:
+            while True:
+                row = db.execute("SELECT * FROM tasks WHERE status = 'queued' "
+                                 "OR (status = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    return None
+                if row["status"] == "leased":
+                    logger.warning(f"lease of step {row['id']} held by {row['worker']} expired")
+                    if row["attempts"] >= self.max_attempts:
+                        db.execute("UPDATE tasks SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                                   (f"lease expired {row['attempts']} times", now, row["id"]))
+                        continue
+                db.execute("UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, "
+                           "attempts = attempts + 1, started = ? WHERE id = ?",
+                           (worker, now + self.lease, now, row["id"]))
+                return Task.from_row(db.execute("SELECT * FROM tasks WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, task_id: int, worker: str) -> bool:
+        """
+        extends lease, False when worker lost it (expired and claimed again, or cancelled)
+        """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                                (time.time() + self.lease, task_id, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker: str, returncode: int, error: str | None = None) -> bool:
+        """
+        stores result of leased step, results of lost leases are dropped
+        """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET status = ?, returncode = ?, error = ?, finished = ? "
+                                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                                ("ok" if returncode == 0 else "failed", returncode, error, time.time(),
+                                 task_id, worker))
+            return cursor.rowcount == 1
+
+    def release(self, task_id: int, worker: str) -> None:
+        """
+        returns unfinished step to queue, for stopping workers
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET status = 'queued', worker = NULL, lease_until = NULL "
+                       "WHERE id = ? AND worker = ? AND status = 'leased'", (task_id, worker))
+
+    def cancel(self, run: str | None = None) -> int:
+        """
+        cancels unfinished steps of run, this instance's run by default
+        """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET status = 'cancelled', finished = ? "
+                                "WHERE run = ? AND status IN ('queued', 'leased')", (time.time(), run or self.run))
+            return cursor.rowcount
+
+    def wait(self, task_id: int) -> Task:
+        while True:
+            task = self.get(task_id)
+            if task.status in DONE:
+                return task
+            time.sleep(self.poll)
+
+    def terragrunt(self, target, terragrunt_options: list[str], log_file: str | None = None, **kwargs):
+        """
+        same contract as Stackd.terragrunt, step runs on a worker.
+        raises ProcessException when step failed or was cancelled
+        """
+        names = { k: getattr(kwargs.get(k), "name", kwargs.get(k)) for k in ("cluster", "stack", "module") }
+        if log_file is None and all(names.values()):
+            log_file = os.path.join(os.path.dirname(os.path.abspath(self.path)), "logs",
+                                    names["cluster"], names["stack"], f"{names['module']}.log")
+        task_id = self.enqueue(target, [*terragrunt_options], log_file=log_file, **names)
+        logger.debug(f"queued step {task_id} terragrunt {' '.join(terragrunt_options)} in {target}")
+        task = self.wait(task_id)
+        if task.status != "ok":
+            raise ProcessException(f"terragrunt {target} {task.status} on {task.worker}"
+                                   + (f": {task.error}" if task.error else ""), returncode=task.returncode)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def work(sd, queue: WorkQueue, worker: str | None = None, once: bool = False) -> int:
+    """
+    runs claimed steps with sd until interrupted, or until queue is empty with once.
+    returns count of steps run
+    """
+    worker = worker or worker_name()
+    count = 0
+    logger.info(f"worker {worker} polling {queue.path}")
+    while True:
+        task = queue.claim(worker)
+        if task is None:
+            if once:
+                return count
+            time.sleep(queue.poll)
+            continue
+
+        logger.info(f"{worker} running step {task.id} terragrunt {' '.join(task.options)} in {task.target}")
+        stop, lost = threading.Event(), threading.Event()
+
+        def heartbeat():
+            while not stop.wait(queue.lease / 3):
+                if not queue.heartbeat(task.id, worker):
+                    # step may be claimed by another worker, it must not run twice at once
+                    logger.warning(f"{worker} lost lease of step {task.id}, terminating terragrunt")
+                    lost.set()
+                    sd.cancel()
+                    return
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        returncode, error = 0, None
+        try:
+            sd.terragrunt(task.target, task.options, log_file=task.log_file,
+                          cluster=task.cluster, stack=task.stack, module=task.module)
+        except ProcessException as e:
+            returncode, error = e.returncode if e.returncode is not None else 1, str(e)
+        except BaseException:
+            # stopped worker: terragrunt is terminated and step goes back to queue
+            sd.cancel()
+            queue.release(task.id, worker)
+            raise
+        finally:
+            stop.set()
+            beat.join()
+        if lost.is_set():
+            sd.resume()
+            logger.error(f"{worker} stopped step {task.id} after losing its lease")
+            continue
+        queue.complete(task.id, worker, returncode, error)
+        count += 1
+        log = logger.info if returncode == 0 else logger.error
+        log(f"{worker} finished step {task.id} rc={returncode}")
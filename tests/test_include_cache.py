@@ -0,0 +1,29 @@
+from stackdiac.stackd.stackd import IncludeCache
+
+
+def test_nested_track_keeps_outer_context(tmp_path):
+    cache = IncludeCache()
+    path = tmp_path / "common.yaml"
+    path.write_text("a: 1\n")
+
+    with cache.track() as outer:
+        with cache.track() as inner:
+            # both lists are empty and equal here
+            pass
+        cache.get(str(path), lambda: {"a": 1})
+
+    assert [ r[0] for r in outer ] == [str(path)]
+    assert inner == []
+    assert cache._reading() == []
+
+
+def test_changed_file_is_read_again(tmp_path):
+    cache = IncludeCache()
+    path = tmp_path / "common.yaml"
+    path.write_text("a: 1\n")
+
+    assert cache.get(str(path), lambda: 1) == 1
+    assert cache.get(str(path), lambda: 2) == 1
+    path.write_text("a: 22\n")
+    assert cache.get(str(path), lambda: 2) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
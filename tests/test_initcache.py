@@ -0,0 +1,81 @@
+import os
+
+from stackdiac.stackd.initcache import LOCK_FILE, InitCache
+
+VERSIONS = 'terraform {\n  required_providers {\n    null = { source = "hashicorp/null", version = "3.2.1" }\n  }\n}\n'
+
+
+def built_module(tmp_path, module, versions=VERSIONS, bucket="state"):
+    src = tmp_path / "modules" / "net"
+    src.mkdir(parents=True, exist_ok=True)
+    if not (src / "main.tf").exists():
+        (src / "main.tf").write_text('resource "null_resource" "x" {}\n')
+    build_path = tmp_path / "build" / "c1" / "app" / module
+    build_path.mkdir(parents=True)
+    (build_path / "_versions.tf").write_text(versions)
+    (build_path / "terragrunt.hcl").write_text(
+        f'terraform {{\n  source = "{src}"\n}}\nremote_state {{\n  backend = "s3"\n  config = {{ bucket = "{bucket}" }}\n}}\n')
+    return str(build_path)
+
+
+def stub_init(init) -> None:
+    # what terraform init leaves behind: providers in TF_DATA_DIR and lock file in build dir
+    os.makedirs(os.path.join(init.data_dir, "providers", "registry.terraform.io"), exist_ok=True)
+    with open(os.path.join(init.build_path, LOCK_FILE), "w") as f:
+        f.write("# lock\n")
+
+
+def test_init_is_reused_until_module_changes(tmp_path):
+    cache = InitCache(str(tmp_path / "tf-init"))
+    target = built_module(tmp_path, "net")
+
+    init = cache.module(str(tmp_path / "build"), target)
+    assert init.data_dir == str(tmp_path / "tf-init" / "modules" / "c1" / "app" / "net")
+    assert not init.initialized
+    init.prepare()
+    stub_init(init)
+    init.done()
+    assert cache.module(str(tmp_path / "build"), target).initialized
+
+    # module source change needs init again
+    (tmp_path / "modules" / "net" / "variables.tf").write_text('variable "x" {}\n')
+    assert not cache.module(str(tmp_path / "build"), target).initialized
+
+
+def test_providers_and_lock_file_shared_by_provider_set(tmp_path):
+    cache = InitCache(str(tmp_path / "tf-init"))
+    first = cache.module(str(tmp_path / "build"), built_module(tmp_path, "net"))
+    first.prepare()
+    stub_init(first)
+    first.done()
+
+    second = cache.module(str(tmp_path / "build"), built_module(tmp_path, "web"))
+    assert second.key == first.key
+    second.prepare()
+    assert os.path.realpath(os.path.join(second.data_dir, "providers")) == os.path.realpath(first.providers_dir)
+    assert os.path.isfile(os.path.join(second.build_path, LOCK_FILE))
+    assert not second.initialized # every module runs its own first init
+
+    other = cache.module(str(tmp_path / "build"), built_module(tmp_path, "dns", versions=VERSIONS.replace("3.2.1", "3.2.2")))
+    other.prepare()
+    assert other.key != first.key
+    assert not os.path.exists(os.path.join(other.build_path, LOCK_FILE))
+
+
+def test_backend_change_and_forget(tmp_path):
+    cache = InitCache(str(tmp_path / "tf-init"))
+    target = built_module(tmp_path, "net")
+    init = cache.module(str(tmp_path / "build"), target)
+    init.prepare()
+    stub_init(init)
+    init.done()
+
+    init.forget()
+    assert not cache.module(str(tmp_path / "build"), target).initialized
+    init.done()
+    with open(os.path.join(target, "terragrunt.hcl")) as f:
+        config = f.read()
+    with open(os.path.join(target, "terragrunt.hcl"), "w") as f:
+        f.write(config.replace('bucket = "state"', 'bucket = "other"'))
+    assert not cache.module(str(tmp_path / "build"), target).initialized
+    assert cache.module(str(tmp_path / "build"), str(tmp_path / "build" / "c1")) is None
@@ -0,0 +1,24 @@
+import threading
+
+from stackdiac.stackd.jobs import JobManager, JobStatus
+from stackdiac.stackd.stackd import Stackd
+
+
+def test_cancel_during_build_job(tmp_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def build(self, **kwargs):
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setattr(Stackd, "configure", lambda self, **kwargs: None)
+    monkeypatch.setattr(Stackd, "build", build)
+    manager = JobManager(str(tmp_path), max_workers=1)
+    job = manager.submit("build", target="c1", cluster="c1")
+    assert started.wait(5)
+    manager.cancel(job.id)
+    release.set()
+    manager._executor.shutdown(wait=True)
+
+    assert job.status == JobStatus.CANCELLED
+    assert JobManager(str(tmp_path)).jobs[job.id].status == JobStatus.CANCELLED
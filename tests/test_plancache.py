@@ -0,0 +1,83 @@
+import json
+import os
+
+from stackdiac.stackd.graph import ModuleGraph, ModuleNode
+from stackdiac.stackd.plancache import PlanCache
+from stackdiac.stackd.stackd import Stackd
+
+
+def write_state(path, serial, lineage="l1"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(dict(version=4, terraform_version="1.5.0", serial=serial, lineage=lineage), f)
+
+
+def node(tmp_path, module, deps=()):
+    return ModuleNode(id=f"app/{module}", cluster="c1", stack="app", module=module,
+                      build_path=str(tmp_path / "build" / module), deps=list(deps), fingerprint=f"fp-{module}",
+                      backend=dict(name="local", config=dict(path=str(tmp_path / "state" / f"{module}.tfstate"))))
+
+
+def test_unchanged_after_clean_plan(tmp_path):
+    sd = Stackd(root=str(tmp_path))
+    graph = ModuleGraph("c1", { n.id: n for n in [node(tmp_path, "net"), node(tmp_path, "web", ["app/net"])] })
+    write_state(str(tmp_path / "state" / "net.tfstate"), 1)
+    write_state(str(tmp_path / "state" / "web.tfstate"), 1)
+
+    cache = PlanCache(sd, "c1", graph=graph)
+    assert not cache.unchanged(graph.nodes["app/web"])
+    cache.record(graph.nodes["app/web"])
+    cache.save()
+
+    assert PlanCache(sd, "c1", graph=graph).unchanged(graph.nodes["app/web"])
+
+
+def test_applied_dependency_is_changed(tmp_path):
+    sd = Stackd(root=str(tmp_path))
+    graph = ModuleGraph("c1", { n.id: n for n in [node(tmp_path, "net"), node(tmp_path, "web", ["app/net"])] })
+    write_state(str(tmp_path / "state" / "net.tfstate"), 1)
+    write_state(str(tmp_path / "state" / "web.tfstate"), 1)
+
+    cache = PlanCache(sd, "c1", graph=graph)
+    cache.unchanged(graph.nodes["app/web"])
+    cache.record(graph.nodes["app/web"])
+    cache.save()
+
+    write_state(str(tmp_path / "state" / "net.tfstate"), 2)
+    # planned selection without app/net keeps its edge through the cluster graph
+    web = graph.select(module="web").nodes["app/web"]
+    assert not PlanCache(sd, "c1", graph=graph).unchanged(web)
+
+
+def test_unknown_dependency_state_is_changed(tmp_path):
+    sd = Stackd(root=str(tmp_path))
+    graph = ModuleGraph("c1", { n.id: n for n in [node(tmp_path, "net"), node(tmp_path, "web", ["app/net"])] })
+    write_state(str(tmp_path / "state" / "web.tfstate"), 1)
+
+    cache = PlanCache(sd, "c1", graph=graph)
+    cache.unchanged(graph.nodes["app/web"])
+    cache.record(graph.nodes["app/web"])
+    assert "app/web" not in cache.records
+
+
+def test_default_local_state_is_asked_from_terragrunt_once(tmp_path, monkeypatch):
+    sd = Stackd(root=str(tmp_path))
+    net = node(tmp_path, "net")
+    net.backend = dict(name="local")
+    graph = ModuleGraph("c1", {net.id: net})
+    # working copy deeper than download cache layout, as with //subdir sources
+    workdir = tmp_path / "cache" / "terragrunt-downloads" / "h1" / "h2" / "modules" / "net"
+    write_state(str(workdir / "terraform.tfstate"), 1)
+    asked = []
+    monkeypatch.setattr(Stackd, "terragrunt_info", lambda self, target: asked.append(target) or dict(WorkingDir=str(workdir)))
+
+    cache = PlanCache(sd, "c1", graph=graph)
+    assert not cache.unchanged(net)
+    cache.record(net)
+    cache.save()
+    assert asked == [net.build_path]
+
+    assert PlanCache(sd, "c1", graph=graph).unchanged(net)
+    write_state(str(workdir / "terraform.tfstate"), 2)
+    assert not PlanCache(sd, "c1", graph=graph).unchanged(net)
+    assert asked == [net.build_path]
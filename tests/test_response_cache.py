@@ -0,0 +1,17 @@
+from stackdiac.api import metrics
+from stackdiac.api.cache import ResponseCache
+
+
+def test_lookups_are_counted():
+    hits, misses = metrics.CACHE.labels(cache="response", result="hit"), metrics.CACHE.labels(cache="response", result="miss")
+    before = (hits.value, misses.value)
+    cache = ResponseCache(maxsize=1)
+    assert cache.get(("/clusters", "", "fp1")) is None
+    cache.put(("/clusters", "", "fp1"), b"[]")
+    assert cache.get(("/clusters", "", "fp1")) == b"[]"
+    cache.put(("/clusters", "", "fp2"), b"[]")
+    assert cache.get(("/clusters", "", "fp1")) is None
+
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert (hits.value - before[0], misses.value - before[1]) == (1, 2)
+    assert 'stackd_cache_lookups_total{cache="response",result="hit"}' in metrics.registry.render()
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import hvac
+
+from stackdiac.models import validation
+from stackdiac.stackd.secrets import ExportedSecret, SecretsDocument, export_secrets, import_secrets
+
+
+class FakeKV:
+    """
+    kv v2 engine of hvac client kept in memory: versions and custom_metadata per path
+    """
+
+    def __init__(self, denied: tuple[str, ...] = ()) -> None:
+        self.store: dict[str, dict] = {}
+        self.denied = denied
+        self._lock = threading.Lock()
+
+    def list_secrets(self, path, mount_point="kv"):
+        prefix = path.rstrip("/") + "/"
+        keys = sorted({ k[len(prefix):].split("/")[0] + ("/" if "/" in k[len(prefix):] else "")
+                        for k in self.store if k.startswith(prefix) })
+        if not keys:
+            raise hvac.exceptions.InvalidPath()
+        return dict(data=dict(keys=keys))
+
+    def _metadata(self, entry):
+        return dict(version=len(entry["versions"]), custom_metadata=entry["custom_metadata"] or None)
+
+    def read_secret_version(self, path, mount_point="kv"):
+        if path not in self.store:
+            raise hvac.exceptions.InvalidPath()
+        entry = self.store[path]
+        return dict(data=dict(data=entry["versions"][-1], metadata=self._metadata(entry)))
+
+    def create_or_update_secret(self, path, secret, mount_point="kv"):
+        if path.startswith(self.denied):
+            raise hvac.exceptions.Forbidden("permission denied")
+        with self._lock:
+            entry = self.store.setdefault(path, dict(versions=[], custom_metadata={}))
+            entry["versions"].append(dict(secret))
+        return dict(data=self._metadata(entry))
+
+    def update_metadata(self, path, custom_metadata, mount_point="kv"):
+        self.store[path]["custom_metadata"] = dict(custom_metadata)
+
+
+def fake_vault(**kwargs):
+    return SimpleNamespace(kv=SimpleNamespace(v2=FakeKV(**kwargs)))
+
+
+SCHEMA = dict(components=dict(schemas=dict(Creds=dict(
+    type="object", required=["username", "password"],
+    properties=dict(username=dict(type="string"), password=dict(type="string"))))))
+
+
+def fake_sd(tmp_path, vault, clusters):
+    """
+    project with built modules {cluster: {stack: [module]}}, secret paths in their vars.tfvars.json
+    """
+    builddir = tmp_path / "build"
+    for cluster, stacks in clusters.items():
+        for stack, modules in stacks.items():
+            for module in modules:
+                os.makedirs(builddir / cluster / stack / module)
+                with open(builddir / cluster / stack / module / "vars.tfvars.json", "w") as f:
+                    json.dump(dict(module_secret_path=f"{cluster}/module/{stack}/{module}"), f)
+    # stacks are loaded only for schema validation
+    stack = SimpleNamespace(load=lambda cluster, sd: SimpleNamespace(compiled_schemas=validation.compile_schemas(SCHEMA)))
+    return SimpleNamespace(builddir=str(builddir), dataroot=str(tmp_path / ".stackd"), vault=vault,
+                           clusters={ c: SimpleNamespace(stacks={ s: stack for s in stacks }) for c in clusters })
+
+
+def test_export_import_round_trip(tmp_path):
+    vault = fake_vault()
+    sd = fake_sd(tmp_path, vault, dict(data={"app": ["net", "web"]}, staging={"app": ["net", "web"]}))
+    kv = vault.kv.v2
+    kv.create_or_update_secret("data/module/app/web/db", dict(username="u", password="p"))
+    kv.update_metadata("data/module/app/web/db", dict(schema="Creds", owner="ops"))
+    kv.create_or_update_secret("data/module/app/net/token", dict(value="t"))
+
+    document = export_secrets(sd, "data", jobs=4)
+    assert sorted(document.secrets) == ["app/net/token", "app/web/db"]
+    assert document.secrets["app/web/db"].secret_type == "Creds"
+    assert { r.status for r in document.results } == {"exported"}
+
+    # document goes through json file as with `stackd secrets export -o`
+    document = SecretsDocument.parse_raw(document.json(exclude={"results"}))
+    results = import_secrets(sd, document, cluster="staging", jobs=4)
+    assert { r.key: (r.status, r.version) for r in results } == \
+        {"app/net/token": ("written", 1), "app/web/db": ("written", 1)}
+    assert kv.store["staging/module/app/web/db"]["versions"] == [dict(username="u", password="p")]
+    assert kv.store["staging/module/app/web/db"]["custom_metadata"] == dict(schema="Creds")
+    assert kv.store["staging/module/app/net/token"]["custom_metadata"] == {}
+
+
+def test_import_reports_invalid_secret(tmp_path):
+    vault = fake_vault()
+    sd = fake_sd(tmp_path, vault, dict(data={"app": ["web"]}))
+    document = SecretsDocument(cluster="data", secrets={
+        "app/web/db": ExportedSecret(secret_type="Creds", data=dict(username="u")),
+        "app/web/api": ExportedSecret(secret_type="Creds", data=dict(username="u", password="p")),
+        "app/web/cert": ExportedSecret(secret_type="Cert", data=dict(pem="x")),
+    })
+
+    results = { r.key: r for r in import_secrets(sd, document) }
+    assert results["app/web/db"].status == "invalid"
+    assert "password" in results["app/web/db"].error
+    assert "data/module/app/web/db" not in vault.kv.v2.store
+    assert results["app/web/api"].status == "written"
+    assert results["app/web/cert"].status == "invalid"
+    assert "Cert not found" in results["app/web/cert"].error
+
+
+def test_import_reports_failed_writes(tmp_path):
+    vault = fake_vault(denied=("data/module/app/net/",))
+    sd = fake_sd(tmp_path, vault, dict(data={"app": ["net", "web"]}))
+    document = SecretsDocument(cluster="data", secrets={
+        "app/net/token": ExportedSecret(data=dict(value="t")),
+        "app/web/token": ExportedSecret(data=dict(value="t")),
+        "app/db/token": ExportedSecret(data=dict(value="t")),
+        "token": ExportedSecret(data=dict(value="t")),
+    })
+
+    results = { r.key: r for r in import_secrets(sd, document, jobs=2) }
+    assert results["app/net/token"].status == "failed"
+    assert "permission denied" in results["app/net/token"].error
+    assert results["app/web/token"].status == "written"
+    assert results["app/db/token"].status == "failed"
+    assert "not built" in results["app/db/token"].error
+    assert results["token"].status == "failed"
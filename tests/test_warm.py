@@ -0,0 +1,77 @@
+import os
+import stat
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+
+from stackdiac.models.provider import Provider
+from stackdiac.models.stack import Module
+from stackdiac.stackd.locks import FileLocks
+from stackdiac.stackd.warm import ProviderMirror, ProviderRequirement, collect_providers, version_matches
+
+
+@pytest.mark.parametrize("version, constraint, matches", [
+    ("3.2.1", "3.2.1", True),
+    ("3.2.1", "= 3.2", False),
+    ("3.2.1", ">= 3.0, < 4.0", True),
+    ("4.0.0", ">= 3.0, < 4.0", False),
+    ("3.2.1", "!= 3.2.1", False),
+    ("1.9.0", "~> 1.2", True),
+    ("2.0.0", "~> 1.2", False),
+    ("1.2.9", "~> 1.2.3", True),
+    ("1.3.0", "~> 1.2.3", False),
+    ("v1.2.4-beta", "> 1.2.3", True),
+])
+def test_version_matches(version, constraint, matches):
+    assert version_matches(version, constraint) is matches
+
+
+def test_collect_providers_names_override_only_providers():
+    web = Module(name="web", providers=["null", "custom"],
+                 provider_overrides=dict(custom=dict(source="acme/custom", version="~> 1.0")))
+    net = Module(name="net", providers=["null"], provider_overrides=dict(null=dict(version="3.2.2")))
+    stack = SimpleNamespace(modules=dict(web=web, net=net))
+    sd = SimpleNamespace(providers=dict(null=Provider(source="hashicorp/null", version="3.2.1")),
+                         clusters=dict(c1=SimpleNamespace(stacks=dict(app=SimpleNamespace(load=lambda cluster, sd: stack)))))
+
+    assert [ (r.name, r.address, r.version) for r in collect_providers(sd) ] == [
+        ("custom", "registry.terraform.io/acme/custom", "~> 1.0"),
+        ("null", "registry.terraform.io/hashicorp/null", "3.2.1"),
+        ("null", "registry.terraform.io/hashicorp/null", "3.2.2"),
+    ]
+
+
+def mirror(tmp_path, source):
+    sd = SimpleNamespace(cacheroot=str(tmp_path / "cache"), locks=FileLocks(str(tmp_path / "locks")))
+    return ProviderMirror(sd, path=str(tmp_path / "mirror"), source=str(source))
+
+
+def test_copy_from_packed_and_unpacked_layouts(tmp_path):
+    source = tmp_path / "source"
+    null = source / "registry.terraform.io" / "hashicorp" / "null"
+    null.mkdir(parents=True)
+    for version in ("3.1.0", "3.2.1"):
+        with zipfile.ZipFile(null / f"terraform-provider-null_{version}_linux_amd64.zip", "w") as z:
+            info = zipfile.ZipInfo(f"terraform-provider-null_v{version}")
+            info.external_attr = (stat.S_IFREG | 0o755) << 16
+            z.writestr(info, "binary")
+    random = source / "registry.terraform.io" / "hashicorp" / "random" / "3.5.1" / "linux_amd64"
+    random.mkdir(parents=True)
+    (random / "terraform-provider-random_v3.5.1").write_text("binary")
+
+    provider_mirror = mirror(tmp_path, source)
+    results = provider_mirror.warm([ProviderRequirement(name="null", source="hashicorp/null", version="~> 3.1"),
+                                    ProviderRequirement(name="random", source="hashicorp/random", version=">= 3.0"),
+                                    ProviderRequirement(name="null", source="null", version="3.2.1")], jobs=3)
+    assert sorted((r.requirement.name, r.status, r.version) for r in results) == [
+        ("null", "cached", "3.2.1"), ("null", "copied", "3.2.1"), ("random", "copied", "3.5.1")]
+
+    binary = tmp_path / "mirror" / "registry.terraform.io" / "hashicorp" / "null" / "3.2.1" / "linux_amd64" / "terraform-provider-null_v3.2.1"
+    assert binary.read_text() == "binary"
+    assert os.access(binary, os.X_OK)
+    assert (tmp_path / "mirror" / "registry.terraform.io" / "hashicorp" / "random" / "3.5.1" / "linux_amd64"
+            / "terraform-provider-random_v3.5.1").is_file()
+
+    missing = provider_mirror.warm([ProviderRequirement(name="null", source="hashicorp/null", version="~> 4.0")])
+    assert missing[0].status == "failed"
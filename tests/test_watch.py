@@ -0,0 +1,53 @@
+import os
+from types import SimpleNamespace
+
+from stackdiac.stackd.affected import ReadIndex
+from stackdiac.stackd.clustermap import ClusterMap
+from stackdiac.stackd.watch import Target, plan_changes
+
+
+def fake_sd(tmp_path):
+    """
+    project with cluster c1 of stack app (spec stack/app/stack.yaml including stack/app/common.yaml)
+    """
+    root = str(tmp_path)
+    for name in ("stackd.yaml", "cluster/c1.yaml", "core/versions.yaml", "stack/app/stack.yaml",
+                 "stack/app/common.yaml", "vars/c1/app/web/vars.yaml", "modules/web/main.tf"):
+        os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+        open(os.path.join(root, name), "w").close()
+    spec = os.path.join(root, "stack", "app", "stack.yaml")
+    cluster_stack = SimpleNamespace(spec_path=lambda sd: spec)
+    cluster = SimpleNamespace(name="c1", stacks=dict(app=cluster_stack))
+    clusters = ClusterMap(lambda filename: cluster, os.path.join(root, "cluster"), ["c1.yaml"])
+    return SimpleNamespace(root=root, config_file=os.path.join(root, "stackd.yaml"), clusters=clusters,
+                           conf=SimpleNamespace(clusters_dir=clusters.clusters_dir),
+                           resolve_path=lambda path: os.path.join(root, "core", "versions.yaml"))
+
+
+def built_index(sd):
+    # app was built with module web only
+    root = sd.root
+    return ReadIndex(root, {"c1/app/web": [
+        sd.config_file, os.path.join(root, "core", "versions.yaml"), os.path.join(root, "cluster", "c1.yaml"),
+        os.path.join(root, "stack", "app", "stack.yaml"), os.path.join(root, "stack", "app", "common.yaml"),
+        os.path.join(root, "vars", "c1", "app", "web", "vars.yaml"), os.path.join(root, "modules", "web", "")]})
+
+
+def test_module_added_to_spec_rebuilds_stack(tmp_path):
+    sd = fake_sd(tmp_path)
+    index = built_index(sd)
+    for spec in ("stack.yaml", "common.yaml"):
+        plan = plan_changes(sd, {os.path.join(sd.root, "stack", "app", spec)}, index=index)
+        assert plan.targets == [Target(cluster="c1", stack="app")]
+        assert not plan.reconfigure
+
+
+def test_module_files_rebuild_module(tmp_path):
+    sd = fake_sd(tmp_path)
+    index = built_index(sd)
+    plan = plan_changes(sd, {os.path.join(sd.root, "vars", "c1", "app", "web", "vars.yaml"),
+                             os.path.join(sd.root, "modules", "web", "outputs.json")}, index=index)
+    assert plan.targets == [Target(cluster="c1", stack="app", module="web")]
+
+    plan = plan_changes(sd, {os.path.join(sd.root, "cluster", "c1.yaml")}, index=index)
+    assert plan.targets == [Target(cluster="c1")]